@@ -0,0 +1,248 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+This file times the steps of an analysis on synthetic surveys generated with maclime.synthetic and compares the times
+with stored baselines. Run it from the root directory of the repository:
+
+    python -m benchmarks.run_benchmarks --sizes 1000 10000
+
+Each step is run once per repeat on a new survey, in the order of an analysis in example/main.py, and the fastest
+time is reported:
+    load: setting the results and statistics frames and parsing them
+    load_excel: reading the results and statistics files from Excel, only for surveys up to --excel-limit respondents
+    includes: evaluating the include expressions of example/my_includes.py
+    include_arrays: building include arrays with maclime.include_arrays.get_include_array and combine_include
+    get_questions: get_questions('ALL') for the graduate students
+    get_stats_comparison: the statistics of AE6 for the graduate students and their complement
+    mwu_test, fast_mwu_test: the p-value of AE6(SQ001) for the graduate students and their complement
+    figure_callbacks: make_histo and plot_impact_statistics on the AE6 statistics, drawn with the Agg backend
+    figure_files: the same figures written to PNG files with maclime.figures.render_figure
+    figure_templates: the same figures written to PNG files by updating a maclime.figures.FigureTemplate, built in
+                      the first repeat
+
+Times are compared with the baselines stored in benchmarks/baselines.json for the same number of respondents, and
+steps slower than the baseline by more than the tolerance are marked. Use --save to store new baselines after a change
+that is meant to affect performance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import warnings
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+from matplotlib import pyplot as plt
+
+from maclime import synthetic
+from maclime.config import Survey, use_survey
+from maclime.figures import FigureTemplate, render_figure
+from maclime.include_arrays import combine_include, get_include_array
+from maclime.include_expressions import evaluate_includes
+from maclime.questions import get_questions
+from maclime.read_statistics import get_statistics_index
+from maclime.scoring import get_included_scores
+from maclime.utils import fast_mwu_test, mwu_test
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+SIZES = [1000, 10000, 100000, 1000000]
+STEPS = ['load', 'load_excel', 'includes', 'include_arrays', 'get_questions', 'get_stats_comparison', 'mwu_test',
+         'fast_mwu_test', 'figure_callbacks', 'figure_files',
+         'figure_templates']
+AE6 = ['AE6(SQ{:03d})'.format(i) for i in range(1, 11)]
+
+
+def _example():
+    """
+    Imports the example survey module and include expressions. The example include arrays are evaluated when
+    example.my_includes is imported, so it is imported while a small synthetic survey is active.
+    :return: The example.mhw_spring_2023 module, the include expressions and their aliases
+    """
+    from example import mhw_spring_2023
+    with use_survey(synthetic.load_survey(*synthetic.generate_survey(100, seed=0), survey=Survey())):
+        from example.my_includes import ALIASES, INCLUDES
+    return mhw_spring_2023, INCLUDES, ALIASES
+
+
+def _timed(times, step, function):
+    """
+    Runs a step and records its time if it is the fastest so far.
+    :param times: A dictionary mapping steps to their fastest time in seconds
+    :param step: The name of the step
+    :param function: A function running the step
+    :return: The value returned by the function
+    """
+    start = time.perf_counter()
+    value = function()
+    elapsed = time.perf_counter() - start
+    times[step] = min(times.get(step, elapsed), elapsed)
+    return value
+
+
+def run_size(respondents, repeat=3, seed=0, categorical=False, excel_limit=10000):
+    """
+    Times every step on a synthetic survey.
+    :param respondents: The number of respondents of the synthetic survey
+    :param repeat: The number of times each step is run
+    :param seed: The seed of the synthetic survey
+    :param categorical: Whether to store answer columns as pandas Categoricals
+    :param excel_limit: The largest survey read from Excel files
+    :return: A dictionary mapping steps to their fastest time in seconds
+    """
+    example, expressions, aliases = _example()
+    results, statistics = synthetic.generate_survey(respondents, seed=seed)
+    times = {}
+    with tempfile.TemporaryDirectory() as directory:
+        results_path = os.path.join(directory, 'results.xlsx')
+        statistics_path = os.path.join(directory, 'statistics.xlsx')
+        template = FigureTemplate(directory)
+        if respondents <= excel_limit:
+            synthetic.write_survey(results, statistics, results_path, statistics_path)
+        for _ in range(repeat):
+            if respondents <= excel_limit:
+                _timed(times, 'load_excel', lambda: _load_excel(results_path, statistics_path, categorical))
+            survey = _timed(times, 'load', lambda: _load(results, statistics, categorical))
+            survey.set_value_dict_callback(example.get_value_dict)
+            survey.set_population(2 * respondents)
+            with use_survey(survey):
+                includes = _timed(times, 'includes', lambda: evaluate_includes(expressions, aliases))
+                _timed(times, 'include_arrays', _include_arrays)
+                include = includes['inc_grad']
+                _timed(times, 'get_questions', lambda: get_questions(include, 'ALL'))
+                frame = _timed(times, 'get_stats_comparison', lambda: example.get_stats_comparison(AE6, include))
+                scores = get_included_scores(AE6[0], include)
+                comp_scores = get_included_scores(AE6[0], frame.attrs['include_comp'])
+                _timed(times, 'mwu_test', lambda: mwu_test(scores, comp_scores))
+                _timed(times, 'fast_mwu_test', lambda: fast_mwu_test(scores, comp_scores))
+                _timed(times, 'figure_callbacks', lambda: _figures(example, frame))
+                _timed(times, 'figure_files', lambda: _figure_files(example, frame, directory))
+                _timed(times, 'figure_templates', lambda: _figure_templates(example, frame, template))
+    return times
+
+
+def _load(results, statistics, categorical):
+    survey = synthetic.load_survey(results, statistics, categorical, survey=Survey())
+    get_statistics_index(survey)
+    return survey
+
+
+def _load_excel(results_path, statistics_path, categorical):
+    survey = Survey()
+    survey.set_results_file(io=results_path, header=0, skiprows=[1], index_col=0, categorical=categorical)
+    survey.set_statistics_file(io=statistics_path, header=None)
+    survey.get_include_all()
+    get_statistics_index(survey)
+    return survey
+
+
+def _include_arrays():
+    grad = combine_include(get_include_array('SAL1', synthetic.SCALES['level'][0]),
+                           get_include_array('SAL1', synthetic.SCALES['level'][1]))
+    employed = combine_include(*[get_include_array('SAL9(SQ{:03d})'.format(i), 'Yes') for i in range(1, 4)])
+    return combine_include(grad, employed, logic='AND')
+
+
+def _figures(example, frame):
+    with warnings.catch_warnings():
+        # plt.show() warns that the Agg backend cannot show figures.
+        warnings.simplefilter('ignore', UserWarning)
+        for complement in (False, True):
+            example.make_histo(frame, "AE6", "grads", complement=complement)
+            plt.close('all')
+            example.plot_impact_statistics(frame, complement=complement, title="AE6",
+                                           x_labels=['AE6'] * len(frame.index))
+            plt.close('all')
+
+
+def _figure_files(example, frame, directory):
+    for complement in (False, True):
+        render_figure(example.make_histo, os.path.join(directory, "histo"), frame=frame, title="AE6",
+                      description="grads", complement=complement)
+        render_figure(example.plot_impact_statistics, os.path.join(directory, "impact"), frame=frame,
+                      complement=complement, title="AE6", x_labels=['AE6'] * len(frame.index))
+
+
+def _figure_templates(example, frame, template):
+    for complement in (False, True):
+        example.make_histo(frame, "AE6", "grads", complement=complement, template=template)
+        example.plot_impact_statistics(frame, complement=complement, title="AE6", x_labels=['AE6'] * len(frame.index),
+                                       template=template)
+
+
+def environment():
+    """
+    Describes the machine and library versions the benchmarks were run with.
+    :return: A dictionary
+    """
+    return {'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__}
+
+
+def compare(times, baselines, tolerance):
+    """
+    Compares benchmark times with baselines.
+    :param times: A dictionary mapping numbers of respondents to dictionaries of step times
+    :param baselines: A dictionary of baselines in the format written by --save
+    :param tolerance: The ratio to the baseline above which a step is marked as slower
+    :return: A dataframe with a row for each size and step
+    """
+    rows = []
+    for respondents, steps in times.items():
+        stored = baselines.get('times', {}).get(str(respondents), {})
+        for step in STEPS:
+            if step not in steps:
+                continue
+            baseline = stored.get(step)
+            ratio = steps[step] / baseline if baseline else None
+            rows.append({'respondents': respondents,
+                         'step': step,
+                         'seconds': steps[step],
+                         'baseline': baseline,
+                         'ratio': ratio,
+                         'slower': ratio is not None and ratio > tolerance})
+    return pd.DataFrame(rows, columns=['respondents', 'step', 'seconds', 'baseline', 'ratio', 'slower'])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Times maclime on synthetic surveys.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="Numbers of respondents")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of each step, the fastest is reported")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic surveys")
+    parser.add_argument('--categorical', action='store_true', help="Store answer columns as Categoricals")
+    parser.add_argument('--excel-limit', type=int, default=10000, help="Largest survey read from Excel files")
+    parser.add_argument('--baselines', default=BASELINES, help="File of stored baselines")
+    parser.add_argument('--tolerance', type=float, default=1.25, help="Ratio to the baseline marked as slower")
+    parser.add_argument('--save', action='store_true', help="Store the times as the new baselines")
+    args = parser.parse_args(args)
+
+    times = {}
+    for respondents in args.sizes:
+        times[respondents] = run_size(respondents, args.repeat, args.seed, args.categorical, args.excel_limit)
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as file:
+            baselines = json.load(file)
+    with pd.option_context('display.max_rows', None, 'display.width', 120):
+        print(compare(times, baselines, args.tolerance).round(4).to_string(index=False))
+
+    if args.save:
+        stored = baselines.get('times', {})
+        stored.update({str(respondents): steps for respondents, steps in times.items()})
+        baselines = {'environment': environment(), 'times': stored}
+        with open(args.baselines, 'w') as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print("Saved baselines to {}".format(args.baselines))
+
+
+if __name__ == '__main__':
+    main()
@@ -18,10 +18,14 @@ import os
 os.chdir("..")
 from textwrap import wrap
 
-# Configure the maclime package. This must be done before importing anything from maclime.
+# Configure the maclime package. The results and statistics files are read when they are first needed.
 import maclime.config
 CONFIG = maclime.config.create_config()
-CONFIG.set_results_file(io=r"working/results/results-survey265235_2023.xls", header=0, skiprows=[1], index_col=0)
+# Parsed exports are cached here and only parsed again when the export changes.
+CONFIG.set_cache_directory(r"working/cache")
+# Answers are stored as categoricals, which uses much less memory than answer strings.
+CONFIG.set_results_file(io=r"working/results/results-survey265235_2023.xls", header=0, skiprows=[1], index_col=0,
+                        categorical=True)
 CONFIG.set_statistics_file(io=r"working/results/statistic-survey265235_2023.xls", header=None)
 CONFIG.set_population(350)
 
@@ -15,24 +15,16 @@ import pandas as pd
 from matplotlib import pyplot as plt
 from matplotlib.ticker import MaxNLocator
 
-from maclime.read_results import get_results, get_included_responses
-from maclime.questions import get_questions
+from maclime.read_results import get_included_responses
+from maclime.questions import get_question, get_questions
 
 from maclime.config import get_config
+from maclime.figures import figure_filename
 from maclime.read_statistics import get_subquestion, get_possible_answers
-from maclime.scoring import get_scored_data
-from maclime.utils import mwu_test, standard_error, fpc, get_confidence_interval
+from maclime.scoring import get_included_scores
+from maclime.utils import fast_mwu_test, standard_error, fpc, get_confidence_interval
 
-CONFIG = get_config()
-ZSCORE = CONFIG.get_zscore()
-POP = CONFIG.get_population()
-ALL_RESPONDENTS = CONFIG.get_all_respondents()
-RESULTS = get_results()
-QUESTIONS = get_questions(codes='ALL')
-INCLUDE_ALL = CONFIG.get_include_all()
-
-if not RESULTS.empty:
-    from maclime.include_arrays import *
+from maclime.include_arrays import *
 
 
 # Store dictionaries that map responses to arbitrary
@@ -148,7 +140,8 @@ def get_stats_comparison(codes,
                          description="",
                          include_other=None,
                          print_table=False,
-                         p_test=mwu_test):
+                         p_test=fast_mwu_test,
+                         confidence_interval=get_confidence_interval):
     """
     Gets the statistics for the given questions and subquestions.
     :param codes: Any number of question codes.
@@ -157,8 +150,12 @@ def get_stats_comparison(codes,
     :param description: Description of inclusion criteria.
     :param include_other: Another include array for comparison.
     :param print_table: When true, prints the table to the console.
-    :param p_test: The p-test to use. This is maclime.utils.mwu_test() by default but any callback function that takes two
-                   arrays and returns a float can be substituted.
+    :param p_test: The p-test to use. This is maclime.utils.fast_mwu_test() by default but any callback function that
+                   takes two arrays and returns a float can be substituted, such as maclime.utils.mwu_test() or a
+                   maclime.permutation.PermutationTest.
+    :param confidence_interval: The function returning the lower limit, median and upper limit of the confidence
+                                interval of some scores. This is maclime.utils.get_confidence_interval() by default
+                                but a maclime.bootstrap.Bootstrap can be substituted.
     :return: A dataframe with the statistics for the given questions and subquestions.
     """
     config = get_config()
@@ -166,7 +163,6 @@ def get_stats_comparison(codes,
     all_respondents = config.get_all_respondents()
     population = config.get_population()
     zscore = config.get_zscore()
-    questions = get_questions(codes='ALL')
     include_comp = include_other
     if not include:
         include = include_all
@@ -195,20 +191,20 @@ def get_stats_comparison(codes,
     df.attrs['complementary_respondents'] = len(include_comp)
 
     first_code = df.index[0]
-    df.attrs['question'] = questions[first_code].question
-    df.attrs['possible_answers'] = questions[first_code].possible_answers
+    first_question = get_question(first_code)
+    df.attrs['question'] = first_question.question
+    df.attrs['possible_answers'] = first_question.possible_answers
     for code in df.index.tolist():
         df.loc[code, 'subquestion'] = get_subquestion(code)
         responses = get_included_responses(code, include)
-        scores = np.array(get_scored_data(responses, code))
-        scores = [i for i in scores if not pd.isna(i)]
+        scores = get_included_scores(code, include).tolist()
         scores_inc = scores.copy()
         df.attrs['include_responses'] = responses
         df.attrs['include_scores'] = scores_inc
         if len(scores) > 1:
             df.loc[code, 'mean'] = float(np.mean(scores))
             df.loc[code, 'moe'] = float(standard_error(scores) * zscore * fpc(population, len(scores)))
-            lconf, median, hconf = get_confidence_interval(scores)
+            lconf, median, hconf = confidence_interval(scores)
             df.loc[code, 'lconf'] = float(lconf)
             df.loc[code, 'median'] = float(median)
             df.loc[code, 'hconf'] = float(hconf)
@@ -220,15 +216,14 @@ def get_stats_comparison(codes,
             df.loc[code, 'hconf'] = None
 
         responses = get_included_responses(code, include_comp)
-        scores = np.array(get_scored_data(responses, code))
-        scores = [i for i in scores if not pd.isna(i)]
+        scores = get_included_scores(code, include_comp).tolist()
         scores_comp = scores.copy()
         df.attrs['complementary_responses'] = responses
         df.attrs['complementary_scores'] = scores_comp
         if len(scores) > 1:
             df.loc[code, 'comp_mean'] = float(np.mean(scores))
             df.loc[code, 'comp_moe'] = float(standard_error(scores) * zscore * fpc(population, len(scores)))
-            lconf, median, hconf = get_confidence_interval(scores)
+            lconf, median, hconf = confidence_interval(scores)
             df.loc[code, 'comp_lconf'] = float(lconf)
             df.loc[code, 'comp_median'] = float(median)
             df.loc[code, 'comp_hconf'] = float(hconf)
@@ -254,7 +249,8 @@ def get_stats_comparison(codes,
 
 
 # This is a function used to produce a desired figure. Can be used as a callback function in analyze.
-def make_histo(frame, title, description, complement=False, save_figure=False, x_labels=None, y_label=None):
+def make_histo(frame, title, description, complement=False, save_figure=False, x_labels=None, y_label=None,
+               template=None):
     """
     Makes a histogram of the data in the given frame.
     :param frame: The frame to be plotted
@@ -264,9 +260,13 @@ def make_histo(frame, title, description, complement=False, save_figure=False, x
     :param save_figure: Whether to save the figure
     :param x_labels: The labels for the x axis
     :param y_label: The labels for the y axis
+    :param template: A maclime.figures.FigureTemplate. When given, the histogram is drawn once for each set of labels
+                     and only its bars and title are updated for each frame. The figure is written to the template's
+                     directory as <title>_<description>_histo, followed by _comp for the complement, instead of being
+                     shown.
     :return:
     """
-    plt.clf()
+    filename = figure_filename(title, description) + "_histo" + ("_comp" if complement else "")
     sample = frame.attrs['sample_size']
 
     if complement:
@@ -287,6 +287,9 @@ def make_histo(frame, title, description, complement=False, save_figure=False, x
 
     if not y_label:
         y_label = 'Respondent count'
+    if template is not None:
+        _update_histo(template, filename, data, title + "\n" + description, x_labels, y_label)
+        return
     _, ax = plt.subplots()
     arrays, __, patches = ax.hist(data,
                                   bins=[-2.5, -1.5, -0.5, 0.5, 1.5, 2.5],
@@ -315,7 +318,8 @@ def plot_impact_statistics(frame=None,
                            x_labels=None,
                            y_label=None,
                            include_sample_size=True,
-                           save_figure=False):
+                           save_figure=False,
+                           template=None):
     """
     Plots the impact statistics for the given question.
     :param frame: The impact statistics for the question
@@ -326,11 +330,17 @@ def plot_impact_statistics(frame=None,
     :param y_label: The label for the y-axis
     :param include_sample_size: Whether to include the sample size in the title
     :param save_figure: Whether to save the figure
+    :param template: A maclime.figures.FigureTemplate. When given, the bar chart is drawn once for each set of codes
+                     and only its bars, error bars, labels and title are updated for each frame. The figure is written
+                     to the template's directory as <title>_<description>_impact, followed by _comp for the
+                     complement, instead of being shown.
     :return:
     """
     if frame is None:
         raise Exception("No dataframe given.")
-    plt.clf()
+    filename = figure_filename(title, description) + "_impact" + ("_comp" if complement else "")
+    if template is None:
+        plt.clf()
     df = frame
     code = df.index[0]
 
@@ -365,11 +375,10 @@ def plot_impact_statistics(frame=None,
             y_label = ['\n'.join(textwrap.wrap(label, 10)) for label in y_label]
 
     # Add valid respondents to x_label
+    x_labels = list(x_labels)
     for i, label in enumerate(x_labels):
         question_code = df.index[i]
-        responses = get_included_responses(question_code, include)
-        scores = get_scored_data(responses, question_code)
-        valid = len(scores)
+        valid = len(get_included_scores(question_code, include))
         p_value = df['pvalue'][question_code]
         x_labels[i] += "\n {}".format(valid)
         x_labels[i] += "\n {}".format(round(p_value, 2))
@@ -386,6 +395,10 @@ def plot_impact_statistics(frame=None,
     if mean_df.dropna().values.tolist():
         # Create plot axis
         title = title + "\n" + description
+        if template is not None:
+            _update_impact_statistics(template, filename, title, mean_df, moe_df, colours, x_labels, y_label,
+                                      low_y, high_y)
+            return
         ax = mean_df.plot.bar(color=colours, title=title, yerr=moe_df, capsize=4)
         ax.set_yticks(range(low_y, high_y + 1))
         ax.set_yticklabels(y_label)
@@ -395,3 +408,111 @@ def plot_impact_statistics(frame=None,
         if save_figure:
             plt.savefig(title + ".png")
         plt.show()
+
+
+# Bins and colours of the bars of make_histo.
+HISTO_BINS = [-2.5, -1.5, -0.5, 0.5, 1.5, 2.5]
+HISTO_COLOURS = ['red', 'orange', 'yellow', '#90EE90', '#013220']
+
+
+def _build_histo(template, x_labels, y_label):
+    """
+    Draws the parts of make_histo's figure that are the same for every frame of a section.
+    :param template: A maclime.figures.FigureTemplate
+    :param x_labels: The labels for the x axis
+    :param y_label: The label for the y axis
+    :return: The figure, its axes, its bars and the labels of the bars
+    """
+    figure = template.new_figure()
+    ax = figure.subplots()
+    __, ___, patches = ax.hist([], bins=HISTO_BINS, edgecolor='black', linewidth=1, zorder=3)
+    labels = ax.bar_label(patches)
+    ax.set_xticks([-2, -1, 0, 1, 2])
+    ax.set_xticklabels(x_labels)
+    ax.grid(axis='y', zorder=0)
+    ax.set_ylabel(y_label)
+    ax.yaxis.set_major_locator(MaxNLocator(integer=True))
+    for patch, colour in zip(patches, HISTO_COLOURS):
+        patch.set_facecolor(colour)
+    return figure, ax, patches, labels
+
+
+def _update_histo(template, filename, data, title, x_labels, y_label):
+    """
+    Updates the bars and title of make_histo's figure for a section and writes it to disk.
+    :param template: A maclime.figures.FigureTemplate
+    :param filename: The name of the figure file without an extension
+    :param data: The scores
+    :param title: The title of the plot
+    :param x_labels: The labels for the x axis
+    :param y_label: The label for the y axis
+    :return:
+    """
+    figure, ax, patches, labels = template.get(('make_histo', tuple(x_labels), y_label),
+                                               lambda: _build_histo(template, x_labels, y_label))
+    counts, _ = np.histogram(data, bins=HISTO_BINS)
+    for patch, label, count in zip(patches, labels, counts):
+        patch.set_height(count)
+        label.xy = (patch.get_x() + patch.get_width() / 2, count)
+        label.set_text("{:g}".format(count))
+    ax.relim()
+    ax.autoscale_view()
+    ax.set_title(title)
+    template.save(figure, filename)
+
+
+def _build_impact_statistics(template, codes, y_label, low_y, high_y):
+    """
+    Draws the parts of plot_impact_statistics' figure that are the same for every frame of a section.
+    :param template: A maclime.figures.FigureTemplate
+    :param codes: The question codes of the bars
+    :param y_label: The labels for the y-axis
+    :param low_y: The lowest score
+    :param high_y: The highest score
+    :return: The figure, its axes and the container of its bars and error bars
+    """
+    figure = template.new_figure()
+    ax = figure.subplots()
+    positions = np.arange(len(codes))
+    bars = ax.bar(positions, np.zeros(len(codes)), width=0.5, yerr=np.zeros(len(codes)), capsize=4)
+    ax.set_xticks(positions)
+    ax.set_xlim(-0.5, len(codes) - 0.5)
+    ax.set_yticks(range(low_y, high_y + 1))
+    ax.set_yticklabels(y_label)
+    ax.set_ylim([low_y, high_y])
+    ax.tick_params(direction='in')
+    return figure, ax, bars
+
+
+def _update_impact_statistics(template, filename, title, mean_df, moe_df, colours, x_labels, y_label, low_y, high_y):
+    """
+    Updates the bars, error bars, labels and title of plot_impact_statistics' figure for a section and writes it to
+    disk.
+    :param template: A maclime.figures.FigureTemplate
+    :param filename: The name of the figure file without an extension
+    :param title: The title of the plot
+    :param mean_df: The mean of each code
+    :param moe_df: The margin of error of each code
+    :param colours: The colour of each bar
+    :param x_labels: The labels for the x-axis
+    :param y_label: The labels for the y-axis
+    :param low_y: The lowest score
+    :param high_y: The highest score
+    :return:
+    """
+    codes = tuple(mean_df.index)
+    figure, ax, bars = template.get(('plot_impact_statistics', codes, tuple(y_label), low_y, high_y),
+                                    lambda: _build_impact_statistics(template, codes, y_label, low_y, high_y))
+    means = mean_df.to_numpy(dtype=float)
+    moes = moe_df.to_numpy(dtype=float)
+    positions = np.arange(len(codes))
+    for patch, mean, colour in zip(bars.patches, means, colours):
+        patch.set_height(mean)
+        patch.set_facecolor(colour)
+    __, (low_caps, high_caps), (lines,) = bars.errorbar.lines
+    low_caps.set_data(positions, means - moes)
+    high_caps.set_data(positions, means + moes)
+    lines.set_segments([[(x, mean - moe), (x, mean + moe)] for x, mean, moe in zip(positions, means, moes)])
+    ax.set_xticklabels(x_labels, rotation=45, fontsize=5.5)
+    ax.set_title(title)
+    template.save(figure, filename)
@@ -5,22 +5,42 @@ Created on June 28, 2023
 This module contains methods which accept callback functions to perform some sort of analysis on a set of questions.
 """
 
-from maclime.include_arrays import subtract_include
-from maclime.config import get_config
+import functools
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import sysconfig
+import types
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
-CONFIG = get_config()
-INCLUDE_ALL = CONFIG.get_include_all()
+import numpy as np
+import pandas as pd
 
+from maclime.cache import file_digest, load_or_build
+from maclime.frequencies import encode_responses
+from maclime.include_arrays import IncludeSet, as_include_set, subtract_include
+from maclime.instrumentation import instrumented, timed
+from maclime.config import get_survey, initialize_worker, use_survey, worker_payload
+from maclime.scoring import count_score_levels, get_score_matrix
+from maclime.utils import (confidence_interval_from_counts, fast_mwu_test, mean_from_counts,
+                           standard_error_from_counts)
 
+
+@instrumented('analysis')
 def analyze(include, stats_callback=None, stats_args=None, include_other=None, figure_callback=None,
-            callback_args=None):
+            callback_args=None, figure_queue=None, result_store=None, survey=None):
     """
         Perform some sort of statistical analysis on a set of question codes with a set of inclusion criteria defined
         by an include array. It will perform a complementary analysis based on the complement of the include array.
         This method accepts a callback function to produce a figure if desired. It will pass the statistics dataframe
         and some arguments to the callback.
 
-        :param include: An include array of respondents.
+        :param include: An include array of respondents. Either an IncludeSet or a list of respondent IDs.
         :param include_other: Another include array for comparison.
         :param stats_callback: A callback function which is passed the include array and some arguments to return a
                                dataframe.
@@ -28,18 +48,546 @@ def analyze(include, stats_callback=None, stats_args=None, include_other=None, f
         :param figure_callback: A callback function which is passed the statistics dataframe and some arguments
                                 to produce a figure.
         :param callback_args: A dictionary of keyword arguments to pass to the figure callback function.
+        :param figure_queue: A maclime.figures.FigureQueue. When given, figures are added to the queue to be rendered
+                             headlessly instead of being drawn immediately.
+        :param result_store: A maclime.result_store.ResultStore. When given, the statistics are appended to it under
+                             the description of the statistics dataframe as the subgroup.
+        :param survey: The survey. Defaults to the current survey. The callbacks are run with it as the current survey.
         :return: A dataframe with the statistics for social perception.
         """
-    include_comp = include_other
-    if not include_comp:
-        include_comp = subtract_include(INCLUDE_ALL, include)
-    stats = stats_callback(include=include,
-                           include_other=include_comp,
-                           **stats_args)
-
-    if figure_callback:
-        figure_callback(**callback_args, complement=False, frame=stats)
-        if len(include_comp) > 0:
-            figure_callback(**callback_args, complement=True, frame=stats)
+    survey = get_survey(survey)
+    with use_survey(survey):
+        include = as_include_set(include)
+        include_comp = include_other
+        if not include_comp:
+            include_comp = subtract_include(survey.get_include_all(), include)
+        else:
+            include_comp = as_include_set(include_comp)
+        with timed("analysis.stats_callback", 'stats'):
+            stats = stats_callback(include=include,
+                                   include_other=include_comp,
+                                   **stats_args)
+        if result_store is not None:
+            result_store.write(stats)
+
+        if figure_callback and figure_queue is not None:
+            from maclime.figures import figure_filename
+            filename = figure_filename(callback_args.get('title'), callback_args.get('description'))
+            figure_queue.add(figure_callback, filename, **callback_args, complement=False, frame=stats)
+            if len(include_comp) > 0:
+                figure_queue.add(figure_callback, filename + "_comp", **callback_args, complement=True, frame=stats)
+        elif figure_callback:
+            with timed("analysis.figure_callback", 'figures'):
+                figure_callback(**callback_args, complement=False, frame=stats)
+                if len(include_comp) > 0:
+                    figure_callback(**callback_args, complement=True, frame=stats)
 
     return stats
+
+
+# Statistics returned by compare_subgroups for each subgroup and code, in the order they are reported.
+COMPARISON_STATISTICS = ['n', 'mean', 'moe', 'lconf', 'median', 'hconf',
+                         'comp_n', 'comp_mean', 'comp_moe', 'comp_lconf', 'comp_median', 'comp_hconf',
+                         'pvalue']
+
+
+def _group_statistics(levels, counts, zscore, population, confidence_interval=None):
+    """
+    Computes the statistics reported by get_stats_comparison for every group and code at once from the number of
+    respondents in each group giving each score.
+    :param levels: The sorted array of scores
+    :param counts: A group x code x score array of counts
+    :param zscore: The z-score used for the margin of error and the median confidence interval
+    :param population: The population size used for the finite population correction, or None
+    :param confidence_interval: An object whose counts_interval method replaces
+                                maclime.utils.confidence_interval_from_counts, or None
+    :return: A dictionary mapping n, mean, moe, lconf, median and hconf to group x code arrays
+    """
+    n = counts.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correction = 1.0 if population is None else np.sqrt((population - n) / (population - 1))
+    mean = mean_from_counts(levels, counts)
+    moe = standard_error_from_counts(levels, counts) * zscore * correction
+    interval = confidence_interval_from_counts if confidence_interval is None else confidence_interval.counts_interval
+    lconf, median, hconf = interval(levels, counts, zscore, population)
+    small = n <= 1
+    for statistic in (mean, moe, lconf, median, hconf):
+        statistic[small] = np.nan
+    return {'n': n, 'mean': mean, 'moe': moe, 'lconf': lconf, 'median': median, 'hconf': hconf}
+
+
+@instrumented('analysis')
+def compare_subgroups(includes, codes, include_other=None, p_test=fast_mwu_test, confidence_interval=None,
+                      survey=None):
+    """
+    Computes the statistics of get_stats_comparison for many subgroups and codes in one call. Each subgroup is
+    compared with its complement, or with include_other when it is given. Means, margins of error, medians and
+    median confidence intervals are computed for every subgroup and code at once from per-score counts.
+    A population size of None skips the finite population correction.
+
+    :param includes: A dictionary mapping subgroup names to include arrays.
+    :param codes: A list of question codes.
+    :param include_other: An include array, or a dictionary mapping subgroup names to include arrays, to compare
+                          each subgroup with instead of its complement.
+    :param p_test: A function that takes two arrays of scores and returns a p-value, or None to skip p-values.
+                   If the function has a counts_test attribute, such as maclime.utils.fast_mwu_test or a
+                   maclime.permutation.PermutationTest, that function is called once with the group x code x score
+                   counts of the subgroups and of their comparisons and the sorted scores as levels.
+    :param confidence_interval: None for the order statistic confidence interval of the median, or an object with a
+                                counts_interval method such as a maclime.bootstrap.Bootstrap of the median, which
+                                gives lconf, median and hconf for every subgroup and code in one call.
+    :param survey: The survey. Defaults to the current survey.
+    :return: A long dataframe with the columns subgroup, code, statistic and value.
+    """
+    config = get_survey(survey)
+    index = config.get_results_file().index
+    include_all = as_include_set(config.get_include_all(), index)
+    codes = list(codes)
+    names = list(includes)
+    masks = np.zeros((2 * len(names), len(index)), dtype=bool)
+    for s, name in enumerate(names):
+        include = as_include_set(includes[name], index)
+        other = include_other.get(name) if isinstance(include_other, dict) else include_other
+        if not other:
+            other = include_all - include
+        masks[s] = include.mask
+        masks[len(names) + s] = as_include_set(other, index).mask
+
+    levels, counts = count_score_levels(codes, masks, config)
+    statistics = _group_statistics(levels, counts, config.get_zscore(), config.get_population(), confidence_interval)
+    columns = {}
+    for statistic, values in statistics.items():
+        columns[statistic] = values[:len(names)]
+        columns['comp_' + statistic] = values[len(names):]
+
+    pvalue = np.full((len(names), len(codes)), np.nan)
+    counts_test = getattr(p_test, 'counts_test', None)
+    if counts_test is not None:
+        pvalue = counts_test(counts[:len(names)], counts[len(names):], levels=levels)
+    elif p_test is not None:
+        scores = get_score_matrix(codes, config)
+        for s in range(len(names)):
+            for c in range(len(codes)):
+                data = scores[masks[s], c]
+                comp = scores[masks[len(names) + s], c]
+                data = data[~np.isnan(data)].astype(np.float64)
+                comp = comp[~np.isnan(comp)].astype(np.float64)
+                if len(data) and len(comp):
+                    pvalue[s, c] = p_test(data, comp)
+    columns['pvalue'] = pvalue
+
+    values = np.stack([columns[statistic] for statistic in COMPARISON_STATISTICS], axis=-1)
+    frame = pd.DataFrame({'subgroup': np.repeat(names, len(codes) * len(COMPARISON_STATISTICS)),
+                          'code': np.tile(np.repeat(codes, len(COMPARISON_STATISTICS)), len(names)),
+                          'statistic': np.tile(COMPARISON_STATISTICS, len(names) * len(codes)),
+                          'value': values.reshape(-1)})
+    return frame
+
+
+def _run_job(mask, job):
+    """
+    Runs analyze for one subgroup and one job in a worker process.
+    :param mask: The boolean mask of the subgroup over the results file
+    :param job: A dictionary of keyword arguments for analyze
+    :return: The statistics dataframe returned by analyze
+    """
+    include = IncludeSet(mask, get_survey().get_results_file().index)
+    return analyze(include=include, **job)
+
+
+@instrumented('analysis')
+def run_analyses(includes, jobs, max_workers=None, mp_context=None, result_store=None, survey=None):
+    """
+    Runs analyze for every subgroup and job across a pool of worker processes. The survey is sent to each worker once
+    when the pool starts, or inherited when workers are forked. Callbacks in the jobs must be importable module level
+    functions so that they can be sent to the workers.
+
+    :param includes: A dictionary mapping subgroup names to include arrays.
+    :param jobs: A list of dictionaries of keyword arguments for analyze, for example stats_callback, stats_args,
+                 figure_callback and callback_args. Each job is run for every subgroup.
+    :param max_workers: The number of worker processes. Defaults to the number of processors.
+    :param mp_context: A multiprocessing context used to start the workers. Defaults to the default context.
+    :param result_store: A maclime.result_store.ResultStore. When given, the statistics of every task are appended to
+                         it under the name of the subgroup, by this process rather than by the workers.
+    :param survey: The survey. Defaults to the current survey.
+    :return: A dictionary mapping each subgroup name to the list of statistics returned for each job, in the order
+             of includes and jobs.
+    """
+    if mp_context is None:
+        mp_context = multiprocessing.get_context()
+    survey = get_survey(survey)
+    index = survey.get_results_file().index
+    masks = {name: as_include_set(include, index).mask for name, include in includes.items()}
+    tasks = [(name, job) for name in includes for job in jobs]
+    payload = worker_payload(mp_context, survey)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context, initializer=initialize_worker,
+                             initargs=(payload,)) as executor:
+        stats = list(executor.map(_run_job, [masks[name] for name, _ in tasks], [job for _, job in tasks]))
+    results = {name: [] for name in includes}
+    for (name, _), frame in zip(tasks, stats):
+        results[name].append(frame)
+        if result_store is not None:
+            result_store.write(frame, subgroup=name)
+    return results
+
+
+# Increment when the way jobs are fingerprinted changes so that every cached output is rebuilt. The pandas and numpy
+# versions are also part of every fingerprint, since statistics are cached as pickles.
+_JOB_VERSION = 1
+# Name of the survey cache of data fingerprints keyed by question code.
+_DATA_FINGERPRINTS = 'job_data_fingerprints'
+
+
+def _digest(*parts):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def callable_identity(function):
+    """
+    Returns a digest identifying a callback by its module, name and code and by the source files of the project
+    modules it depends on, see _dependency_digest, so that editing a callback or a helper it calls changes its
+    identity. Objects that are not functions are identified by fingerprint_value.
+    :param function: A function or callable object
+    :return: A hexadecimal string
+    """
+    code = getattr(function, '__code__', None)
+    wrapped = getattr(function, '__wrapped__', None)
+    if wrapped is not None:
+        return callable_identity(wrapped)
+    if code is None:
+        return fingerprint_value(function)
+    return _digest(getattr(function, '__module__', ""), getattr(function, '__qualname__', ""), _code_digest(code),
+                   fingerprint_value(function.__defaults__), fingerprint_value(function.__kwdefaults__),
+                   _dependency_digest(function))
+
+
+def _code_digest(code):
+    constants = [_code_digest(constant) if isinstance(constant, types.CodeType) else repr(constant)
+                 for constant in code.co_consts]
+    return _digest(code.co_code, constants, code.co_names)
+
+
+def _code_names(code):
+    """
+    Returns the global names used by a code object and the code objects nested in it.
+    :param code: A code object
+    :return: A set of names
+    """
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names |= _code_names(constant)
+    return names
+
+
+@functools.lru_cache(maxsize=None)
+def _library_directories():
+    paths = sysconfig.get_paths()
+    return tuple(os.path.realpath(paths[key]) + os.sep for key in ('stdlib', 'platstdlib', 'purelib', 'platlib'))
+
+
+def _project_file(obj):
+    """
+    Returns the source file of the module defining an object or of a module, unless it belongs to the standard library
+    or an installed package.
+    :param obj: A function, class or module
+    :return: The real path of the file, or None
+    """
+    module = obj if isinstance(obj, types.ModuleType) else sys.modules.get(getattr(obj, '__module__', None))
+    path = getattr(module, '__file__', None)
+    if path is None:
+        return None
+    return _project_path(path)
+
+
+@functools.lru_cache(maxsize=None)
+def _project_path(path):
+    path = os.path.realpath(path)
+    if path.startswith(_library_directories()):
+        return None
+    return path
+
+
+# Digests of source files keyed by path, with the modification time and size they were computed for.
+_FILE_DIGESTS = {}
+
+
+def _source_digest(path):
+    status = os.stat(path)
+    stamp = (status.st_mtime_ns, status.st_size)
+    if _FILE_DIGESTS.get(path, (None,))[0] != stamp:
+        _FILE_DIGESTS[path] = (stamp, file_digest(path))
+    return _FILE_DIGESTS[path][1]
+
+
+def _dependency_digest(obj):
+    """
+    Returns a digest of the source files of the project modules a function or class depends on: the module defining
+    it and, recursively, the modules defining the functions, classes and modules its code refers to by global name.
+    Modules of the standard library and installed packages are not followed.
+    :param obj: A function, method or class
+    :return: A hexadecimal string
+    """
+    files = set()
+    seen = set()
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        obj = inspect.unwrap(getattr(obj, '__func__', obj))
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        path = _project_file(obj)
+        if path is None:
+            continue
+        files.add(path)
+        if isinstance(obj, type):
+            stack.extend(value for value in vars(obj).values() if isinstance(value, types.FunctionType))
+        elif isinstance(obj, types.FunctionType):
+            for name in _code_names(obj.__code__):
+                value = obj.__globals__.get(name)
+                if isinstance(value, (types.FunctionType, type, types.ModuleType)):
+                    stack.append(value)
+    return _digest(*[_source_digest(path) for path in sorted(files)])
+
+
+def fingerprint_value(value):
+    """
+    Returns a digest of an argument of a job. Include arrays are identified by their respondents, dataframes and
+    arrays by their contents, callbacks by callable_identity, objects with attributes by their type and the state they
+    are pickled with, and other objects by their pickle.
+    :param value: The value
+    :return: A hexadecimal string
+    :raises TypeError: If the value cannot be pickled, since it could not be identified from one run to the next
+    """
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return _digest(type(value).__name__, repr(value))
+    if isinstance(value, IncludeSet):
+        return _digest('IncludeSet', value.fingerprint())
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        return _digest(type(value).__name__, pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes(),
+                       fingerprint_value(dict(value.attrs)) if hasattr(value, 'attrs') else "")
+    if isinstance(value, np.ndarray):
+        return _digest('ndarray', value.dtype, value.shape, np.ascontiguousarray(value).tobytes()
+                       if value.dtype != object else fingerprint_value(value.tolist()))
+    if isinstance(value, np.random.SeedSequence):
+        return _digest('SeedSequence', value.entropy, value.spawn_key)
+    if isinstance(value, dict):
+        items = sorted((fingerprint_value(key), fingerprint_value(item)) for key, item in value.items())
+        return _digest('dict', items)
+    if isinstance(value, (list, tuple)):
+        return _digest(type(value).__name__, [fingerprint_value(item) for item in value])
+    if isinstance(value, (set, frozenset)):
+        return _digest('set', sorted(fingerprint_value(item) for item in value))
+    if isinstance(value, (types.FunctionType, types.MethodType)):
+        return callable_identity(value)
+    if hasattr(value, '__dict__'):
+        state = value.__getstate__() if hasattr(value, '__getstate__') else vars(value)
+        return _digest(type(value).__module__, type(value).__qualname__, fingerprint_value(state),
+                       _dependency_digest(type(value)))
+    try:
+        pickled = pickle.dumps(value, protocol=4)
+    except Exception as error:
+        raise TypeError("Cannot fingerprint a job argument of type {}: {}".format(type(value).__qualname__,
+                                                                                  error)) from error
+    return _digest(type(value).__qualname__, pickled)
+
+
+def _data_fingerprint(survey, codes):
+    """
+    Returns a digest of the survey data a job reads: the responses to its codes, or the whole results file when the
+    job has no codes, and the statistics file, respondent IDs, value dictionaries, z-score and population.
+    :param survey: The survey
+    :param codes: A list of question codes, or None
+    :return: A hexadecimal string
+    """
+    fingerprints = survey.get_cache(_DATA_FINGERPRINTS)
+    if 'survey' not in fingerprints:
+        results = survey.get_results_file()
+        statistics = survey.get_statistics_file()
+        fingerprints['survey'] = _digest(
+            pd.util.hash_pandas_object(results.index).to_numpy().tobytes(),
+            fingerprint_value(statistics) if statistics is not None and not statistics.empty else "")
+    parts = [fingerprints['survey'], survey.get_zscore(), survey.get_population(), survey.get_all_respondents()]
+    if codes is None:
+        if 'results' not in fingerprints:
+            fingerprints['results'] = fingerprint_value(survey.get_results_file())
+        parts.append(fingerprints['results'])
+        parts.append(callable_identity(survey.get_value_dict_callback()))
+        return _digest(*parts)
+    for code in codes:
+        if code not in fingerprints:
+            level_codes, categories = encode_responses(code, survey)
+            fingerprints[code] = _digest(np.ascontiguousarray(level_codes).tobytes(), repr(list(categories)))
+        parts.append(fingerprints[code])
+        parts.append(fingerprint_value(survey.get_value_dict(code)))
+    return _digest(*parts)
+
+
+class JobGraph:
+    """
+    A graph of analysis jobs that only rebuilds jobs whose inputs changed. Each job computes a statistics dataframe
+    for a subgroup with analyze and, optionally, draws its figures, which depend on the statistics. A statistics job
+    is identified by a fingerprint of the survey data it reads, its include arrays, its stats callback and the
+    callback's arguments, including the codes. A figure job is identified by the fingerprint of its statistics job,
+    its figure callback and the callback's arguments. Jobs whose fingerprint matches a cached output are skipped:
+    statistics are loaded from the cache directory and figure files already written are kept, so a small edit only
+    rebuilds the jobs it affects.
+
+    Attributes:
+        cache_directory (str): The directory where statistics dataframes and the figure manifest are cached.
+        figure_directory (str): The directory figures are written to. Defaults to the directory of the figure queue.
+        formats (tuple): The file formats written for each figure. Defaults to the formats of the figure queue.
+        figure_queue: A maclime.figures.FigureQueue rendering the figures in worker processes, or None to render them
+                      in this process.
+        survey (Survey): The survey. Defaults to the current survey when the graph is run.
+        built (list): The keys of the jobs built by the last run.
+        skipped (list): The keys of the jobs skipped by the last run.
+
+    Methods:
+        add: Adds a job to the graph.
+        run: Runs every job whose output is out of date and returns the statistics of every job.
+    """
+
+    def __init__(self, cache_directory, figure_directory=".", formats=('png',), figure_queue=None, survey=None):
+        if figure_queue is not None:
+            figure_directory, formats = figure_queue.directory, figure_queue.formats
+        self.cache_directory = cache_directory
+        self.figure_directory = figure_directory
+        self.formats = tuple(formats)
+        self.figure_queue = figure_queue
+        self.survey = survey
+        self.built = []
+        self.skipped = []
+        self._jobs = OrderedDict()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def add(self, key, include, stats_callback, stats_args=None, include_other=None, figure_callback=None,
+            callback_args=None, filename=None):
+        """
+        Adds a job to the graph.
+        :param key: A name for the job, such as the subgroup and section, unique within the graph
+        :param include: An include array of respondents
+        :param stats_callback: The stats callback passed to analyze
+        :param stats_args: A dictionary of keyword arguments for the stats callback
+        :param include_other: Another include array for comparison
+        :param figure_callback: A figure callback drawing the statistics, or None
+        :param callback_args: A dictionary of keyword arguments for the figure callback
+        :param filename: The name of the figure file without an extension, relative to the figure directory.
+                         Defaults to a name made from the title and description in callback_args. Callbacks that
+                         write their own files, such as the example callbacks given a FigureTemplate, need the name
+                         they write, for example <title>_<description>_impact.
+        :return:
+        """
+        if key in self._jobs:
+            raise ValueError("The job graph already has a job named {!r}.".format(key))
+        callback_args = dict(callback_args or {})
+        if filename is None and figure_callback is not None:
+            from maclime.figures import figure_filename
+            filename = figure_filename(callback_args.get('title'), callback_args.get('description'))
+        self._jobs[key] = {'include': include,
+                           'stats_callback': stats_callback,
+                           'stats_args': dict(stats_args or {}),
+                           'include_other': include_other,
+                           'figure_callback': figure_callback,
+                           'callback_args': callback_args,
+                           'filename': filename}
+
+    def _stats_fingerprint(self, survey, job):
+        include = as_include_set(job['include'], survey=survey)
+        other = job['include_other']
+        codes = job['stats_args'].get('codes')
+        return _digest(_JOB_VERSION, pd.__version__, np.__version__,
+                       _data_fingerprint(survey, list(codes) if codes is not None else None),
+                       include.fingerprint(),
+                       fingerprint_value(as_include_set(other, survey=survey) if other else None),
+                       callable_identity(job['stats_callback']),
+                       fingerprint_value(job['stats_args']))
+
+    def _manifest_path(self):
+        return os.path.join(self.cache_directory, 'figures.json')
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path()) as file:
+                return json.load(file)
+        except (OSError, ValueError) as _:
+            return {}
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.cache_directory, exist_ok=True)
+        with open(self._manifest_path(), 'w') as file:
+            json.dump(manifest, file, indent=1, sort_keys=True)
+
+    @instrumented('analysis')
+    def run(self):
+        """
+        Runs every job whose output is out of date. The keys of the jobs built and skipped are stored in the built
+        and skipped attributes.
+        :return: A dictionary mapping each job key to its statistics dataframe, in the order the jobs were added
+        """
+        survey = get_survey(self.survey)
+        self.built, self.skipped = [], []
+        manifest = self._read_manifest()
+        figures = []
+        results = OrderedDict()
+        with use_survey(survey):
+            for key, job in self._jobs.items():
+                fingerprint = self._stats_fingerprint(survey, job)
+                rebuilt = []
+
+                def build(job=job):
+                    rebuilt.append(True)
+                    return analyze(job['include'], job['stats_callback'], job['stats_args'], job['include_other'])
+                results[key] = load_or_build(os.path.join(self.cache_directory, 'stats'), fingerprint, build)
+                figure_built = False
+                if job['figure_callback'] is not None:
+                    figure_fingerprint = _digest(fingerprint, callable_identity(job['figure_callback']),
+                                                 fingerprint_value(job['callback_args']), self.formats)
+                    path = os.path.join(self.figure_directory, job['filename'])
+                    paths = self._figure_paths(path, results[key])
+                    if manifest.get(path) != figure_fingerprint or not all(map(os.path.exists, paths)):
+                        figures.append((job, path, results[key]))
+                        manifest[path] = figure_fingerprint
+                        figure_built = True
+                (self.built if rebuilt or figure_built else self.skipped).append(key)
+            self._render(figures)
+        if figures:
+            self._write_manifest(manifest)
+        return results
+
+    def _figure_paths(self, path, stats):
+        paths = [path]
+        if len(stats.attrs.get('include_comp', [None])) > 0:
+            paths.append(path + "_comp")
+        return ["{}.{}".format(name, extension) for name in paths for extension in self.formats]
+
+    def _render(self, figures):
+        """
+        Draws the figures of the jobs that were built, with both the subgroup and its complement as analyze does.
+        :param figures: A list of tuples of a job, the path of its figure and its statistics
+        :return:
+        """
+        if not figures:
+            return
+        os.makedirs(self.figure_directory, exist_ok=True)
+        from maclime.figures import render_figure
+        for job, path, stats in figures:
+            drawings = [(path, False)]
+            if len(stats.attrs.get('include_comp', [None])) > 0:
+                drawings.append((path + "_comp", True))
+            for figure_path, complement in drawings:
+                if self.figure_queue is not None:
+                    self.figure_queue.add(job['figure_callback'], os.path.relpath(figure_path, self.figure_directory),
+                                          **job['callback_args'], complement=complement, frame=stats)
+                else:
+                    render_figure(job['figure_callback'], figure_path, self.formats, **job['callback_args'],
+                                  complement=complement, frame=stats)
+        if self.figure_queue is not None:
+            self.figure_queue.render()
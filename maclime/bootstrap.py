@@ -0,0 +1,225 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+This file computes bootstrap confidence intervals for the mean and median, which behave better than the normal and
+order statistic approximations of maclime.utils for small subgroups.
+
+Scores only take a few levels, so a sample is described by its per-level counts and resampling it with replacement
+is a multinomial draw of the same size with the observed proportions. Every resample of every subgroup and code is
+drawn in one call to numpy's multinomial, and the statistics of all resamples are computed from the resampled counts
+at once, so thousands of resamples of a whole section stay cheap.
+
+Percentile intervals and bias-corrected and accelerated (BCa) intervals are supported. The acceleration of BCa is
+estimated with the jackknife, which for per-level counts only needs one leave-one-out sample per level.
+"""
+
+import numpy as np
+from scipy.special import ndtr, ndtri
+
+from maclime.config import get_survey
+from maclime.instrumentation import instrumented
+from maclime.utils import get_level_counts, mean_from_counts, order_statistic_from_counts, seeded_generator
+
+# Largest number of resampled counts drawn at a time.
+MAX_RESAMPLED_COUNTS = 2 ** 24
+STATISTICS = ('mean', 'median')
+METHODS = ('percentile', 'bca')
+
+
+def _statistic_from_counts(statistic, levels, counts):
+    """
+    Computes a statistic from per-level counts.
+    :param statistic: 'mean' or 'median'
+    :param levels: An array of k sorted levels
+    :param counts: An array of counts with k entries on the last axis
+    :return: An array with the leading shape of counts, NaN where there is no data
+    """
+    n = counts.sum(axis=-1)
+    if statistic == 'mean':
+        return mean_from_counts(levels, counts)
+    last = np.maximum(n - 1, 0)
+    median = (order_statistic_from_counts(levels, counts, last // 2) +
+              order_statistic_from_counts(levels, counts, n // 2)) / 2
+    return np.where(n > 0, median, np.nan)
+
+
+def _quantiles(replicates, q):
+    """
+    Returns a quantile of the replicates of each element, with linear interpolation.
+    :param replicates: A resample x element array sorted along the first axis
+    :param q: An array of probabilities, one for each element
+    :return: An array of quantiles
+    """
+    position = q * (len(replicates) - 1)
+    below = np.floor(position).astype(np.intp)
+    above = np.minimum(below + 1, len(replicates) - 1)
+    low = np.take_along_axis(replicates, below[None, :], axis=0)[0]
+    high = np.take_along_axis(replicates, above[None, :], axis=0)[0]
+    return low + (position - below) * (high - low)
+
+
+def _acceleration(statistic, levels, counts):
+    """
+    Estimates the acceleration of BCa intervals with the jackknife. Leaving out any one respondent giving the same
+    level gives the same sample, so the jackknife is computed over levels weighted by their counts.
+    :param statistic: 'mean' or 'median'
+    :param levels: An array of k sorted levels
+    :param counts: An element x level array of counts
+    :return: An array of accelerations, 0 where they cannot be estimated
+    """
+    k = counts.shape[-1]
+    left_out = counts[:, None, :] - np.eye(k, dtype=counts.dtype)[None, :, :]
+    jackknife = _statistic_from_counts(statistic, levels, np.maximum(left_out, 0))
+    weights = counts.astype(np.float64)
+    n = weights.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centre = np.nansum(weights * jackknife, axis=-1, keepdims=True) / n
+        deviation = np.where(weights > 0, centre - jackknife, 0.0)
+        numerator = np.sum(weights * deviation ** 3, axis=-1)
+        denominator = 6 * np.sum(weights * deviation ** 2, axis=-1) ** 1.5
+        acceleration = numerator / denominator
+    return np.where(np.isfinite(acceleration), acceleration, 0.0)
+
+
+def bootstrap_from_counts(levels, counts, statistic='median', method='percentile', resamples=2000, confidence=0.95,
+                          rng=None):
+    """
+    Computes bootstrap confidence intervals for data described by per-level counts.
+    :param levels: An array of k sorted levels
+    :param counts: An array of counts with k entries on the last axis and any leading axes, for example
+                   subgroup x code, whose elements are resampled independently
+    :param statistic: 'mean' or 'median'
+    :param method: 'percentile' or 'bca'
+    :param resamples: The number of resamples of each element
+    :param confidence: The confidence level of the intervals
+    :param rng: A numpy Generator. Defaults to a new unseeded generator.
+    :return: Arrays of the lower limits, statistics and upper limits, NaN where there is no data
+    """
+    if statistic not in STATISTICS:
+        raise ValueError("Unknown statistic {!r}, expected one of {}.".format(statistic, STATISTICS))
+    if method not in METHODS:
+        raise ValueError("Unknown method {!r}, expected one of {}.".format(method, METHODS))
+    if rng is None:
+        rng = np.random.default_rng()
+    levels = np.asarray(levels, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.int64)
+    shape, k = counts.shape[:-1], counts.shape[-1]
+    counts = counts.reshape(-1, k)
+    n = counts.sum(axis=-1)
+    estimate = _statistic_from_counts(statistic, levels, counts)
+    lower = np.full(len(counts), np.nan)
+    upper = np.full(len(counts), np.nan)
+    z = ndtri(0.5 + np.array([-confidence, confidence]) / 2)[:, None]
+
+    valid = np.flatnonzero(n > 0)
+    chunk = max(1, MAX_RESAMPLED_COUNTS // (resamples * max(k, 1)))
+    for start in range(0, len(valid), chunk):
+        elements = valid[start:start + chunk]
+        proportions = counts[elements] / n[elements, None]
+        resampled = rng.multinomial(n[elements], proportions, size=(resamples, len(elements)))
+        replicates = np.sort(_statistic_from_counts(statistic, levels, resampled), axis=0)
+        if method == 'bca':
+            observed = estimate[elements]
+            below = np.mean(replicates < observed, axis=0) + 0.5 * np.mean(replicates == observed, axis=0)
+            bias = ndtri(np.clip(below, 0.5 / resamples, 1 - 0.5 / resamples))
+            acceleration = _acceleration(statistic, levels, counts[elements])
+            q = ndtr(bias + (bias + z) / (1 - acceleration * (bias + z)))
+        else:
+            q = np.broadcast_to(ndtr(z), (2, len(elements)))
+        lower[elements] = _quantiles(replicates, q[0])
+        upper[elements] = _quantiles(replicates, q[1])
+    return lower.reshape(shape), estimate.reshape(shape), upper.reshape(shape)
+
+
+class Bootstrap:
+    """
+    This class is a bootstrap confidence interval. Call an instance with an array of data for the same result as
+    maclime.utils.get_confidence_interval, or pass it as the confidence_interval of maclime.analysis.compare_subgroups
+    to use it in place of maclime.utils.confidence_interval_from_counts. The finite population correction is not
+    applied.
+
+    Attributes:
+        statistic: 'mean' or 'median'
+        method: 'percentile' or 'bca'
+        resamples: The number of resamples
+        confidence: The confidence level of the intervals, or None to use the one given by the survey's z-score
+        seed_sequence: The numpy SeedSequence the random numbers of each interval are derived from, with its counts,
+                       so a seeded bootstrap always gives the same intervals for the same data
+
+    Methods:
+        counts_interval: Computes intervals for every element of an array of per-level counts at once
+        spawn: Returns independent children with other seeds
+    """
+
+    def __init__(self, statistic='median', method='percentile', resamples=2000, confidence=None, seed=None):
+        """
+        :param statistic: 'mean' or 'median'
+        :param method: 'percentile' or 'bca'
+        :param resamples: The number of resamples
+        :param confidence: The confidence level of the intervals, or None to use the one given by the survey's z-score
+        :param seed: An integer seed or a numpy SeedSequence. None seeds the bootstrap from fresh entropy.
+        """
+        if statistic not in STATISTICS:
+            raise ValueError("Unknown statistic {!r}, expected one of {}.".format(statistic, STATISTICS))
+        if method not in METHODS:
+            raise ValueError("Unknown method {!r}, expected one of {}.".format(method, METHODS))
+        self.statistic = statistic
+        self.method = method
+        self.resamples = resamples
+        self.confidence = confidence
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+
+    def __repr__(self):
+        return "Bootstrap(statistic={!r}, method={!r}, resamples={}, confidence={})".format(
+            self.statistic, self.method, self.resamples, self.confidence)
+
+    def spawn(self, n):
+        """
+        Returns independent children with the same settings.
+        :param n: The number of children
+        :return: A list of Bootstraps
+        """
+        return [Bootstrap(self.statistic, self.method, self.resamples, self.confidence, child)
+                for child in self.seed_sequence.spawn(n)]
+
+    def _confidence(self, zscore, survey):
+        if self.confidence is not None:
+            return self.confidence
+        if zscore is None:
+            zscore = get_survey(survey).get_zscore()
+        return 2 * ndtr(zscore) - 1
+
+    @instrumented('utils', name='bootstrap.Bootstrap.counts_interval')
+    def counts_interval(self, levels, counts, zscore=None, population=None, survey=None):
+        """
+        Computes intervals for every element of an array of per-level counts at once, with the arguments and return
+        value of maclime.utils.confidence_interval_from_counts.
+        :param levels: An array of k sorted levels
+        :param counts: An array of counts with k entries on the last axis
+        :param zscore: The z-score giving the confidence level when no confidence was set. Defaults to the survey's.
+        :param population: Unused, since the finite population correction is not applied
+        :param survey: The survey. Defaults to the current survey.
+        :return: Arrays of the lower limits, statistics and upper limits
+        """
+        rng = seeded_generator(self.seed_sequence, np.asarray(levels, dtype=np.float64),
+                               np.asarray(counts, dtype=np.int64))
+        return bootstrap_from_counts(levels, counts, self.statistic, self.method, self.resamples,
+                                     self._confidence(zscore, survey), rng)
+
+    def __call__(self, data, survey=None):
+        """
+        Returns the statistic and the limits of its confidence interval for some data. NaN values are ignored.
+        :param data: The data
+        :param survey: The survey whose z-score is used when no confidence was set. Defaults to the current survey.
+        :return: The lower limit, the statistic and the upper limit, or three Nones if there is no data
+        """
+        levels, counts = get_level_counts(data)
+        if not len(levels):
+            return None, None, None
+        lower, estimate, upper = self.counts_interval(levels, counts, survey=survey)
+        return float(lower), float(estimate), float(upper)
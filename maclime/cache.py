@@ -0,0 +1,116 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+This file caches parsed survey files on disk. Excel exports are slow to parse, so the parsed dataframes and data
+derived from them are pickled under a cache directory, keyed by a hash of the source file's contents and the
+arguments used to read it. Later runs load the pickles and only parse the export again when it changes.
+
+Entries are pickles rather than the Parquet or Feather files of maclime.result_store, even though pyarrow is now a
+requirement. Limesurvey results mix numbers, strings and timestamps in object columns, which pickle round-trips exactly
+and Arrow formats reject or convert. The cached statistics index is a dictionary rather than a dataframe.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+import pandas as pd
+
+# Increment to invalidate every cache entry written by an older version of this file.
+CACHE_VERSION = 1
+# Errors raised when unpickling a damaged entry, or one written with other versions of pandas or numpy.
+_LOAD_ERRORS = (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError, KeyError,
+                TypeError, ValueError, MemoryError, OverflowError)
+
+
+def file_digest(path, chunk_size=2 ** 20):
+    """
+    Returns the SHA-256 digest of a file's contents.
+    :param path: The path to the file
+    :param chunk_size: The number of bytes read at a time
+    :return: A hexadecimal string
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(path, **args):
+    """
+    Returns the cache key of a file read with some arguments.
+    :param path: The path to the file
+    :param args: The keyword arguments used to read the file
+    :return: A hexadecimal string
+    """
+    digest = hashlib.sha256()
+    digest.update(file_digest(path).encode())
+    digest.update(repr(sorted((key, repr(value)) for key, value in args.items())).encode())
+    digest.update("{}-{}".format(CACHE_VERSION, pd.__version__).encode())
+    return digest.hexdigest()
+
+
+def load_or_build(cache_directory, key, builder):
+    """
+    Returns the object cached under a key, or builds it, caches it and returns it.
+    Entries are written to a temporary file and renamed so that a cache entry is never partially written.
+    :param cache_directory: The cache directory
+    :param key: The cache key
+    :param builder: A function with no arguments returning the object to cache
+    :return: The cached object
+    """
+    path = os.path.join(cache_directory, key + ".pkl")
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as file:
+                return pickle.load(file)
+        except _LOAD_ERRORS as _:
+            # The entry is removed and built again. Errors raised by the builder are not caught.
+            try:
+                os.remove(path)
+            except OSError as _:
+                pass
+    value = builder()
+    os.makedirs(cache_directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=cache_directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return value
+
+
+def read_excel_cached(cache_directory, **args):
+    """
+    Reads an excel file with pandas.read_excel through the cache.
+    Files given as an open file object rather than a path are read without the cache.
+    :param cache_directory: The cache directory
+    :param args: Keyword arguments passed to pandas.read_excel, including io
+    :return: The dataframe and its cache key, or None as the key when the cache was not used
+    """
+    path = args.get('io')
+    if not isinstance(path, (str, os.PathLike)):
+        return pd.read_excel(**args), None
+    key = cache_key(path, **{name: value for name, value in args.items() if name != 'io'})
+    return load_or_build(cache_directory, key, lambda: pd.read_excel(**args)), key
+
+
+def clear_cache(cache_directory):
+    """
+    Removes every cache entry from a cache directory.
+    :param cache_directory: The cache directory
+    :return:
+    """
+    if not os.path.isdir(cache_directory):
+        return
+    for name in os.listdir(cache_directory):
+        if name.endswith(".pkl") or name.endswith(".tmp"):
+            os.remove(os.path.join(cache_directory, name))
@@ -4,18 +4,43 @@ Created on May 18, 2022
 @author: Devin Burke
 This file contains configuration variables used by many different functions.
 These variables will change for any given survey.
+Setting the results or statistics file only records how to read it. Files are read the first time they are needed,
+so importing maclime and creating a configuration are cheap and modules can be imported in any order.
+New responses can be appended to a loaded results file, in which case caches derived from it are extended rather
+than rebuilt.
+
+Each Survey owns its data and the caches derived from it, so several surveys can be analyzed in one process.
+Functions throughout maclime take an optional survey argument. Without it they use the current survey, which is the
+survey activated with use_survey or else the default survey returned by create_config.
 """
 
-from matplotlib import rc
+import contextlib
+import contextvars
+import pickle
+import sys
+
+import numpy as np
 import pandas as pd
 
+from maclime.cache import read_excel_cached
+from maclime.instrumentation import instrumented
+
+# The default survey, used when no survey is active.
 CONFIG = None
+# The survey activated with use_survey in the current context, if any.
+_CURRENT_SURVEY = contextvars.ContextVar('maclime_survey', default=None)
+# Functions called with the survey whenever its data changes, after its caches have been cleared.
+_INVALIDATION_HOOKS = []
+# Priorities and functions extending a named survey cache when responses are appended, keyed by the cache name.
+# Caches without an append hook are cleared.
+_APPEND_HOOKS = {}
 
 
-class Configuration:
+class Survey:
     """
-    This class contains configuration variables used by many different functions.
+    This class contains the data and configuration variables of a survey used by many different functions.
     These variables will change for any given survey. Set and retrieve configuration variable using the get/set methods.
+    Caches derived from the survey data are held by the survey and cleared when its data changes.
 
     Attributes:
         _RESULTS_FILE: The results file
@@ -24,14 +49,30 @@ class Configuration:
         _ZSCORE: The z-score used to calculate confidence intervals
         _POPULATION: The estimated population size
         _INCLUDE_ALL: The include array containing all respondents
+        _STATISTICS_KEY: The cache key of the statistics file, if it was read through the cache
+        _CACHE_DIRECTORY: The directory where parsed files are cached, or None to disable the cache
+        _RESULTS_SPEC: The arguments used to read the results file when it is first needed
+        _STATISTICS_SPEC: The arguments used to read the statistics file when it is first needed
+        _APPENDED_RESPONSES: The number of responses appended since the results and statistics files were set
+        _CATEGORICAL: Whether answer columns of the results file are stored as pandas Categoricals
+        _CACHES: Caches derived from the survey data, keyed by name
         _FONT: The font used by matplotlib in figures
 
     Methods:
         get_results_file: Returns the results file
         set_results_file: Sets the results file by specifying the path to the file
+        set_results_frame: Sets the results file from a dataframe
+        append_results_file: Appends the responses in a file to the results file
+        append_results_frame: Appends the responses in a dataframe to the results file
+        get_appended_responses: Returns the number of responses appended since the files were set
+        get_categorical: Returns whether answer columns are stored as pandas Categoricals
         get_include_all: Returns the include array containing all respondents
         get_statistics_file: Returns the statistics file
         set_statistics_file: Sets the statistics file by specifying the path to the file
+        set_statistics_frame: Sets the statistics file from a dataframe
+        get_statistics_key: Returns the cache key of the statistics file
+        get_cache_directory: Returns the directory where parsed files are cached
+        set_cache_directory: Sets the directory where parsed files are cached
         get_all_respondents: Returns the total number of respondents
         set_all_respondents: Sets the total number of respondents
         get_zscore: Returns the z-score
@@ -40,6 +81,13 @@ class Configuration:
         set_population: Sets the population size
         get_font: Returns the font used by matplotlib in figures
         set_font: Sets the font used by matplotlib in figures
+        get_value_dict: Returns the value dictionary for a question code
+        get_value_dict_callback: Returns the function returning the value dictionary for a question code
+        set_value_dict_callback: Sets the function returning the value dictionary for a question code
+        get_state: Returns the survey data and settings
+        set_state: Restores survey data and settings returned by get_state
+        get_cache: Returns a named cache derived from the survey data
+        invalidate: Clears caches derived from the survey data
 
     """
     _RESULTS_FILE = None
@@ -49,51 +97,192 @@ class Configuration:
     _POPULATION = None
     _INCLUDE_ALL = None
     _VALUE_DICT_CALLBACK = None
+    _STATISTICS_KEY = None
+    _CACHE_DIRECTORY = None
+    _RESULTS_SPEC = None
+    _STATISTICS_SPEC = None
+    _APPENDED_RESPONSES = 0
+    _CATEGORICAL = False
     # Font used by matplotlib in figures
     _FONT = {'family': 'DejaVu Sans',
              'weight': 'normal',
              'size': 10}
-    rc('font', **_FONT)
-
-    def __new__(cls):
-        global CONFIG
-        if CONFIG is None:
-            print("Creating new configuration object.")
-            CONFIG = super(Configuration, cls).__new__(cls)
-        else:
-            raise Exception("Configuration object already exists. Access the object with maclime.config.get_config().")
-        return CONFIG
 
     def __init__(self):
-        pass
+        self._CACHES = {}
+        if 'matplotlib' in sys.modules:
+            self._apply_font()
 
     def get_results_file(self):
+        self._load_results()
         return self._RESULTS_FILE
 
-    def set_results_file(self, **args):
+    def set_results_file(self, categorical=None, **args):
+        """
+        Sets the results file by specifying the path to the file. The file is read when it is first needed.
+        :param categorical: Whether to store answer columns as pandas Categoricals, see set_results_frame.
+                            Defaults to the current setting.
+        :param args: Keyword arguments passed to pandas.read_excel
+        :return:
+        """
+        if categorical is not None:
+            self._CATEGORICAL = categorical
+        self._RESULTS_SPEC = args
+        self._RESULTS_FILE = None
+        self._ALL_RESPONDENTS = None
+        self._INCLUDE_ALL = None
+        self._APPENDED_RESPONSES = 0
+        self.invalidate()
+
+    def set_results_frame(self, results, categorical=None):
+        """
+        Sets the results file from a dataframe.
+        :param results: A dataframe of responses indexed by respondent ID
+        :param categorical: Whether to store answer columns as pandas Categoricals whose categories are the answers
+                            listed in the statistics file, which uses a fraction of the memory of answer strings.
+                            Defaults to the current setting.
+        :return:
+        """
+        if categorical is not None:
+            self._CATEGORICAL = categorical
+        self._RESULTS_SPEC = None
+        self._APPENDED_RESPONSES = 0
+        self.invalidate()
+        self._store_results(results)
+
+    def append_results_file(self, **args):
+        """
+        Appends the responses in a file, such as an export filtered to new respondent IDs, to the results file.
+        :param args: Keyword arguments passed to pandas.read_excel, as for set_results_file
+        :return: The number of responses appended
+        """
+        return self.append_results_frame(self._read_excel(**args)[0])
+
+    def append_results_frame(self, rows):
+        """
+        Appends new responses to the results file. Respondent IDs already in the results file are ignored and columns
+        that are not in the results file are dropped. Caches derived from the results file are extended with the new
+        rows instead of being rebuilt.
+        :param rows: A dataframe of responses indexed by respondent ID, with the columns of the results file
+        :return: The number of responses appended
+        """
+        results = self.get_results_file()
+        if results is None:
+            results = pd.DataFrame()
+        rows = rows[~rows.index.isin(results.index) & ~rows.index.duplicated()]
+        if rows.empty:
+            return 0
+        if len(results.columns):
+            rows = rows.reindex(columns=results.columns)
+        if self._CATEGORICAL:
+            from maclime.read_results import categorize_results
+            rows = categorize_results(rows, self, like=results)
+            results = results.astype({code: rows[code].dtype for code in results.columns
+                                      if isinstance(rows[code].dtype, pd.CategoricalDtype)
+                                      and rows[code].dtype != results[code].dtype})
+        self._RESULTS_SPEC = None
+        self._APPENDED_RESPONSES += len(rows.index)
+        self._store_results(pd.concat([results, rows]))
+        for name in [name for name in self._CACHES if name not in _APPEND_HOOKS]:
+            del self._CACHES[name]
+        # Hooks run in order of priority, so caches are extended after the caches they are built from, whatever order
+        # the modules registering them were imported in.
+        for name, (_, hook) in sorted(_APPEND_HOOKS.items(), key=lambda item: item[1][0]):
+            if name in self._CACHES:
+                hook(self, self._CACHES[name], rows)
+        return len(rows.index)
+
+    def get_appended_responses(self):
+        return self._APPENDED_RESPONSES
+
+    def get_categorical(self):
+        return self._CATEGORICAL
+
+    def _store_results(self, results):
+        from maclime.include_arrays import IncludeSet
+        if self._CATEGORICAL:
+            from maclime.read_results import categorize_results
+            results = categorize_results(results, self)
+        self._RESULTS_FILE = results
+        self._ALL_RESPONDENTS = len(results.index)
+        self._INCLUDE_ALL = IncludeSet(np.ones(self._ALL_RESPONDENTS, dtype=bool), results.index)
+
+    def _load_results(self):
+        """
+        Reads the results file recorded by set_results_file if it has not been read yet.
+        :return:
+        """
+        if self._RESULTS_FILE is not None or self._RESULTS_SPEC is None:
+            return
         try:
-            self._RESULTS_FILE = pd.read_excel(**args)
-            self._ALL_RESPONDENTS = len(self._RESULTS_FILE.index)
-            self._INCLUDE_ALL = list(self._RESULTS_FILE.index)
+            results = self._read_excel(**self._RESULTS_SPEC)[0]
         except FileNotFoundError as _:
-            self._RESULTS_FILE = pd.DataFrame()
+            results = pd.DataFrame()
+        self._store_results(results)
 
     def get_include_all(self):
+        self._load_results()
         return self._INCLUDE_ALL
 
     def get_statistics_file(self):
+        self._load_statistics()
         return self._STATISTICS_FILE
 
     def set_statistics_file(self, **args):
+        self._STATISTICS_SPEC = args
+        self._STATISTICS_FILE = None
+        self._STATISTICS_KEY = None
+        self._APPENDED_RESPONSES = 0
+        self.invalidate()
+
+    def set_statistics_frame(self, statistics, cache_key=None):
+        self._STATISTICS_SPEC = None
+        self._APPENDED_RESPONSES = 0
+        self._STATISTICS_FILE = statistics
+        self._STATISTICS_KEY = cache_key
+        self.invalidate()
+
+    def _load_statistics(self):
+        """
+        Reads the statistics file recorded by set_statistics_file if it has not been read yet.
+        :return:
+        """
+        if self._STATISTICS_FILE is not None or self._STATISTICS_SPEC is None:
+            return
         try:
-            self._STATISTICS_FILE = pd.read_excel(**args)
+            statistics, key = self._read_excel(**self._STATISTICS_SPEC)
         except FileNotFoundError as _:
-            self._STATISTICS_FILE = pd.DataFrame()
+            statistics, key = pd.DataFrame(), None
+        self._STATISTICS_FILE = statistics
+        self._STATISTICS_KEY = key
+
+    def get_statistics_key(self):
+        self._load_statistics()
+        return self._STATISTICS_KEY
+
+    def get_cache_directory(self):
+        return self._CACHE_DIRECTORY
+
+    def set_cache_directory(self, cache_directory):
+        self._CACHE_DIRECTORY = cache_directory
+
+    @instrumented('excel')
+    def _read_excel(self, **args):
+        """
+        Reads an excel file, through the cache when a cache directory is set.
+        :param args: Keyword arguments passed to pandas.read_excel
+        :return: The dataframe and its cache key, or None as the key when the cache was not used
+        """
+        if self._CACHE_DIRECTORY is None:
+            return pd.read_excel(**args), None
+        return read_excel_cached(self._CACHE_DIRECTORY, **args)
 
     def get_all_respondents(self):
+        self._load_results()
         return self._ALL_RESPONDENTS
 
     def set_all_respondents(self, respondents):
+        self._load_results()
         self._ALL_RESPONDENTS = respondents
 
     def get_zscore(self):
@@ -113,20 +302,202 @@ class Configuration:
 
     def set_font(self, **args):
         self._FONT = args
-        rc('font', **args)
+        self._apply_font()
+
+    def _apply_font(self):
+        from matplotlib import rc
+        rc('font', **self._FONT)
 
     def get_value_dict(self, code):
         return self._VALUE_DICT_CALLBACK(code)
 
+    def get_value_dict_callback(self):
+        return self._VALUE_DICT_CALLBACK
+
     def set_value_dict_callback(self, callback):
         self._VALUE_DICT_CALLBACK = callback
+        self.invalidate()
+
+    def get_state(self):
+        """
+        Returns the survey data and settings held by the configuration, for example to copy them to a worker process.
+        Files that have not been read yet are returned as the arguments recorded to read them.
+        The value dictionary callback is not included.
+        :return: A dictionary of the results, statistics, respondents, z-score, population and font
+        """
+        return {'results': self._RESULTS_FILE,
+                'results_spec': self._RESULTS_SPEC,
+                'categorical': self._CATEGORICAL,
+                'statistics': self._STATISTICS_FILE,
+                'statistics_spec': self._STATISTICS_SPEC,
+                'statistics_key': self._STATISTICS_KEY,
+                'cache_directory': self._CACHE_DIRECTORY,
+                'all_respondents': self._ALL_RESPONDENTS,
+                'appended_responses': self._APPENDED_RESPONSES,
+                'zscore': self._ZSCORE,
+                'population': self._POPULATION,
+                'font': self._FONT}
+
+    def set_state(self, state):
+        """
+        Restores survey data and settings returned by get_state.
+        :param state: A dictionary returned by get_state
+        :return:
+        """
+        self._CACHE_DIRECTORY = state['cache_directory']
+        self._CATEGORICAL = state['categorical']
+        if state['statistics'] is not None:
+            self.set_statistics_frame(state['statistics'], cache_key=state['statistics_key'])
+        elif state['statistics_spec'] is not None:
+            self.set_statistics_file(**state['statistics_spec'])
+        if state['results'] is not None:
+            self.set_results_frame(state['results'])
+            self._ALL_RESPONDENTS = state['all_respondents']
+        elif state['results_spec'] is not None:
+            self.set_results_file(**state['results_spec'])
+        self._APPENDED_RESPONSES = state['appended_responses']
+        self._ZSCORE = state['zscore']
+        self._POPULATION = state['population']
+        self.set_font(**state['font'])
+
+    def get_cache(self, name, factory=dict):
+        """
+        Returns a cache derived from the survey data, creating it if it does not exist.
+        :param name: The name of the cache
+        :param factory: A function with no arguments returning an empty cache
+        :return: The cache
+        """
+        if name not in self._CACHES:
+            self._CACHES[name] = factory()
+        return self._CACHES[name]
+
+    def invalidate(self):
+        """
+        Clears every cache derived from the survey data and calls every registered invalidation hook.
+        :return:
+        """
+        self._CACHES.clear()
+        for hook in _INVALIDATION_HOOKS:
+            hook(self)
+
+
+# The name used by existing scripts.
+Configuration = Survey
 
 
 def create_config():
+    """
+    Creates the default survey, or returns it if it already exists.
+    :return: The default survey
+    """
     global CONFIG
-    CONFIG = Configuration()
+    if CONFIG is None:
+        print("Creating new configuration object.")
+        CONFIG = Survey()
     return CONFIG
 
 
 def get_config():
-    return CONFIG
+    """
+    Returns the current survey: the survey activated with use_survey, or else the default survey, which is created
+    if it does not exist yet.
+    :return: The current survey
+    """
+    current = _CURRENT_SURVEY.get()
+    if current is not None:
+        return current
+    return create_config()
+
+
+def get_survey(survey=None):
+    """
+    Returns the survey passed to a function, or the current survey when none was passed.
+    :param survey: A Survey or None
+    :return: A Survey
+    """
+    if survey is not None:
+        return survey
+    return get_config()
+
+
+@contextlib.contextmanager
+def use_survey(survey):
+    """
+    Makes a survey the current survey within a with block. Functions called without a survey argument in the block,
+    including callbacks, use this survey.
+    :param survey: A Survey
+    :return: A context manager yielding the survey
+    """
+    token = _CURRENT_SURVEY.set(survey)
+    try:
+        yield survey
+    finally:
+        _CURRENT_SURVEY.reset(token)
+
+
+def register_invalidation_hook(hook):
+    """
+    Registers a function to be called with the survey whenever its results file, statistics file or value
+    dictionary callback is set.
+    :param hook: A function of a Survey
+    :return:
+    """
+    if hook not in _INVALIDATION_HOOKS:
+        _INVALIDATION_HOOKS.append(hook)
+
+
+def register_append_hook(name, hook, priority=0):
+    """
+    Registers a function extending a named survey cache when responses are appended, instead of clearing it.
+    The hook is called with the survey, the cache and a dataframe of the appended responses. Hooks run in increasing
+    order of priority, so a cache built from other caches must have a higher priority than each of them.
+    :param name: The name of the cache
+    :param hook: A function of a Survey, a cache and a dataframe
+    :param priority: The priority of the hook
+    :return:
+    """
+    _APPEND_HOOKS[name] = (priority, hook)
+
+
+def pickle_survey(survey=None):
+    """
+    Pickles the state of a survey and its value dictionary callback to send to worker processes.
+    :param survey: The survey. Defaults to the current survey.
+    :return: A tuple of the pickled state and the pickled callback, or None if there is no survey
+    """
+    if survey is None:
+        if _CURRENT_SURVEY.get() is None and CONFIG is None:
+            return None
+        survey = get_config()
+    return pickle.dumps(survey.get_state()), pickle.dumps(survey.get_value_dict_callback())
+
+
+def worker_payload(mp_context, survey=None):
+    """
+    Returns the payload to pass to initialize_worker for a pool of worker processes. Forked workers inherit the
+    default survey, so nothing is pickled for them unless another survey is used.
+    :param mp_context: The multiprocessing context used to start the workers
+    :param survey: The survey. Defaults to the current survey.
+    :return: The value returned by pickle_survey, or None
+    """
+    if mp_context.get_start_method() == 'fork' and (survey or get_config()) is CONFIG:
+        return None
+    return pickle_survey(survey)
+
+
+def initialize_worker(payload=None):
+    """
+    Loads a survey pickled by pickle_survey into the default survey of a worker process. Use as the initializer of a
+    process pool.
+    The survey data is restored before the callback is unpickled, so modules imported while unpickling the callback
+    find a configured survey. Nothing is done when the payload is None, for example when workers are forked and
+    inherit the survey.
+    :param payload: The value returned by pickle_survey, or None
+    :return:
+    """
+    if payload is None:
+        return
+    state, callback = payload
+    config = get_config()
+    config.set_state(pickle.loads(state))
+    config.set_value_dict_callback(pickle.loads(callback))
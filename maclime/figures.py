@@ -2,13 +2,27 @@
 Created on May 18, 2022
 
 @author: Devin Burke
+
+This file contains figure functions and a headless renderer. A FigureQueue collects figure callbacks and renders
+them in a pool of worker processes using the Agg backend, writing each figure to disk without showing it and closing
+it as soon as it is written. A FigureTemplate keeps the figure of each section of a report so that figure callbacks
+supporting it only update the data and labels of the figure for each subgroup instead of drawing it again.
 """
 
-import matplotlib.pyplot as plt
+import multiprocessing
+import os
 import textwrap
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+
+from maclime.config import initialize_worker, worker_payload
 
 
-def create_pie_chart(answers, frequencies, title=None, subtitle=None, save_figure=False):
+def create_pie_chart(answers, frequencies, title=None, subtitle=None, save_figure=False, show=True):
     """
     Create a pie chart with labels, percentages, title, and subtitle.
     :param answers: list of strings
@@ -16,6 +30,7 @@ def create_pie_chart(answers, frequencies, title=None, subtitle=None, save_figur
     :param title: Title string
     :param subtitle: Subtitle string
     :param save_figure: Whether to save the figure
+    :param show: Whether to show the figure. When False the figure is closed after it is saved.
     :return:
     """
     # Create a figure and axis
@@ -44,7 +59,206 @@ def create_pie_chart(answers, frequencies, title=None, subtitle=None, save_figur
         if frequencies[i] != 0:
             label.set_text(f"{label.get_text()}%")
 
-    # Show the pie char
+    # Show the pie chart
     if save_figure:
-        plt.savefig(title + ".png")
-    plt.show()
+        fig.savefig(title + ".png")
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
+
+
+def render_figure(callback, filename, formats=('png',), **kwargs):
+    """
+    Calls a figure callback and writes every figure it draws to disk instead of showing it. The callback draws on a
+    new current figure, and the figures it creates are closed afterwards while figures that were already open are left
+    alone. The first figure is written to filename and any further figures to filename followed by _2, _3...
+    Use with a non-interactive backend such as Agg.
+    :param callback: A figure callback such as the figure_callback passed to maclime.analysis.analyze
+    :param filename: The path of the figure without an extension
+    :param formats: The file formats to write, for example png, svg and pdf
+    :param kwargs: Keyword arguments passed to the callback
+    :return: A list of the paths written
+    """
+    open_figures = set(plt.get_fignums())
+    paths = []
+    try:
+        # Callbacks such as plot_impact_statistics draw on the current figure, which must not be one of the caller's.
+        plt.figure()
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message='.*non-interactive.*')
+            callback(**kwargs)
+        figures = [plt.figure(number) for number in plt.get_fignums() if number not in open_figures]
+        figures = [figure for figure in figures if figure.axes]
+        for i, figure in enumerate(figures):
+            path = filename if i == 0 else "{}_{}".format(filename, i + 1)
+            for extension in formats:
+                figure.savefig("{}.{}".format(path, extension))
+                paths.append("{}.{}".format(path, extension))
+    finally:
+        for number in set(plt.get_fignums()) - open_figures:
+            plt.close(number)
+    return paths
+
+
+def _initialize_figure_worker(payload):
+    """
+    Switches a worker process to the Agg backend and loads the survey into it.
+    :param payload: The value returned by maclime.config.pickle_survey, or None
+    :return:
+    """
+    matplotlib.use('Agg', force=True)
+    initialize_worker(payload)
+
+
+def _render_job(job):
+    """
+    Renders one queued figure in a worker process.
+    :param job: A tuple of the callback, filename, formats and keyword arguments
+    :return: A list of the paths written
+    """
+    callback, filename, formats, kwargs = job
+    return render_figure(callback, filename, formats, **kwargs)
+
+
+class FigureQueue:
+    """
+    A queue of figure callbacks rendered headlessly in a pool of worker processes.
+    Each worker uses the Agg backend, never calls plt.show() and closes every figure once it is written, so memory
+    stays flat however many figures are rendered.
+
+    Attributes:
+        directory (str): The directory figures are written to.
+        formats (tuple): The file formats written for each figure, for example png, svg and pdf.
+        max_workers (int): The number of worker processes. Defaults to the number of processors.
+        mp_context: The multiprocessing context used to start the workers.
+        survey (Survey): The survey loaded into the workers. Defaults to the current survey when rendering.
+
+    Methods:
+        add: Adds a figure callback to the queue.
+        render: Renders every queued figure and empties the queue.
+    """
+
+    def __init__(self, directory=".", formats=('png',), max_workers=None, mp_context=None, survey=None):
+        self.directory = directory
+        self.formats = tuple(formats)
+        self.max_workers = max_workers
+        self.mp_context = mp_context if mp_context is not None else multiprocessing.get_context()
+        self.survey = survey
+        self._jobs = []
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def add(self, callback, filename, **kwargs):
+        """
+        Adds a figure callback to the queue. The callback must be an importable module level function and its keyword
+        arguments must be picklable. Pass save_figure=False to callbacks that save figures themselves.
+        :param callback: A figure callback
+        :param filename: The name of the figure file without an extension, relative to the queue directory
+        :param kwargs: Keyword arguments passed to the callback
+        :return:
+        """
+        self._jobs.append((callback, os.path.join(self.directory, filename), self.formats, kwargs))
+
+    def render(self):
+        """
+        Renders every queued figure in the worker pool and empties the queue.
+        :return: A list with the paths written for each queued figure, in the order the figures were added
+        """
+        jobs, self._jobs = self._jobs, []
+        if not jobs:
+            return []
+        os.makedirs(self.directory, exist_ok=True)
+        payload = worker_payload(self.mp_context, self.survey)
+        with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self.mp_context,
+                                 initializer=_initialize_figure_worker, initargs=(payload,)) as executor:
+            return list(executor.map(_render_job, jobs))
+
+
+def figure_filename(title, description=None):
+    """
+    Returns a file name for a figure from its title and description, the same name maclime.analysis.analyze gives a
+    queued figure.
+    :param title: The title of the figure
+    :param description: The description of the figure
+    :return: A file name without an extension
+    """
+    name = "_".join(str(part) for part in (title, description) if part)
+    name = "".join(char if char.isalnum() or char in " -_()" else "_" for char in name)
+    return name or "figure"
+
+
+class FigureTemplate:
+    """
+    Figures built once for each section of a report and updated for each subgroup.
+    A figure callback given a template builds its figure and artists the first time it is called for a section. On
+    later calls it only updates the bar heights, error bars, labels and title before writing the figure to disk, which
+    avoids creating axes, ticks and wrapped labels again for every subgroup and complement.
+    Figures are created without pyplot, so they are never shown and are left open by render_figure. A template copied
+    to a worker process of a FigureQueue starts empty, and each worker builds its own figures.
+
+    Attributes:
+        directory (str): The directory figures are written to.
+        formats (tuple): The file formats written for each figure, for example png, svg and pdf.
+
+    Methods:
+        get: Returns the figure and artists of a section, building them the first time.
+        save: Writes a figure to disk.
+        clear: Forgets every figure.
+    """
+
+    def __init__(self, directory=".", formats=('png',)):
+        self.directory = directory
+        self.formats = tuple(formats)
+        self._figures = {}
+
+    def __len__(self):
+        return len(self._figures)
+
+    def __getstate__(self):
+        return {'directory': self.directory, 'formats': self.formats}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key, build):
+        """
+        Returns the figure and artists of a section, building them the first time.
+        :param key: A hashable key identifying the section, such as the callback name, codes and axis labels
+        :param build: A function with no arguments returning a figure created by new_figure and its artists
+        :return: The value returned by build for the key
+        """
+        if key not in self._figures:
+            self._figures[key] = build()
+        return self._figures[key]
+
+    @staticmethod
+    def new_figure():
+        """
+        Creates a figure that is not managed by pyplot.
+        :return: A matplotlib.figure.Figure
+        """
+        return Figure()
+
+    def save(self, figure, filename):
+        """
+        Writes a figure to disk in every format of the template.
+        :param figure: A matplotlib.figure.Figure
+        :param filename: The name of the figure file without an extension, relative to the template directory
+        :return: A list of the paths written
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        paths = []
+        for extension in self.formats:
+            path = "{}.{}".format(os.path.join(self.directory, filename), extension)
+            figure.savefig(path)
+            paths.append(path)
+        return paths
+
+    def clear(self):
+        """
+        Forgets every figure.
+        :return:
+        """
+        self._figures.clear()
@@ -0,0 +1,232 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+This module computes answer frequencies directly from the limesurvey results file.
+Every code and every include array is counted in one vectorized pass over the results, so the statistics file is
+only needed to order the possible answers. Codes missing from the statistics file use the answers found in the
+results file.
+"""
+
+import numpy as np
+import pandas as pd
+
+from maclime.config import get_survey, register_append_hook
+from maclime.include_arrays import as_include_set
+from maclime.read_statistics import get_statistics_index
+
+# Answers that are never counted from the results file.
+NOT_DISPLAYED = "Not completed or Not displayed"
+NO_ANSWER = "No answer"
+# Maximum number of respondent x answer cells encoded at once by get_frequency_table.
+_CHUNK_CELLS = 2 ** 22
+
+# Name of the survey cache of encoded responses keyed by question code.
+_ENCODED = 'encoded_responses'
+
+
+def clear_encoded_responses(survey=None):
+    """
+    Removes every encoded column from a survey's cache.
+    :param survey: The survey. Defaults to the current survey.
+    :return:
+    """
+    get_survey(survey).get_cache(_ENCODED).clear()
+
+
+def _append_encoded_responses(survey, encoded, rows):
+    """
+    Extends every encoded column in the cache with appended responses. Answers that are new are added to the end of
+    the categories, which is where pandas.factorize would put them.
+    :param survey: The survey
+    :param encoded: The survey's cache of encoded responses
+    :param rows: A dataframe of the appended responses
+    :return:
+    """
+    for code, (codes, categories) in list(encoded.items()):
+        column = rows[code]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            encoded[code] = (np.concatenate([codes, column.cat.codes.to_numpy()]), list(column.cat.categories))
+            continue
+        new_codes = pd.Index(categories, dtype=object).get_indexer(column.astype(object))
+        unknown = (new_codes < 0) & column.notna().to_numpy()
+        if unknown.any():
+            extra_codes, extra = pd.factorize(column[unknown])
+            new_codes[unknown] = extra_codes + len(categories)
+            categories = categories + list(extra)
+        encoded[code] = (np.concatenate([codes, new_codes]), categories)
+
+
+register_append_hook(_ENCODED, _append_encoded_responses)
+
+
+def encode_responses(code, survey=None):
+    """
+    Encodes the responses to a question code as integers. Encodings are cached until the survey changes.
+    Categorical columns are encoded by their own codes and categories without being factorized again.
+    :param code: The question code
+    :param survey: The survey. Defaults to the current survey.
+    :return: An array with the category number of each respondent's answer, -1 if there was no answer, and the list
+             of categories
+    """
+    survey = get_survey(survey)
+    encoded = survey.get_cache(_ENCODED)
+    if code not in encoded:
+        column = survey.get_results_file()[code]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            encoded[code] = (column.cat.codes.to_numpy(), list(column.cat.categories))
+        else:
+            codes, categories = pd.factorize(column, use_na_sentinel=True)
+            encoded[code] = (codes, list(categories))
+    return encoded[code]
+
+
+def get_answers(code, survey=None):
+    """
+    Returns the possible answers for a question code in the order they are reported. Answers are taken from the
+    statistics file when the code is in it, otherwise from the results file followed by 'No answer'.
+    :param code: The question code
+    :param survey: The survey. Defaults to the current survey.
+    :return: A list of answers
+    """
+    statistics_index = get_statistics_index(survey)
+    if code in statistics_index:
+        answers = list(statistics_index[code]['answers'])
+    else:
+        answers = list(encode_responses(code, survey)[1])
+    if NO_ANSWER not in answers:
+        answers.append(NO_ANSWER)
+    return answers
+
+
+def _answer_matrix(code, answers, survey):
+    """
+    Returns a respondent x answer indicator matrix for a question code.
+    :param code: The question code
+    :param answers: The answers returned by get_answers
+    :param survey: The survey
+    :return: A float array with a one for the answer each respondent gave
+    """
+    codes, categories = encode_responses(code, survey)
+    positions = {answer: i for i, answer in enumerate(answers) if answer != NOT_DISPLAYED}
+    category_positions = np.array([positions.get(category, -1) for category in categories] +
+                                  [answers.index(NO_ANSWER)], dtype=np.intp)
+    columns = category_positions[codes]
+    counted = np.flatnonzero(columns >= 0)
+    matrix = np.zeros((len(codes), len(answers)))
+    matrix[counted, columns[counted]] = 1
+    return matrix
+
+
+def _include_masks(includes, survey):
+    """
+    Converts a dictionary of include arrays to a matrix of masks over the results file.
+    :param includes: A dictionary of include arrays
+    :param survey: The survey
+    :return: A float array with a row for each include array
+    """
+    index = survey.get_results_file().index
+    masks = np.zeros((len(includes), len(index)))
+    for i, include in enumerate(includes.values()):
+        masks[i] = as_include_set(include, index).mask
+    return masks
+
+
+def _count_answers(codes, includes, survey):
+    """
+    Counts the answers to each code for each include array with one matrix product per chunk of codes.
+    :param codes: A list of question codes
+    :param includes: A dictionary of include arrays
+    :param survey: The survey
+    :return: A list with the answers for each code, a list with a subgroup x answer array of counts for each code,
+             and an array with the number of respondents in each include array
+    """
+    masks = _include_masks(includes, survey)
+    totals = masks.sum(axis=1)
+    layouts = [get_answers(code, survey) for code in codes]
+    counts = []
+    chunk_size = max(1, _CHUNK_CELLS // max(1, masks.shape[1] * max((len(a) for a in layouts), default=1)))
+    for first in range(0, len(codes), chunk_size):
+        chunk = range(first, min(first + chunk_size, len(codes)))
+        matrix = np.hstack([_answer_matrix(codes[i], layouts[i], survey) for i in chunk])
+        chunk_counts = masks @ matrix
+        column = 0
+        for i in chunk:
+            width = len(layouts[i])
+            code_counts = chunk_counts[:, column:column + width]
+            if NOT_DISPLAYED in layouts[i]:
+                code_counts[:, layouts[i].index(NOT_DISPLAYED)] = np.nan
+            counts.append(code_counts)
+            column += width
+    return layouts, counts, totals
+
+
+def _default_codes(survey):
+    """
+    Returns every code in the statistics file that is also in the results file, or every column of the results file
+    when there is no statistics file.
+    :param survey: The survey
+    :return: A list of question codes
+    """
+    columns = survey.get_results_file().columns
+    statistics_index = get_statistics_index(survey)
+    if statistics_index:
+        return [code for code in statistics_index if code in columns]
+    return list(columns)
+
+
+def get_frequencies(code, include=None, survey=None):
+    """
+    Returns the answers, counts and percentages for a question code and include array.
+    Counts are None for 'Not completed or Not displayed' and 'No answer' counts respondents who gave no answer.
+    Percentages are relative to the number of included respondents and rounded to one decimal place.
+    :param code: The question code
+    :param include: An include array. Defaults to all respondents.
+    :param survey: The survey. Defaults to the current survey.
+    :return: A list of answers, a list of counts and a list of percentages
+    """
+    survey = get_survey(survey)
+    if include is None:
+        include = survey.get_include_all()
+    answers, counts, totals = _count_answers([code], {code: include}, survey)
+    counts = [None if pd.isna(count) else int(count) for count in counts[0][0].tolist()]
+    total = int(totals[0])
+    percentages = [None if count is None or not total else round(count / total * 100, 1) for count in counts]
+    return answers[0], counts, percentages
+
+
+def get_frequency_table(codes='ALL', includes=None, survey=None):
+    """
+    Returns the answer counts and percentages for many codes and include arrays in one pass over the results file.
+    :param codes: A list of question codes. If codes is 'ALL', every code is counted.
+    :param includes: A dictionary mapping subgroup names to include arrays, or a single include array.
+                     Defaults to all respondents.
+    :param survey: The survey. Defaults to the current survey.
+    :return: A dataframe indexed by subgroup, code and answer with the columns Count and Percentage
+    """
+    survey = get_survey(survey)
+    if includes is None:
+        includes = {'all': survey.get_include_all()}
+    elif not isinstance(includes, dict):
+        includes = {'include': includes}
+    if codes == 'ALL':
+        codes = _default_codes(survey)
+    codes = list(codes)
+    answers, counts, totals = _count_answers(codes, includes, survey)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percentages = [code_counts / totals[:, None] * 100 for code_counts in counts]
+
+    index = []
+    count_column = []
+    percentage_column = []
+    for s, subgroup in enumerate(includes):
+        for i, code in enumerate(codes):
+            index.extend((subgroup, code, answer) for answer in answers[i])
+            count_column.append(counts[i][s])
+            percentage_column.append(percentages[i][s])
+    index = pd.MultiIndex.from_tuples(index, names=['subgroup', 'code', 'answer'])
+    if not count_column:
+        return pd.DataFrame({'Count': [], 'Percentage': []}, index=index)
+    return pd.DataFrame({'Count': np.concatenate(count_column),
+                         'Percentage': np.concatenate(percentage_column)}, index=index)
@@ -3,65 +3,292 @@ Created on April 27, 2023
 
 @author: Devin Burke
 
-This file houses user defined include arrays. 
-An include array is a list with an entry for each respondent according to their respondent ID.
-If a respondent gave the specified response for a given question code.
-Include arrays can be combined with added together or subtracted from each other.
+This file houses user defined include arrays.
+An include array is a set of respondent IDs that gave the specified response for a given question code.
+Include arrays are stored as an IncludeSet, a boolean mask over the index of the results file.
+Include arrays can be combined with & and |, subtracted with - and complemented with ~.
+Plain lists of respondent IDs are still accepted anywhere an include array is expected.
+Include arrays can also be defined by name with define_include. Definitions are shared by every survey. The include
+arrays of each survey are built when first requested and extended with the new rows when responses are appended to
+its results file.
 
 Pass include arrays to functions called from your main survey file and use them to
 filter your data.
 """
 
-from collections import Counter
-from maclime.read_results import get_results
+import hashlib
+from collections import OrderedDict
 
+import numpy as np
+import pandas as pd
 
-# Returns a list of index values (respondent IDs) that have the response to the code.
-def get_include_array(code, response):
+from maclime.config import get_survey, register_append_hook
+
+# Named include definitions, and the name of the survey cache holding the include arrays built from them.
+_INCLUDE_DEFINITIONS = OrderedDict()
+_DEFINED_INCLUDES = 'defined_includes'
+# The number of times each include has been defined, so that surveys rebuild include arrays that were redefined.
+_DEFINED_INCLUDE_VERSIONS = {}
+
+
+class IncludeSet:
+    """
+    An include array backed by a boolean mask over the index of the results file.
+    Iterating over an IncludeSet yields the included respondent IDs in the order of the results file.
+
+    Attributes:
+        index (Index): The index of the results file the mask refers to.
+        mask (ndarray): A read-only boolean array with an entry for each row of the results file.
+
+    Methods:
+        from_ids: Builds an IncludeSet from an iterable of respondent IDs.
+        tolist: Returns the included respondent IDs as a list.
+        fingerprint: Returns a digest identifying the included respondents.
+        copy: Returns the IncludeSet. IncludeSets are immutable so no copy is made.
+    """
+    __slots__ = ('_index', '_mask', '_fingerprint')
+
+    def __init__(self, mask, index=None, survey=None):
+        if index is None:
+            index = get_survey(survey).get_results_file().index
+        mask = np.asarray(mask, dtype=bool)
+        if mask.shape != (len(index),):
+            raise ValueError("Mask of length {} does not match an index of length {}.".format(mask.size,
+                                                                                               len(index)))
+        mask.setflags(write=False)
+        self._index = index
+        self._mask = mask
+        self._fingerprint = None
+
+    @classmethod
+    def from_ids(cls, ids, index=None, survey=None):
+        """
+        Builds an IncludeSet from an iterable of respondent IDs.
+        :param ids: An iterable of respondent IDs
+        :param index: The index of the results file. Defaults to the index of the survey's results file.
+        :param survey: The survey. Defaults to the current survey.
+        :return: An IncludeSet
+        """
+        if index is None:
+            index = get_survey(survey).get_results_file().index
+        if isinstance(ids, IncludeSet):
+            if ids.index is index:
+                return ids
+            if ids.index.equals(index):
+                return cls(ids.mask, index)
+            ids = ids.tolist()
+        return cls(index.isin(list(ids)), index)
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def mask(self):
+        return self._mask
+
+    def tolist(self):
+        return self._index[self._mask].tolist()
+
+    def copy(self):
+        return self
+
+    def fingerprint(self):
+        """
+        Returns a digest of the included respondent IDs. Include arrays with the same respondents have the same
+        fingerprint.
+        :return: A hexadecimal string
+        """
+        if self._fingerprint is None:
+            hashed_ids = pd.util.hash_array(self._index[self._mask].to_numpy())
+            self._fingerprint = hashlib.blake2b(hashed_ids.tobytes(), digest_size=16).hexdigest()
+        return self._fingerprint
+
+    def _coerce(self, other):
+        return IncludeSet.from_ids(other, self._index).mask
+
+    def __and__(self, other):
+        return IncludeSet(self._mask & self._coerce(other), self._index)
+
+    def __or__(self, other):
+        return IncludeSet(self._mask | self._coerce(other), self._index)
+
+    def __sub__(self, other):
+        return IncludeSet(self._mask & ~self._coerce(other), self._index)
+
+    def __invert__(self):
+        return IncludeSet(~self._mask, self._index)
+
+    __rand__ = __and__
+    __ror__ = __or__
+
+    def __rsub__(self, other):
+        return as_include_set(other, self._index) - self
+
+    def __len__(self):
+        return int(np.count_nonzero(self._mask))
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __contains__(self, item):
+        position = self._index.get_indexer([item])[0]
+        return position >= 0 and bool(self._mask[position])
+
+    def __eq__(self, other):
+        if isinstance(other, (IncludeSet, list, tuple, set, pd.Index)):
+            return bool(np.array_equal(self._mask, self._coerce(other)))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "IncludeSet({} of {} respondents)".format(len(self), len(self._mask))
+
+
+def as_include_set(include, index=None, survey=None):
+    """
+    Converts an include array to an IncludeSet.
+    :param include: An IncludeSet or an iterable of respondent IDs
+    :param index: The index of the results file. Defaults to the index of the survey's results file.
+    :param survey: The survey. Defaults to the current survey.
+    :return: An IncludeSet
+    """
+    return IncludeSet.from_ids(include, index, survey)
+
+
+# Returns the respondent IDs (index values) that have the response to the code.
+def get_include_array(code, response, survey=None):
     """
-    Returns a list of respondent IDs that have the specified response to the specified question code.
+    Returns an include array of respondent IDs that have the specified response to the specified question code.
     :param code: The question code
     :param response: The response
-    :return: A list of respondent IDs
+    :param survey: The survey. Defaults to the current survey.
+    :return: An IncludeSet of respondent IDs
     """
-    RESULTS = get_results()
-    f_results = RESULTS[RESULTS[code] == response]
-    return f_results.index.tolist()
+    RESULTS = get_survey(survey).get_results_file()
+    return IncludeSet(response_mask(RESULTS, code, response), RESULTS.index)
 
 
-# Can combine lists using AND or OR logic.
-def combine_include(*args, logic='OR'):
+# Can combine include arrays using AND or OR logic.
+def combine_include(*args, logic='OR', survey=None):
     """
     Combines include arrays using AND or OR logic.
     :param args: The include arrays to be combined
     :param logic: The logic to be used. AND or OR
-    :return: A list of respondent IDs
+    :param survey: The survey. Defaults to the current survey.
+    :return: An IncludeSet of respondent IDs
     """
-    x = args[0].copy()
-    for i, inc in enumerate(args):
-        if i == 0:
-            continue
-        x = x + inc
-    if logic == 'OR':
-        return list(dict.fromkeys(x))
-    if logic == 'AND':
-        return [item for item, count in Counter(x).items() if count > 1]
+    x = as_include_set(args[0], survey=survey)
+    for inc in args[1:]:
+        if logic == 'OR':
+            x = x | inc
+        elif logic == 'AND':
+            x = x & inc
+    return x
 
-# All respondent arrays after the first are subtracted from the first.
-# For each boolean in the first array, if any boolean of the same index in
-# another array is True, the value in the first array becomes False.
-# Returns a new array
 
-
-def subtract_include(*args):
+# All include arrays after the first are subtracted from the first.
+# A respondent in the first array is removed if it appears in any other array.
+# Returns a new include array.
+def subtract_include(*args, survey=None):
     """
     Subtracts include arrays from each other.
     :param args: The include arrays to be subtracted
-    :return: A list of respondent IDs
+    :param survey: The survey. Defaults to the current survey.
+    :return: An IncludeSet of respondent IDs
     """
-    new_include = args[0].copy()
-    for i, inc in enumerate(args):
-        if i == 0:
-            continue
-        new_include = [x for x in new_include if x not in inc]
+    new_include = as_include_set(args[0], survey=survey)
+    for inc in args[1:]:
+        new_include = new_include - inc
     return new_include
+
+
+def response_mask(rows, code, response):
+    """
+    Returns which rows of the results file have the specified response to the specified question code.
+    :param rows: A dataframe of rows of the results file
+    :param code: The question code
+    :param response: The response
+    :return: A boolean array with an entry for each row
+    """
+    column = rows[code]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        position = column.cat.categories.get_indexer([response])[0]
+        codes = column.cat.codes.to_numpy()
+        return codes == position if position >= 0 else np.zeros(len(codes), dtype=bool)
+    return (column == response).to_numpy(dtype=bool, na_value=False)
+
+
+def define_include(name, definition, aliases=None, survey=None):
+    """
+    Defines a named include array. A definition is a (code, response) tuple, an include expression as described in
+    maclime.include_expressions, or a function taking a dataframe of rows of the results file and returning a boolean
+    array saying which rows are included. A function must only look at the rows it is given so that the include array
+    can be extended when responses are appended. Include expressions can refer to include arrays defined earlier.
+    :param name: The name of the include array
+    :param definition: A (code, response) tuple, an include expression or a function of a dataframe of rows
+    :param aliases: A dictionary mapping words used as values in an include expression to the answers they stand for
+    :param survey: The survey the include array is returned for. Defaults to the current survey.
+    :return: The include array as an IncludeSet
+    """
+    if isinstance(definition, tuple):
+        code, response = definition
+        definition = lambda rows: response_mask(rows, code, response)
+    elif isinstance(definition, str):
+        from maclime.include_expressions import expression_definition
+        definition = expression_definition(definition, aliases, dict(_INCLUDE_DEFINITIONS))
+    _INCLUDE_DEFINITIONS[name] = definition
+    _DEFINED_INCLUDE_VERSIONS[name] = _DEFINED_INCLUDE_VERSIONS.get(name, 0) + 1
+    return get_defined_include(name, survey)
+
+
+def get_defined_include(name, survey=None):
+    """
+    Returns a named include array defined with define_include, building it on first use.
+    :param name: The name of the include array
+    :param survey: The survey. Defaults to the current survey.
+    :return: An IncludeSet of respondent IDs
+    """
+    includes = get_survey(survey).get_cache(_DEFINED_INCLUDES)
+    version = _DEFINED_INCLUDE_VERSIONS[name]
+    if name not in includes or includes[name][0] != version:
+        results = get_survey(survey).get_results_file()
+        includes[name] = (version, IncludeSet(_INCLUDE_DEFINITIONS[name](results), results.index))
+    return includes[name][1]
+
+
+def get_defined_include_names():
+    """
+    Returns the names of the include arrays defined with define_include, in the order they were defined.
+    :return: A list of names
+    """
+    return list(_INCLUDE_DEFINITIONS)
+
+
+def clear_defined_includes(survey=None):
+    """
+    Removes every include array a survey built from a definition. The definitions are kept and the include arrays
+    rebuilt when next requested.
+    :param survey: The survey. Defaults to the current survey.
+    :return:
+    """
+    get_survey(survey).get_cache(_DEFINED_INCLUDES).clear()
+
+
+def _append_defined_includes(survey, includes, rows):
+    """
+    Extends every include array built from a definition with appended responses, evaluating the definition on the new
+    rows only.
+    :param survey: The survey
+    :param includes: The survey's cache of defined include arrays
+    :param rows: A dataframe of the appended responses
+    :return:
+    """
+    index = survey.get_results_file().index
+    for name, (version, include) in list(includes.items()):
+        mask = np.concatenate([include.mask, np.asarray(_INCLUDE_DEFINITIONS[name](rows), dtype=bool)])
+        includes[name] = (version, IncludeSet(mask, index))
+
+
+register_append_hook(_DEFINED_INCLUDES, _append_defined_includes)
@@ -0,0 +1,379 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+This file compiles include expressions to include arrays. An include expression describes the respondents to include
+in a single string, for example:
+
+    SAL1 in {phd, master} & PI1 == 'Yes' & !SAL6 == coop
+
+Comparisons are written as CODE == value, CODE != value or CODE in {value, value, ...}. Values are quoted strings,
+numbers or bare words. Bare words found in the aliases dictionary are replaced by the answer they stand for, so long
+answers only need to be written once, while quoted strings are always taken literally. Comparisons are combined with & (and), | (or) and - (and not), negated with ! or ~ and
+grouped with parentheses. A bare name refers to another include expression, include array or include definition
+passed as names.
+
+Expressions are compiled to a tree whose nodes are hashable. Evaluating a set of expressions shares one cache of masks
+keyed by these nodes, so a subexpression used by several includes is computed once, and each comparison is a table
+lookup over the encoded responses of its code, so every column of the results file is scanned at most once.
+"""
+
+import re
+
+import numpy as np
+
+from maclime.config import get_survey
+from maclime.frequencies import encode_responses
+from maclime.include_arrays import IncludeSet, as_include_set
+
+# Name of the survey cache of evaluated subexpressions.
+_MASKS = 'include_expression_masks'
+
+_TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+      | (?P<number>\d+(?:\.\d+)?(?![\w(]))
+      | (?P<operator>==|!=|[&|!~(){},-])
+      | (?P<name>[A-Za-z_][\w.]*(?:\([\w.]+\))?)
+    )""", re.VERBOSE)
+
+
+def _tokenize(expression):
+    """
+    Splits an include expression into tokens.
+    :param expression: The include expression
+    :return: A list of (kind, value) tuples
+    """
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN_PATTERN.match(expression, position)
+        if match is None or match.end() == position:
+            raise ValueError("Unexpected character {!r} at position {} of {!r}."
+                             .format(expression[position:].strip()[:1], position, expression))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        elif kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        elif kind == 'name' and value == 'in':
+            kind = 'operator'
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    A recursive descent parser turning the tokens of an include expression into a tree of tuples.
+    """
+
+    def __init__(self, expression, aliases, names, compiling=()):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.position = 0
+        self.aliases = aliases
+        self.names = names
+        # The names whose expressions are being compiled around this one, to detect names referring to each other.
+        self.compiling = compiling
+
+    def parse(self):
+        node = self._or()
+        if self.position < len(self.tokens):
+            self._fail("Unexpected {!r}".format(self.tokens[self.position][1]))
+        return node
+
+    def _fail(self, message):
+        raise ValueError("{} in include expression {!r}.".format(message, self.expression))
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _accept(self, *operators):
+        kind, value = self._peek()
+        if kind == 'operator' and value in operators:
+            self.position += 1
+            return value
+        return None
+
+    def _expect(self, operator):
+        if self._accept(operator) is None:
+            self._fail("Expected {!r}".format(operator))
+
+    def _or(self):
+        children = [self._and()]
+        while self._accept('|'):
+            children.append(self._and())
+        return _combine('or', children)
+
+    def _and(self):
+        children = [self._unary()]
+        while True:
+            operator = self._accept('&', '-')
+            if operator is None:
+                return _combine('and', children)
+            child = self._unary()
+            children.append(child if operator == '&' else _negate(child))
+
+    def _unary(self):
+        if self._accept('!', '~'):
+            return _negate(self._unary())
+        return self._primary()
+
+    def _primary(self):
+        if self._accept('('):
+            node = self._or()
+            self._expect(')')
+            return node
+        kind, name = self._peek()
+        if kind != 'name':
+            self._fail("Expected a question code or name")
+        self.position += 1
+        operator = self._accept('==', '!=', 'in')
+        if operator is None:
+            return self._reference(name)
+        if operator == 'in':
+            self._expect('{')
+            values = [self._value()]
+            while self._accept(','):
+                values.append(self._value())
+            self._expect('}')
+        else:
+            values = [self._value()]
+        node = ('in', name, tuple(sorted(set(values), key=repr)))
+        return _negate(node) if operator == '!=' else node
+
+    def _value(self):
+        negative = self._accept('-') is not None
+        kind, value = self._peek()
+        if kind not in ('string', 'number', 'name') or (negative and kind != 'number'):
+            self._fail("Expected a value")
+        self.position += 1
+        if negative:
+            return -value
+        if kind == 'name' and value in self.aliases:
+            return self.aliases[value]
+        return value
+
+    def _reference(self, name):
+        if name not in self.names:
+            self._fail("Unknown name {!r}".format(name))
+        target = self.names[name]
+        if isinstance(target, str):
+            if name in self.compiling:
+                cycle = self.compiling[self.compiling.index(name):] + (name,)
+                self._fail("Names refer to each other in a cycle {}".format(" -> ".join(map(repr, cycle))))
+            return _Parser(target, self.aliases, self.names, self.compiling + (name,)).parse()
+        return ('include', name)
+
+
+def _combine(operator, children):
+    """
+    Combines nodes with and/or, flattening nested nodes of the same operator and sorting the children so that
+    equivalent expressions compile to the same node.
+    :param operator: 'and' or 'or'
+    :param children: A list of nodes
+    :return: A node
+    """
+    flat = set()
+    for child in children:
+        if child[0] == operator:
+            flat.update(child[1])
+        else:
+            flat.add(child)
+    if len(flat) == 1:
+        return flat.pop()
+    return operator, tuple(sorted(flat, key=repr))
+
+
+def _negate(node):
+    """
+    Negates a node, removing double negations.
+    :param node: A node
+    :return: A node
+    """
+    if node[0] == 'not':
+        return node[1]
+    return 'not', node
+
+
+def format_value(value):
+    """
+    Formats an answer as a value of an include expression. Strings are quoted and numbers are written as they are.
+    :param value: An answer
+    :return: A string
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return "'{}'".format(str(value).replace("\\", "\\\\").replace("'", "\\'"))
+
+
+def compile_include(expression, aliases=None, names=None):
+    """
+    Compiles an include expression to a tree of nodes. Names of other include expressions are compiled into the tree.
+    :param expression: The include expression
+    :param aliases: A dictionary mapping words used as values to the answers they stand for
+    :param names: A dictionary mapping names used in the expression to include expressions or include arrays
+    :return: The root node of the tree
+    """
+    return _Parser(expression, aliases or {}, names or {}).parse()
+
+
+def _question_codes(node):
+    """
+    Returns the question codes a node compares answers of.
+    :param node: A node
+    :return: A set of question codes
+    """
+    if node[0] == 'in':
+        return {node[1]}
+    if node[0] == 'include':
+        return set()
+    if node[0] == 'not':
+        return _question_codes(node[1])
+    return set().union(*[_question_codes(child) for child in node[1]])
+
+
+def _check_codes(node, columns, expression):
+    """
+    Raises a ValueError if a node compares answers of a question code that is not a column of the results file.
+    :param node: A node
+    :param columns: The columns of the results file
+    :param expression: The include expression the node was compiled from, for the error message
+    :return:
+    """
+    unknown = sorted(code for code in _question_codes(node) if code not in columns)
+    if unknown:
+        raise ValueError("Unknown question code {!r} in include expression {!r}.".format(unknown[0], expression))
+
+
+def _evaluate(node, survey, names, masks):
+    """
+    Evaluates a node to a boolean mask over the results file, reusing and filling a cache of masks.
+    Masks of nodes that do not depend on include arrays passed by name are cached.
+    :param node: A node
+    :param survey: The survey
+    :param names: A dictionary mapping names to include arrays or include definitions, for include nodes
+    :param masks: A dictionary of masks keyed by node
+    :return: A read-only boolean array
+    """
+    if node[0] == 'include':
+        target = names[node[1]]
+        results = survey.get_results_file()
+        if callable(target):
+            return np.asarray(target(results), dtype=bool)
+        return as_include_set(target, results.index).mask
+    if node in masks:
+        return masks[node]
+    operator = node[0]
+    if operator == 'in':
+        codes, categories = encode_responses(node[1], survey)
+        values = set(node[2])
+        table = np.array([category in values for category in categories] + [False], dtype=bool)
+        mask = table[codes]
+    elif operator == 'not':
+        mask = ~_evaluate(node[1], survey, names, masks)
+    else:
+        children = [_evaluate(child, survey, names, masks) for child in node[1]]
+        mask = np.logical_and.reduce(children) if operator == 'and' else np.logical_or.reduce(children)
+    mask.setflags(write=False)
+    if not _refers_to_names(node):
+        masks[node] = mask
+    return mask
+
+
+def _refers_to_names(node):
+    """
+    Returns whether a node depends on include arrays passed by name. Such nodes are not cached because the same name
+    can refer to different include arrays in different calls.
+    :param node: A node
+    :return: True or False
+    """
+    if node[0] == 'include':
+        return True
+    if node[0] == 'in':
+        return False
+    if node[0] == 'not':
+        return _refers_to_names(node[1])
+    return any(_refers_to_names(child) for child in node[1])
+
+
+def _evaluate_rows(node, rows, names):
+    """
+    Evaluates a node on a dataframe of rows of the results file without using the survey's caches.
+    :param node: A node
+    :param rows: A dataframe of rows of the results file
+    :param names: A dictionary mapping names to include arrays or include definitions, for include nodes
+    :return: A boolean array with an entry for each row
+    """
+    operator = node[0]
+    if operator == 'include':
+        target = names[node[1]]
+        if callable(target):
+            return np.asarray(target(rows), dtype=bool)
+        return np.asarray([respondent in target for respondent in rows.index], dtype=bool)
+    if operator == 'in':
+        return rows[node[1]].isin(node[2]).to_numpy(dtype=bool)
+    if operator == 'not':
+        return ~_evaluate_rows(node[1], rows, names)
+    children = [_evaluate_rows(child, rows, names) for child in node[1]]
+    return np.logical_and.reduce(children) if operator == 'and' else np.logical_or.reduce(children)
+
+
+def evaluate_include(expression, aliases=None, names=None, survey=None):
+    """
+    Returns the include array described by an include expression.
+    :param expression: The include expression, or a node returned by compile_include
+    :param aliases: A dictionary mapping words used as values to the answers they stand for
+    :param names: A dictionary mapping names used in the expression to include expressions or include arrays
+    :param survey: The survey. Defaults to the current survey.
+    :return: An IncludeSet of respondent IDs
+    """
+    survey = get_survey(survey)
+    names = names or {}
+    node = compile_include(expression, aliases, names) if isinstance(expression, str) else expression
+    _check_codes(node, survey.get_results_file().columns, expression)
+    mask = _evaluate(node, survey, names, survey.get_cache(_MASKS))
+    return IncludeSet(mask, survey.get_results_file().index)
+
+
+def evaluate_includes(expressions, aliases=None, survey=None):
+    """
+    Returns the include arrays described by a dictionary of include expressions. Expressions can refer to each other
+    by name, and every subexpression shared between them is evaluated once.
+    :param expressions: A dictionary mapping names to include expressions or include arrays
+    :param aliases: A dictionary mapping words used as values to the answers they stand for
+    :param survey: The survey. Defaults to the current survey.
+    :return: A dictionary mapping each name to an IncludeSet of respondent IDs
+    """
+    survey = get_survey(survey)
+    includes = {}
+    for name, expression in expressions.items():
+        if isinstance(expression, str):
+            includes[name] = evaluate_include(expression, aliases, expressions, survey)
+        else:
+            includes[name] = as_include_set(expression, survey=survey)
+    return includes
+
+
+def expression_definition(expression, aliases=None, names=None):
+    """
+    Returns a definition for maclime.include_arrays.define_include that evaluates an include expression on rows of
+    the results file, so that the include array is extended when responses are appended.
+    :param expression: The include expression
+    :param aliases: A dictionary mapping words used as values to the answers they stand for
+    :param names: A dictionary mapping names used in the expression to include expressions or include arrays
+    :return: A function of a dataframe of rows returning a boolean array
+    """
+    names = names or {}
+    node = compile_include(expression, aliases, names)
+
+    def definition(rows):
+        _check_codes(node, rows.columns, expression)
+        return _evaluate_rows(node, rows, names)
+    return definition
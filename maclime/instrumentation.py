@@ -0,0 +1,306 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+This file measures where the time and memory of an analysis go. Instrumentation is off by default and costs a single
+check per call of an instrumented function. Turn it on around a run with:
+
+    with instrument(memory=True) as instrumentation:
+        ...
+    report = instrumentation.report()
+
+The hot paths of maclime are instrumented with the instrumented decorator and grouped into stages: excel (reading
+results and statistics files), read_statistics, questions, scoring, utils, analysis, and the stats and figure callbacks
+run by maclime.analysis.analyze. For each function the number of calls, the wall time including and excluding the
+instrumented functions it calls and, when memory is measured, the peak memory allocated during a call are recorded.
+Memory is measured with tracemalloc, which slows Python down considerably, so it is off unless asked for.
+
+Only the current process is measured. Work done by worker processes of run_analyses or a FigureQueue is not recorded.
+"""
+
+import contextlib
+import functools
+import json
+import threading
+import time
+import tracemalloc
+
+# The instrumentation recording calls, or None when instrumentation is off.
+_ACTIVE = None
+
+
+class Instrumentation:
+    """
+    This class records the calls of instrumented functions while it is active.
+
+    Attributes:
+        memory: Whether the peak memory of each call is measured with tracemalloc
+        functions: Records of each instrumented function keyed by name
+        stages: Records of each stage keyed by stage name
+
+    Methods:
+        start: Starts recording calls
+        stop: Stops recording calls
+        report: Returns the records as a dictionary
+        to_json: Returns the report as a JSON string and optionally writes it to a file
+        summary: Returns one line per stage describing its calls, time and memory
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.functions = {}
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_tracemalloc = False
+        self._start_time = None
+        self._seconds = 0.0
+        self._peak_bytes = 0
+
+    def start(self):
+        """
+        Starts recording calls. Starts tracemalloc if memory is measured and it is not already tracing.
+        :return:
+        """
+        global _ACTIVE
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if self.memory:
+            tracemalloc.reset_peak()
+        self._start_time = time.perf_counter()
+        _ACTIVE = self
+
+    def stop(self):
+        """
+        Stops recording calls.
+        :return:
+        """
+        global _ACTIVE
+        if _ACTIVE is self:
+            _ACTIVE = None
+        if self._start_time is not None:
+            self._seconds += time.perf_counter() - self._start_time
+            self._start_time = None
+        if self.memory and tracemalloc.is_tracing():
+            self._peak_bytes = max(self._peak_bytes, tracemalloc.get_traced_memory()[1])
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+            self._local.stage_depth = {}
+        return stack
+
+    def _enter(self, name, stage):
+        """
+        Records the start of a call.
+        :param name: The name of the function
+        :param stage: The stage of the function
+        :return: The frame of the call
+        """
+        stack = self._stack()
+        frame = {'name': name, 'stage': stage, 'children': 0.0, 'start_bytes': 0, 'peak_bytes': 0}
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]['peak_bytes'] = max(stack[-1]['peak_bytes'], peak)
+            tracemalloc.reset_peak()
+            frame['start_bytes'] = frame['peak_bytes'] = current
+        stage_depth = self._local.stage_depth
+        stage_depth[stage] = stage_depth.get(stage, 0) + 1
+        stack.append(frame)
+        frame['start'] = time.perf_counter()
+        return frame
+
+    def _exit(self, frame):
+        """
+        Records the end of a call.
+        :param frame: The frame returned by _enter
+        :return:
+        """
+        elapsed = time.perf_counter() - frame['start']
+        stack = self._stack()
+        stack.pop()
+        stage_depth = self._local.stage_depth
+        stage_depth[frame['stage']] -= 1
+        peak_bytes = 0
+        if self.memory and tracemalloc.is_tracing():
+            frame['peak_bytes'] = max(frame['peak_bytes'], tracemalloc.get_traced_memory()[1])
+            peak_bytes = frame['peak_bytes'] - frame['start_bytes']
+            if stack:
+                stack[-1]['peak_bytes'] = max(stack[-1]['peak_bytes'], frame['peak_bytes'])
+        if stack:
+            stack[-1]['children'] += elapsed
+        self_seconds = elapsed - frame['children']
+        # Time spent in a stage is only counted by the outermost call of the stage, so that nested calls are not
+        # counted twice.
+        outermost = stage_depth[frame['stage']] == 0
+        with self._lock:
+            _add(self.functions.setdefault(frame['name'], _record(frame['stage'])),
+                 elapsed, self_seconds, peak_bytes)
+            _add(self.stages.setdefault(frame['stage'], _record()),
+                 elapsed if outermost else 0.0, self_seconds, peak_bytes)
+
+    def report(self):
+        """
+        Returns the records as a dictionary.
+        :return: A dictionary with the total seconds and peak bytes of the run and a dictionary of records for each
+                 stage and function. Each record holds calls, seconds, self_seconds and peak_bytes, where seconds
+                 includes and self_seconds excludes the time spent in other instrumented functions.
+        """
+        seconds = self._seconds
+        if self._start_time is not None:
+            seconds += time.perf_counter() - self._start_time
+        peak_bytes = self._peak_bytes
+        if self.memory and _ACTIVE is self and tracemalloc.is_tracing():
+            peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1])
+        with self._lock:
+            return {'seconds': seconds,
+                    'peak_bytes': peak_bytes if self.memory else None,
+                    'stages': {stage: dict(record) for stage, record in self.stages.items()},
+                    'functions': {name: dict(record) for name, record in self.functions.items()}}
+
+    def to_json(self, path=None):
+        """
+        Returns the report as a JSON string.
+        :param path: A file to write the report to, if any
+        :return: The JSON string
+        """
+        text = json.dumps(self.report(), indent=2)
+        if path is not None:
+            with open(path, 'w') as file:
+                file.write(text)
+        return text
+
+    def summary(self):
+        """
+        Returns one line per stage describing its calls, time and memory, slowest stage first.
+        :return: A string
+        """
+        report = self.report()
+        lines = []
+        for stage, record in sorted(report['stages'].items(), key=lambda item: -item[1]['self_seconds']):
+            line = "{}: {} calls, {:.3f} s ({:.3f} s self)".format(stage, record['calls'], record['seconds'],
+                                                                   record['self_seconds'])
+            if self.memory:
+                line += ", peak {:.1f} MiB".format(record['peak_bytes'] / 2 ** 20)
+            lines.append(line)
+        total = "total: {:.3f} s".format(report['seconds'])
+        if self.memory:
+            total += ", peak {:.1f} MiB".format(report['peak_bytes'] / 2 ** 20)
+        lines.append(total)
+        return "\n".join(lines)
+
+
+def _record(stage=None):
+    record = {'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0, 'peak_bytes': 0}
+    if stage is not None:
+        record['stage'] = stage
+    return record
+
+
+def _add(record, seconds, self_seconds, peak_bytes):
+    record['calls'] += 1
+    record['seconds'] += seconds
+    record['self_seconds'] += self_seconds
+    record['peak_bytes'] = max(record['peak_bytes'], peak_bytes)
+
+
+def instrumented(stage, name=None):
+    """
+    Decorates a function so that its calls are recorded while instrumentation is on.
+    :param stage: The stage the function belongs to
+    :param name: The name of the function in reports. Defaults to its module and qualified name.
+    :return: The decorator
+    """
+    def decorator(function):
+        label = name or "{}.{}".format(function.__module__.rsplit('.', 1)[-1], function.__qualname__)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            instrumentation = _ACTIVE
+            if instrumentation is None:
+                return function(*args, **kwargs)
+            frame = instrumentation._enter(label, stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                instrumentation._exit(frame)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def timed(name, stage):
+    """
+    Records a block of code as a call of a function while instrumentation is on.
+    :param name: The name of the block in reports
+    :param stage: The stage the block belongs to
+    :return:
+    """
+    instrumentation = _ACTIVE
+    if instrumentation is None:
+        yield
+        return
+    frame = instrumentation._enter(name, stage)
+    try:
+        yield
+    finally:
+        instrumentation._exit(frame)
+
+
+def get_instrumentation():
+    """
+    Returns the active instrumentation.
+    :return: An Instrumentation, or None when instrumentation is off
+    """
+    return _ACTIVE
+
+
+def enable_instrumentation(memory=False):
+    """
+    Turns instrumentation on, replacing any active instrumentation.
+    :param memory: Whether to measure the peak memory of each call with tracemalloc
+    :return: The Instrumentation recording calls
+    """
+    if _ACTIVE is not None:
+        _ACTIVE.stop()
+    instrumentation = Instrumentation(memory)
+    instrumentation.start()
+    return instrumentation
+
+
+def disable_instrumentation():
+    """
+    Turns instrumentation off.
+    :return: The Instrumentation that was recording calls, or None
+    """
+    instrumentation = _ACTIVE
+    if instrumentation is not None:
+        instrumentation.stop()
+    return instrumentation
+
+
+@contextlib.contextmanager
+def instrument(memory=False, print_summary=True, path=None):
+    """
+    Turns instrumentation on for a block of code.
+    :param memory: Whether to measure the peak memory of each call with tracemalloc
+    :param print_summary: Whether to print the summary at the end of the block
+    :param path: A file to write the JSON report to at the end of the block, if any
+    :return: The Instrumentation recording calls
+    """
+    instrumentation = enable_instrumentation(memory)
+    try:
+        yield instrumentation
+    finally:
+        instrumentation.stop()
+        if path is not None:
+            instrumentation.to_json(path)
+        if print_summary:
+            print(instrumentation.summary())
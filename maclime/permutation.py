@@ -0,0 +1,223 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+This file contains a permutation test on the difference in means of two samples, usable wherever a p_test callback is
+accepted, for example by get_stats_comparison, maclime.analysis.analyze or maclime.analysis.compare_subgroups.
+
+Permutations are drawn in batches. For two arrays of scores, a batch is a matrix of indices into the pooled scores
+with a row for each permutation, so a batch is evaluated with a few NumPy calls instead of a Python loop. For the
+per-score counts used by compare_subgroups, relabelling respondents at random is the same as drawing the counts of
+the first sample from a multivariate hypergeometric distribution, which is drawn one score level at a time for every
+subgroup and code of a section at once.
+
+Every test draws its random numbers from a stream derived from the test's numpy SeedSequence and a digest of its
+inputs, so a seeded test always gives the same p-value for the same data, whatever other tests ran before it in the
+process or in which worker process it runs. Sampling stops early once a p-value is clearly above or below alpha.
+"""
+
+import numpy as np
+from scipy.special import ndtri
+
+from maclime.instrumentation import instrumented
+from maclime.utils import seeded_generator
+
+# Largest number of entries in an index matrix of a batch.
+MAX_BATCH_ENTRIES = 2 ** 24
+
+
+class PermutationTest:
+    """
+    This class is a two-sided permutation test on the difference in means of two samples. Call an instance with two
+    arrays of scores to get a p-value, or pass it as a p_test callback.
+
+    Attributes:
+        permutations: The largest number of permutations drawn for a test
+        batch_size: The number of permutations drawn at a time
+        alpha: The significance level used to decide when to stop early
+        confidence: The confidence with which a p-value must be above or below alpha to stop early, or None to
+                    always draw every permutation
+        seed_sequence: The numpy SeedSequence the random numbers of each test are derived from, with its inputs
+
+    Methods:
+        counts_test: Tests every element of arrays of per-level counts at once
+        spawn: Returns independent child tests with other seeds
+    """
+
+    def __init__(self, permutations=10000, batch_size=1000, seed=None, alpha=0.05, confidence=0.999):
+        """
+        :param permutations: The largest number of permutations drawn for a test
+        :param batch_size: The number of permutations drawn at a time
+        :param seed: An integer seed or a numpy SeedSequence. None seeds the test from fresh entropy.
+        :param alpha: The significance level used to decide when to stop early
+        :param confidence: The confidence with which a p-value must be above or below alpha to stop early, or None to
+                           always draw every permutation
+        """
+        if permutations < 1 or batch_size < 1:
+            raise ValueError("A permutation test needs at least one permutation in each batch.")
+        self.permutations = permutations
+        self.batch_size = batch_size
+        self.alpha = alpha
+        self.confidence = confidence
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+
+    def __repr__(self):
+        return "PermutationTest(permutations={}, batch_size={}, alpha={}, confidence={})".format(
+            self.permutations, self.batch_size, self.alpha, self.confidence)
+
+    def spawn(self, n):
+        """
+        Returns independent child tests with the same settings.
+        :param n: The number of child tests
+        :return: A list of PermutationTests
+        """
+        return [PermutationTest(self.permutations, self.batch_size, child, self.alpha, self.confidence)
+                for child in self.seed_sequence.spawn(n)]
+
+    def _generator(self, *arrays):
+        return seeded_generator(self.seed_sequence, *arrays)
+
+    @instrumented('utils', name='permutation.PermutationTest')
+    def __call__(self, data, comp):
+        """
+        Returns the p-value of the difference in means of two samples. NaN values are ignored.
+        :param data: The data
+        :param comp: The comparison data
+        :return: The p-value, or None if either sample is empty
+        """
+        data = np.asarray(data, dtype=np.float64)
+        comp = np.asarray(comp, dtype=np.float64)
+        data = data[~np.isnan(data)]
+        comp = comp[~np.isnan(comp)]
+        if not len(data) or not len(comp):
+            return None
+        pooled = np.concatenate([data, comp])
+        n1, n = len(data), len(pooled)
+        # Draw the smaller sample so that index matrices are as small as possible.
+        drawn, size = (1, n1) if n1 <= n - n1 else (-1, n - n1)
+        total = pooled.sum()
+        rows = max(1, min(self.batch_size, MAX_BATCH_ENTRIES // n))
+        rng = self._generator(data, comp)
+
+        def draw(b):
+            keys = rng.random((b, n))
+            indices = np.argpartition(keys, size - 1, axis=1)[:, :size] if size < n else np.argsort(keys, axis=1)
+            sums = pooled[indices].sum(axis=1)
+            return sums if drawn == 1 else total - sums
+
+        observed = _mean_difference(np.array([data.sum()]), total, n1, n - n1)
+        pvalue = self._run(observed, lambda active, b: draw(b)[:, None], np.array([total]), np.array([n1]),
+                           np.array([n - n1]), rows)
+        return float(pvalue[0])
+
+    @instrumented('utils', name='permutation.PermutationTest.counts_test')
+    def counts_test(self, counts, comp_counts, levels=None):
+        """
+        Tests every element of arrays of per-level counts at once. Both arrays hold counts of the same sorted levels
+        on their last axis, and any leading axes, for example subgroup x code, are tested element by element.
+        :param counts: An array of counts for the data
+        :param comp_counts: An array of counts for the comparison data
+        :param levels: The sorted levels. Defaults to 0, 1, 2, ..., which gives the same p-values whenever the levels
+                       are evenly spaced.
+        :return: An array of p-values, NaN where either sample is empty
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        comp_counts = np.asarray(comp_counts, dtype=np.int64)
+        shape = np.broadcast_shapes(counts.shape, comp_counts.shape)
+        k = shape[-1]
+        counts = np.broadcast_to(counts, shape).reshape(-1, k)
+        comp_counts = np.broadcast_to(comp_counts, shape).reshape(-1, k)
+        if levels is None:
+            levels = np.arange(k, dtype=np.float64)
+        levels = np.asarray(levels, dtype=np.float64)
+
+        pooled = counts + comp_counts
+        # The number of pooled values above each level, used as the bad items of each hypergeometric draw.
+        above = pooled.sum(axis=1, keepdims=True) - np.cumsum(pooled, axis=1)
+        n1 = counts.sum(axis=1)
+        n2 = comp_counts.sum(axis=1)
+        total = pooled @ levels
+        pvalue = np.full(len(counts), np.nan)
+        valid = np.flatnonzero((n1 > 0) & (n2 > 0))
+        if len(valid):
+            rng = self._generator(counts[valid], comp_counts[valid], levels)
+
+            def draw(active, b):
+                elements = valid[active]
+                remaining = np.broadcast_to(n1[elements], (b, len(elements))).copy()
+                sums = np.zeros((b, len(elements)))
+                for level in range(k - 1):
+                    taken = rng.hypergeometric(pooled[elements, level], above[elements, level], remaining)
+                    sums += taken * levels[level]
+                    remaining -= taken
+                return sums + remaining * levels[-1]
+
+            observed = _mean_difference(counts[valid] @ levels, total[valid], n1[valid], n2[valid])
+            pvalue[valid] = self._run(observed, draw, total[valid], n1[valid], n2[valid], self.batch_size)
+        return pvalue.reshape(shape[:-1])
+
+    def _run(self, observed, draw, total, n1, n2, rows):
+        """
+        Draws batches of permutations until every test has drawn every permutation or is decided.
+        :param observed: An array of the absolute observed difference in means of each test
+        :param draw: A function of the positions of the tests still running and a number of permutations, returning
+                     a permutation x test array of the sums of the first sample
+        :param total: An array of the sum of the pooled samples of each test
+        :param n1: An array of the size of the first sample of each test
+        :param n2: An array of the size of the second sample of each test
+        :param rows: The number of permutations drawn at a time
+        :return: An array of p-values
+        """
+        exceeded = np.zeros(len(observed), dtype=np.int64)
+        drawn = np.zeros(len(observed), dtype=np.int64)
+        active = np.arange(len(observed))
+        # Differences within rounding error of the observed difference count as at least as extreme.
+        threshold = observed - 1e-9 * np.maximum(np.abs(observed), 1.0)
+        while len(active):
+            b = int(min(rows, self.permutations - drawn[active[0]]))
+            sums = draw(active, b)
+            differences = _mean_difference(sums, total[active], n1[active], n2[active])
+            exceeded[active] += np.sum(differences >= threshold[active], axis=0)
+            drawn[active] += b
+            running = drawn[active] < self.permutations
+            if self.confidence is not None:
+                running &= ~_decided(exceeded[active], drawn[active], self.alpha, self.confidence)
+            active = active[running]
+        return (exceeded + 1) / (drawn + 1)
+
+
+def _mean_difference(sums, total, n1, n2):
+    """
+    Returns the absolute difference in means of two samples from the sum of the first sample.
+    :param sums: An array of sums of the first sample
+    :param total: The sum of both samples
+    :param n1: The size of the first sample
+    :param n2: The size of the second sample
+    :return: An array of absolute differences in means
+    """
+    return np.abs(sums / n1 - (total - sums) / n2)
+
+
+def _decided(exceeded, drawn, alpha, confidence):
+    """
+    Returns whether the p-values of tests are above or below alpha with the given confidence, from the Wilson score
+    interval of the fraction of permutations at least as extreme as the observed difference.
+    :param exceeded: An array of the number of permutations at least as extreme as the observed difference
+    :param drawn: An array of the number of permutations drawn
+    :param alpha: The significance level
+    :param confidence: The two-sided confidence of the interval
+    :return: A boolean array
+    """
+    z = ndtri(1 - (1 - confidence) / 2)
+    p = exceeded / drawn
+    centre = (p + z ** 2 / (2 * drawn)) / (1 + z ** 2 / drawn)
+    half_width = z * np.sqrt(p * (1 - p) / drawn + z ** 2 / (4 * drawn ** 2)) / (1 + z ** 2 / drawn)
+    return (centre - half_width > alpha) | (centre + half_width < alpha)
+
+
+# A permutation test with the default settings, seeded so that p-values are reproducible between runs.
+permutation_test = PermutationTest(seed=0)
@@ -5,21 +5,35 @@ Created on June 27, 2023
 This module contains classes and methods for working with the questions and sections of a survey.
 """
 
+from collections import OrderedDict
+from functools import cached_property
+
 from maclime.read_results import get_included_responses
 from maclime.read_statistics import *
-from maclime.config import get_config
-from maclime.scoring import get_scored_data
+from maclime.config import get_survey
+from maclime.frequencies import get_answers, get_frequencies
+from maclime.include_arrays import as_include_set
+from maclime.instrumentation import instrumented
+from maclime.scoring import get_included_scores
+
+# Name of the survey cache holding the registry of Question objects keyed by (code, include fingerprint).
+# The least recently used question is evicted once a registry holds _QUESTION_REGISTRY_SIZE questions.
+_QUESTION_REGISTRY = 'questions'
+_QUESTION_REGISTRY_SIZE = 4096
 
 
 class Question:
     """
     This class will be used to store the data for each question.
+    Attributes other than the code, include and description are resolved on first access and cached, so building
+    a large set of questions is cheap until their data is actually read.
 
     Attributes:
         code (str): The code for the question.
         summary (str): The summary of the question.
-        include (list): The list of responses to include.
+        include (IncludeSet): The include array of respondents.
         description (str): The description of the question.
+        survey (Survey): The survey the question belongs to.
         question (str): The question.
         subquestion (str): The subquestion if applicable.
         responses (list): The responses for the question.
@@ -29,128 +43,123 @@ class Question:
         possible_answers (list): The possible answers for the question.
         counts (list): The counts for each possible answer.
         stats (list): The percentages for each possible answer.
-        error (str): Exceptions raised while instantiating object.
+        error (str): Exceptions raised while resolving attributes.
         data (DataFrame): The data for the question.
 
     """
     code = ""
-    summary = ""
     include = []
     description = ""
-    question = ""
-    subquestion = ""
-    responses = []
-    value_dict = {}
-    scores = []
-    question_headers = []
-    possible_answers = []
-    counts = []
-    stats = []
     error = ""
-    data = pd.DataFrame()
+    survey = None
 
-    def __init__(self, code=None, include=None, description=""):
-        config = get_config()
+    def __init__(self, code=None, include=None, description="", survey=None):
         if not code:
             raise Exception("No code provided.")
+        self.code = code
+        self.survey = get_survey(survey)
+        if code not in get_codex(self.survey) and code not in self.survey.get_results_file().columns:
+            self.error = "KeyError: {}".format(repr(code))
+        if not include:
+            include = self.survey.get_include_all()
+        self.include = include
+        self.description = description
+        if code == 'TEST':
+            self._init_test_question()
+
+    def _resolve(self, getter, default):
+        """
+        Calls getter and returns its value. Any exception is stored in the error attribute and default is returned.
+        :param getter: A function with no arguments
+        :param default: The value returned if getter raises an exception
+        :return: The value returned by getter or the default
+        """
         try:
-            _ = CODEX[code]
-            self.code = code
-        except KeyError as e:
-            self.error = "KeyError: {}".format(e)
-        try:
-            self.summary = get_summary(code)
-        except Exception as e:
-            self.error = e
-        try:
-            if not include:
-                self.include = config.get_include_all()
-            self.include = include
-        except Exception as e:
-            self.error = e
-        try:
-            self.description = description
-        except Exception as e:
-            self.error = e
-        try:
-            self.question = get_top_question(code)
-        except Exception as e:
-            self.error = e
-        try:
-            self.subquestion = get_subquestion(code)
-        except Exception as e:
-            self.error = e
-        try:
-            self.responses = get_included_responses(self.include, self.code)
-        except Exception as e:
-            self.error = e
-        try:
-            self.value_dict = config.get_value_dict(self.code)
-        except Exception as e:
-            self.error = e
-        try:
-            if self.value_dict:
-                self.scores = get_scored_data(self.responses, self.code, self.value_dict)
-        except Exception as e:
-            self.error = e
-        try:
-            self.question_headers = get_question_headers(code)
-        except Exception as e:
-            self.error = e
-        try:
-            self.possible_answers = get_possible_answers(code)
+            return getter()
         except Exception as e:
             self.error = e
-        self._populate_data()
-        if code == 'TEST':
-            self._init_test_question()
-        self._build_dataframe()
+            return default
+
+    @cached_property
+    def summary(self):
+        return self._resolve(lambda: get_summary(self.code, self.survey), "")
+
+    @cached_property
+    def question(self):
+        return self._resolve(lambda: get_top_question(self.code, self.survey), "")
+
+    @cached_property
+    def subquestion(self):
+        return self._resolve(lambda: get_subquestion(self.code, self.survey), "")
+
+    @cached_property
+    def responses(self):
+        return self._resolve(lambda: get_included_responses(self.code, self.include, self.survey), [])
+
+    @cached_property
+    def value_dict(self):
+        return self._resolve(lambda: self.survey.get_value_dict(self.code), {})
 
+    @cached_property
+    def scores(self):
+        if not self.value_dict:
+            return []
+        return self._resolve(lambda: get_included_scores(self.code, self.include, self.survey).tolist(), [])
+
+    @cached_property
+    def question_headers(self):
+        return self._resolve(lambda: get_question_headers(self.code, self.survey), [])
+
+    @cached_property
+    def possible_answers(self):
+        if self.code in get_codex(self.survey):
+            return self._resolve(lambda: get_possible_answers(self.code, self.survey), [])
+        return self._resolve(lambda: get_answers(self.code, self.survey), [])
+
+    @cached_property
+    def counts(self):
+        return self._populated_data[0]
+
+    @cached_property
+    def stats(self):
+        return self._populated_data[1]
+
+    @cached_property
+    def data(self):
+        return self._build_dataframe()
+
+    @instrumented('questions')
     def _build_dataframe(self):
         """
         Builds the dataframe for the question.
-        :return:
+        :return: The dataframe
         """
         df = pd.DataFrame(columns=self.question_headers)
         df['Answer'] = self.possible_answers
         df['Count'] = self.counts
         df['Percentage'] = self.stats
-        self.data = df
+        return df
 
-    def _populate_data(self):
+    @cached_property
+    @instrumented('questions')
+    def _populated_data(self):
         """
-        Populates the counts and stats attributes.
-        :return:
+        Computes the counts and stats attributes. Counts for all respondents are read from the statistics file when
+        the code is in it and no responses were appended since, otherwise they are computed from the results file.
+        :return: A tuple of the counts and the stats
         """
-        config = get_config()
-        if self.include == config.get_include_all():
-            try:
-                self.counts = get_counts(self.code)
-            except Exception as e:
-                self.error = e
-            try:
-                self.stats = get_data(self.code)
-            except Exception as e:
-                self.error = e
-        else:
-            try:
-                included_responses = get_included_responses(self.code, self.include)
-                counts = {}
-                percentages = {}
-                for answer in self.possible_answers:
-                    if answer == "Not completed or Not displayed":
-                        counts[answer] = None
-                        percentages[answer] = None
-                        continue
-                    counts[answer] = included_responses.count(answer)
-                    percentages[answer] = round(counts[answer]/len(included_responses) * 100, 1)
-                number_of_nan = get_number_of_nan_in_list(included_responses)
-                counts['No answer'] = number_of_nan
-                percentages['No answer'] = round(number_of_nan/len(included_responses) * 100, 1)
-                self.counts = counts.values()
-                self.stats = percentages.values()
-            except Exception as e:
-                self.error = e
+        survey = self.survey
+        if (self.include == survey.get_include_all() and self.code in get_codex(survey)
+                and not survey.get_appended_responses()):
+            counts = self._resolve(lambda: get_counts(self.code, self.survey), [])
+            stats = self._resolve(lambda: get_data(self.code, self.survey), [])
+            return counts, stats
+        try:
+            _, counts, percentages = get_frequencies(self.code, self.include, self.survey)
+            return counts, percentages
+        except Exception as e:
+            self.error = e
+            return [], []
 
     def _init_test_question(self):
         """
@@ -175,25 +184,81 @@ class Question:
         self.stats = [round(i/sum_counts, 1) for i in self.counts]
 
 
-def get_questions(include=None, codes=None):
+@instrumented('questions')
+def get_question(code, include=None, survey=None):
+    """
+    Returns the question for a code and include array from the survey's question registry, creating it if it is not
+    registered yet. Questions are shared, so callers should treat them as read-only.
+    :param code: The code for the question.
+    :param include: The inclusion criteria for the question. Defaults to all respondents.
+    :param survey: The survey. Defaults to the current survey.
+    :return: A Question object
+    """
+    survey = get_survey(survey)
+    if not include:
+        include = survey.get_include_all()
+    include = as_include_set(include, survey=survey)
+    registry = survey.get_cache(_QUESTION_REGISTRY, OrderedDict)
+    key = (code, include.fingerprint())
+    question = registry.get(key)
+    if question is not None:
+        registry.move_to_end(key)
+        return question
+    question = Question(code, include=include, survey=survey)
+    registry[key] = question
+    while len(registry) > _QUESTION_REGISTRY_SIZE:
+        registry.popitem(last=False)
+    return question
+
+
+def clear_question_registry(survey=None):
+    """
+    Removes every question from a survey's question registry.
+    :param survey: The survey. Defaults to the current survey.
+    :return:
+    """
+    get_survey(survey).get_cache(_QUESTION_REGISTRY, OrderedDict).clear()
+
+
+def set_question_registry_size(size, survey=None):
+    """
+    Sets the maximum number of questions held by each question registry, evicting the least recently used questions
+    of a survey's registry if necessary.
+    :param size: The maximum number of questions
+    :param survey: The survey. Defaults to the current survey.
+    :return:
+    """
+    global _QUESTION_REGISTRY_SIZE
+    if size < 1:
+        raise ValueError("The question registry must hold at least one question.")
+    _QUESTION_REGISTRY_SIZE = size
+    registry = get_survey(survey).get_cache(_QUESTION_REGISTRY, OrderedDict)
+    while len(registry) > _QUESTION_REGISTRY_SIZE:
+        registry.popitem(last=False)
+
+
+@instrumented('questions')
+def get_questions(include=None, codes=None, survey=None):
     """
     Returns a dictionary of questions from a list of codes and inclusion criteria. If codes is 'ALL', then all questions
-    are returned.
+    are returned. Questions are taken from the question registry.
     :param include: The inclusion criteria for the questions.
     :param codes: The codes for the questions.
+    :param survey: The survey. Defaults to the current survey.
     :return:
     """
     if not codes:
         raise Exception("No codes provided. Set codes to 'ALL' to get all questions.")
-    config = get_config()
+    config = get_survey(survey)
     all_questions = {}
 
     if not include:
         include = config.get_include_all()
+    include = as_include_set(include, survey=config)
     if codes == 'ALL':
-        codes = get_all_codes()
+        codes = get_all_codes(config)
     for code in codes:
-        all_questions[code] = Question(code, include=include)
+        all_questions[code] = get_question(code, include=include, survey=config)
     return all_questions
 
 
@@ -207,6 +272,7 @@ class QuestionSection:
         subtitle (str): The subtitle of the section.
         codes (list): The codes for the questions in the section.
         questions (dict): The questions in the section.
+        survey (Survey): The survey the section belongs to.
 
     Methods:
         get_questions: Gets the questions for the section.
@@ -218,14 +284,17 @@ class QuestionSection:
     include = []
     description = ""
     questions = None
+    survey = None
 
-    def __init__(self, top_code=None, title=None, subtitle=None, codes=None, include=None, description=""):
+    def __init__(self, top_code=None, title=None, subtitle=None, codes=None, include=None, description="",
+                 survey=None):
         self.top_code = top_code
         self.title = title
         self.subtitle = subtitle
         self.codes = codes
         self.include = include
         self.description = description
+        self.survey = get_survey(survey)
 
         if self.codes:
-            self.questions = get_questions(include=self.include, codes=self.codes)
+            self.questions = get_questions(include=self.include, codes=self.codes, survey=self.survey)
@@ -4,56 +4,102 @@ Created on May 18, 2022
 @author: Devin Burke
 
 This file holds functions for reading the limesurvey results file and extracting responses.
+Answer columns can be stored as pandas Categoricals, in which case responses are selected through the integer codes.
 
 """
 import pandas as pd
 
-from maclime.config import get_config
-CONFIG = get_config()
+from maclime.config import get_survey
+from maclime.frequencies import NOT_DISPLAYED, NO_ANSWER
+from maclime.include_arrays import IncludeSet
+from maclime.read_statistics import get_statistics_index
 
 
 # Returns list of responses for a question code
-def get_all_responses(code):
+def get_all_responses(code, survey=None):
     """
     Returns a list of all responses for a given question code.
     :param code: The question code
+    :param survey: The survey. Defaults to the current survey.
     :return: A list of responses
     """
-    keys = CONFIG.get_results_file().index.tolist()
-    values = CONFIG.get_results_file()[code].values.tolist()
+    results = get_survey(survey).get_results_file()
+    keys = results.index.tolist()
+    values = results[code].values.tolist()
     responses = {keys[i]: None if pd.isna(values[i]) else values[i] for i in range(len(keys))}
     return responses
 
 
-def get_single_response(code, resp_id):
+def get_single_response(code, resp_id, survey=None):
     """
     Returns a single response for a given question code and respondent ID.
     :param code: The question code
     :param resp_id: The respondent ID
+    :param survey: The survey. Defaults to the current survey.
     :return: A single response
     """
     response_id = int(resp_id)
-    response = CONFIG.get_results_file().loc[response_id, code]
+    response = get_survey(survey).get_results_file().loc[response_id, code]
     if pd.isna(response):
         return None
     else:
-        return CONFIG.get_results_file().loc[response_id, code]
+        return response
 
 
 # Returns only responses which have a corresponding True value in the include array
-def get_included_responses(code, include):
+def get_included_responses(code, include, survey=None):
     """
     Returns a list of responses for a given question code and include array.
     :param code: The question code
     :param include: The include array
+    :param survey: The survey. Defaults to the current survey.
     :return: A list of responses
     """
-    return CONFIG.get_results_file()[code][include].to_list()
+    column = get_survey(survey).get_results_file()[code]
+    if isinstance(include, IncludeSet):
+        if include.index is column.index or include.index.equals(column.index):
+            return column[include.mask].to_list()
+        include = include.tolist()
+    return column[include].to_list()
 
 
-def get_results():
+def get_results(survey=None):
     """
     Returns the results dataframe.
+    :param survey: The survey. Defaults to the current survey.
     :return: The results dataframe
     """
-    return CONFIG.get_results_file()
+    return get_survey(survey).get_results_file()
+
+
+def categorize_results(results, survey=None, like=None):
+    """
+    Converts the answer columns of a results dataframe to pandas Categoricals. The categories of a code are the
+    answers listed for it in the statistics file followed by any other answers in the order they first appear.
+    Columns that are not strings are left as they are.
+    :param results: A dataframe of responses
+    :param survey: The survey whose statistics file lists the answers. Defaults to the current survey.
+    :param like: A categorized results dataframe. When given, only its categorical columns are converted and their
+                 categories are kept, with new answers added at the end, so that the two frames can be concatenated.
+    :return: A dataframe with categorical answer columns
+    """
+    statistics_index = get_statistics_index(survey)
+    dtypes = {}
+    for code in results.columns:
+        column = results[code]
+        if like is not None:
+            if code not in like.columns or not isinstance(like[code].dtype, pd.CategoricalDtype):
+                continue
+            categories = list(like[code].cat.categories)
+        elif column.dtype != object and not isinstance(column.dtype, pd.StringDtype):
+            continue
+        else:
+            answers = statistics_index[code]['answers'] if code in statistics_index else []
+            categories = list(dict.fromkeys(answer for answer in answers
+                                            if not pd.isna(answer) and answer not in (NOT_DISPLAYED, NO_ANSWER)))
+        known = set(categories)
+        categories.extend(answer for answer in pd.unique(column.dropna().to_numpy()) if answer not in known)
+        dtypes[code] = pd.CategoricalDtype(categories)
+    if not dtypes:
+        return results
+    return results.astype(dtypes)
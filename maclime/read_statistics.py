@@ -4,18 +4,78 @@ Created on May 18, 2022
 @author: Devin Burke
 
 This file will allow you to read from the limesurvey statistics output file.
-This version of the code requires the statistics file but these data could
-be obtained from the results file in future versions.
+Answer counts can also be computed from the results file with maclime.frequencies,
+which only uses the statistics file to order the possible answers.
+The statistics file of each survey is parsed the first time it is needed and again after the survey changes.
 """
+import re
+
+import numpy as np
 import pandas as pd
-from maclime.utils import char_split, merge
 
-from maclime.config import get_config
-CONFIG = get_config()
-STATISTICS = CONFIG.get_statistics_file()
-INCLUDE_ALL = CONFIG.get_include_all()
+from maclime.cache import load_or_build
+from maclime.config import get_config, get_survey, register_append_hook
+from maclime.instrumentation import instrumented
+
+# Increment when the structure of the statistics index changes so that cached indexes are rebuilt.
+_INDEX_VERSION = 1
+# Matches the code in a summary row such as "Summary for AE0(SQ001)[subquestion]".
+# The code is the third word of the row up to and including the first closing bracket.
+_SUMMARY_PATTERN = r'^\s*Summary\s+\S+\s+([^)\s]*\)?)'
+# Matches the subquestion, everything after the first opening square bracket except the last character.
+_SUBQUESTION_PATTERN = r'\[(.*).$'
+# Matches an answer followed by its answer code such as "Strongly agree (A7)".
+_ANSWER_PATTERN = r'^([^(]*).\(.*$'
 
-# data = statistics_file
+
+@instrumented('read_statistics')
+def generate_statistics_index(statistics_file):
+    """
+    Parses the statistics file in a single pass. Each question code maps to a dictionary holding its block of rows in
+    the statistics file and its pre-parsed contents.
+
+    :param statistics_file: A pandas dataframe of the statistics file
+    :return: A dictionary mapping each code to a dictionary with the keys row, block, summary, question, subquestion,
+             headers, answers, counts and percentages
+    """
+    statistics_index = {}
+    if statistics_file is None or statistics_file.empty:
+        return statistics_index
+    first_column = statistics_file.iloc[:, 0]
+    is_text = first_column.map(type).eq(str).to_numpy()
+    text = first_column.where(is_text)
+    codes = text.str.extract(_SUMMARY_PATTERN, expand=False)
+    summary_rows = np.flatnonzero(codes.notna().to_numpy())
+    if summary_rows.size == 0:
+        return statistics_index
+
+    values = statistics_file.iloc[:, :3].to_numpy(dtype=object)
+    blank_rows = np.flatnonzero(statistics_file.iloc[:, 2].isna().to_numpy())
+    starts = summary_rows + 3
+    stops = np.append(blank_rows, len(values))[np.searchsorted(blank_rows, starts)]
+    stops = np.maximum(stops, starts)
+
+    subquestions = text.iloc[summary_rows].str.extract(_SUBQUESTION_PATTERN, flags=re.S, expand=False).fillna("")
+    answer_rows = np.zeros(len(values), dtype=bool)
+    for start, stop in zip(starts, stops):
+        answer_rows[start:stop] = True
+    answers = text.str.replace(_ANSWER_PATTERN, r'\1', regex=True, flags=re.S).where(is_text, first_column)
+    answers = answers.to_numpy(dtype=object)
+
+    for i, row in enumerate(summary_rows.tolist()):
+        start, stop = int(starts[i]), int(stops[i])
+        statistics_index[codes.iat[row]] = {
+            'row': row,
+            'block': slice(row, stop),
+            'summary': values[row, 0],
+            'question': values[row + 1, 0] if row + 1 < len(values) else None,
+            'subquestion': subquestions.iat[i],
+            'headers': values[row + 2, 0:3].tolist() if row + 2 < len(values) else [],
+            'answers': answers[start:stop].tolist(),
+            'counts': values[start:stop, 1].tolist(),
+            'percentages': [round(dat * 100, 1) for dat in values[start:stop, 2].tolist()],
+        }
+    return statistics_index
 
 
 def generate_codex(statistics_file):
@@ -25,151 +85,146 @@ def generate_codex(statistics_file):
     :param statistics_file: A pandas dataframe of the statistics file
     :return: A dictionary of the codes and their row numbers
     """
-    code_dict = {}
-    if statistics_file.empty:
-        return code_dict
-    else:
-        for i in range(len(statistics_file)):
-            ls = statistics_file.loc[i].values.tolist()
-            if isinstance(ls[0], str):
-                ls = ls[0].split()
-                if ls[0] == "Summary":
-                    code = ls[2]
-                    characters = char_split(code)
-                    ch = 0
-                    for char in characters:
-                        ch += 1
-                        if char == ")":
-                            break
-                    code = code[0:ch]
-                    code_dict[code] = i
-    return code_dict
+    return {code: entry['row'] for code, entry in generate_statistics_index(statistics_file).items()}
+
 
+@instrumented('read_statistics')
+def _load_statistics_index(config):
+    """
+    Returns the statistics index of a survey's statistics file, from the disk cache when the statistics file was read
+    through the cache.
+    :param config: The survey
+    :return: The statistics index
+    """
+    statistics = config.get_statistics_file()
+    key = config.get_statistics_key()
+    if key is None or config.get_cache_directory() is None:
+        return generate_statistics_index(statistics)
+    return load_or_build(config.get_cache_directory(), "{}-index-{}".format(key, _INDEX_VERSION),
+                         lambda: generate_statistics_index(statistics))
 
-CODEX = generate_codex(STATISTICS)
 
+# Names of the survey caches holding the parsed statistics file and its codex.
+_STATISTICS_INDEX = 'statistics_index'
+_CODEX = 'codex'
 
-def get_summary(code):
+
+def get_statistics_index(survey=None):
+    """
+    Returns the statistics index of a survey's statistics file, parsing it on first use.
+    :param survey: The survey. Defaults to the current survey.
+    :return: A dictionary returned by generate_statistics_index
+    """
+    survey = get_survey(survey)
+    return survey.get_cache(_STATISTICS_INDEX, lambda: _load_statistics_index(survey))
+
+
+def get_codex(survey=None):
+    """
+    Returns a dictionary of the codes in the statistics file and their row numbers.
+    :param survey: The survey. Defaults to the current survey.
+    :return: A dictionary of the codes and their row numbers
+    """
+    survey = get_survey(survey)
+    return survey.get_cache(_CODEX, lambda: {code: entry['row']
+                                             for code, entry in get_statistics_index(survey).items()})
+
+
+def _keep_statistics(survey, cache, rows):
+    """
+    Keeps the parsed statistics file when responses are appended, since the statistics file does not change.
+    :param survey: The survey
+    :param cache: The cache
+    :param rows: The appended responses
+    :return:
+    """
+
+
+register_append_hook(_STATISTICS_INDEX, _keep_statistics)
+register_append_hook(_CODEX, _keep_statistics)
+
+
+def __getattr__(name):
+    # The module level names that used to be computed at import time are computed on access.
+    if name == 'STATISTICS_INDEX':
+        return get_statistics_index()
+    if name == 'CODEX':
+        return get_codex()
+    if name == 'STATISTICS':
+        return get_config().get_statistics_file()
+    if name == 'INCLUDE_ALL':
+        return get_config().get_include_all()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def get_summary(code, survey=None):
     """
     Returns the summary of the question with the given code.
     :param code: The question code
+    :param survey: The survey. Defaults to the current survey.
     :return: The summary
     """
-    row = CODEX[code]
-    ls = STATISTICS.loc[row].values.tolist()
-    return ls[0]
+    return get_statistics_index(survey)[code]['summary']
 
 
-def get_top_question(code):
+def get_top_question(code, survey=None):
     """
     Returns the top question of the question with the given code.
     :param code: The question code
+    :param survey: The survey. Defaults to the current survey.
     :return: The top question
     """
-    row = CODEX[code]
-    ls = STATISTICS.loc[row + 1].values.tolist()
-    return ls[0]
+    return get_statistics_index(survey)[code]['question']
 
 
-def get_subquestion(code):
+def get_subquestion(code, survey=None):
     """
     Returns the subquestion of the question with the given code.
     :param code: The question code
+    :param survey: The survey. Defaults to the current survey.
     :return: The subquestion
     """
-    row = CODEX[code]
-    ls = STATISTICS.loc[row].values.tolist()
-    subq = ""
-    while True:
-        ls_check = ls[0].split()
-        if ls_check[0] == "Summary":
-            characters = char_split(ls[0])
-            ch = 0
-            for char in characters:
-                ch += 1
-                if char == "[":
-                    subq = merge(characters[ch:-1])
-                    break
-        break
-    return subq
-
-
-def get_question_headers(code):
+    return get_statistics_index(survey)[code]['subquestion']
+
+
+def get_question_headers(code, survey=None):
     """
     Returns the question headers of the question with the given code.
     :param code: The question code
+    :param survey: The survey. Defaults to the current survey.
     :return: The question headers
     """
-    row = CODEX[code]
-    ls = STATISTICS.loc[row + 2].values.tolist()
-    return ls[0:3] 
+    return list(get_statistics_index(survey)[code]['headers'])
 
 
-def get_possible_answers(code):
+def get_possible_answers(code, survey=None):
     """
     Returns the possible answers of the question with the given code.
     :param code: The question code
+    :param survey: The survey. Defaults to the current survey.
     :return: The possible answers
     """
-    subq = []
-    row = CODEX[code] + 2
-    while row > 0:
-        row += 1
-        ls = STATISTICS.loc[row].values.tolist()
-        if not pd.isna(ls[2]):
-            subq.append(ls[0])
-
-        else:
-            break
-    for index, ans in enumerate(subq):
-        characters = char_split(ans)
-        ch = 0
-        for char in characters:
-            ch += 1
-            if char == "(":
-                subq[index] = merge(characters[0:ch-2])
-                break   
-    return subq
-
-
-def get_counts(code):
+    return list(get_statistics_index(survey)[code]['answers'])
+
+
+def get_counts(code, survey=None):
     """
     Returns the frequency of each answer for a question with the given code.
     :param code: The question code
+    :param survey: The survey. Defaults to the current survey.
     :return: The counts
     """
-    counts = []
-    row = CODEX[code] + 2
-    while row > 0:
-        row += 1
-        ls = STATISTICS.loc[row].values.tolist()
-        if not pd.isna(ls[2]):
-            counts.append(ls[1])
-        else:
-            break
-    count_data = counts
-    return count_data
+    return list(get_statistics_index(survey)[code]['counts'])
 
 
-def get_data(code):
+def get_data(code, survey=None):
     """
-    Returns the dataframe for a question with the given code.
+    Returns the percentage of respondents giving each answer for a question with the given code.
     :param code: The question code
-    :return: The dataframe
-    """
-    perc = []
-    row = CODEX[code] + 2
-    while row > 0:
-        row += 1
-        ls = STATISTICS.loc[row].values.tolist()
-        if not pd.isna(ls[2]):
-            perc.append(ls[2])
-        else:
-            break
-    for index, dat in enumerate(perc):
-        perc[index] = round(dat*100, 1)        
-    qdata = perc
-    return qdata
+    :param survey: The survey. Defaults to the current survey.
+    :return: The percentages
+    """
+    return list(get_statistics_index(survey)[code]['percentages'])
 
 
 def get_number_of_nan_in_list(ls):
@@ -185,9 +240,10 @@ def get_number_of_nan_in_list(ls):
     return number_of_nan
 
 
-def get_all_codes():
+def get_all_codes(survey=None):
     """
     Returns a list of all question codes.
+    :param survey: The survey. Defaults to the current survey.
     :return:
     """
-    return list(CODEX.keys())
+    return list(get_codex(survey).keys())
@@ -0,0 +1,255 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+This file stores computed statistics so that past runs can be queried, compared and plotted again without running
+the analysis again. Every statistic is stored as a row with the columns run, subgroup, title, code, statistic and
+value, in a directory of Parquet or Feather files partitioned by run and subgroup:
+
+    directory/run=<run>/subgroup=<subgroup>/part-<time>-<id>.parquet
+
+Each write adds a new file, so a run can be written to a little at a time, and queries for a run or subgroup only read
+its directories. Reading and writing the files needs pyarrow.
+"""
+
+import os
+import uuid
+from datetime import datetime
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+# Columns of the rows stored for every statistic.
+STORE_COLUMNS = ['run', 'subgroup', 'title', 'code', 'statistic', 'value']
+# File formats and their extensions.
+_EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather'}
+
+
+def new_run_id():
+    """
+    Returns an identifier for a run from the current time, which sorts in the order runs were started.
+    :return: A string
+    """
+    return datetime.now().strftime('%Y%m%dT%H%M%S%f')
+
+
+def frame_rows(frame, subgroup=None, title=None):
+    """
+    Converts a dataframe of statistics to stored rows.
+    A dataframe returned by get_stats_comparison, indexed by code with a column for each statistic, gives a row for
+    each code and numeric statistic, and a row with an empty code for each numeric attribute such as
+    included_respondents. A long dataframe returned by maclime.analysis.compare_subgroups, with the columns subgroup,
+    code, statistic and value, is used as it is.
+    :param frame: A dataframe of statistics
+    :param subgroup: The name of the subgroup. Defaults to the subgroup column of a long dataframe or to the
+                     description attribute of the dataframe.
+    :param title: The title of the analysis. Defaults to the title attribute of the dataframe.
+    :return: A dataframe with the columns subgroup, title, code, statistic and value
+    """
+    if title is None:
+        title = frame.attrs.get('title', "")
+    if {'code', 'statistic', 'value'}.issubset(frame.columns):
+        rows = frame[['code', 'statistic', 'value']].copy()
+        rows.insert(0, 'subgroup', frame['subgroup'] if subgroup is None and 'subgroup' in frame.columns else subgroup)
+    else:
+        if subgroup is None:
+            subgroup = frame.attrs.get('description', "")
+        numeric = {}
+        for column in frame.columns:
+            values = pd.to_numeric(frame[column], errors='coerce')
+            if values.notna().sum() == frame[column].notna().sum():
+                numeric[column] = values.astype(np.float64)
+        stacked = pd.DataFrame(numeric, index=frame.index).rename_axis('code').reset_index()
+        stacked = stacked.melt(id_vars='code', var_name='statistic', value_name='value')
+        attributes = [(name, value) for name, value in frame.attrs.items()
+                      if isinstance(value, (int, float, np.number)) and not isinstance(value, bool)]
+        attributes = pd.DataFrame({'code': "", 'statistic': [name for name, _ in attributes],
+                                   'value': [value for _, value in attributes]})
+        rows = pd.concat([stacked, attributes], ignore_index=True)
+        rows.insert(0, 'subgroup', subgroup)
+    rows.insert(1, 'title', title)
+    rows['subgroup'] = rows['subgroup'].astype(str)
+    rows['title'] = rows['title'].astype(str)
+    rows['code'] = rows['code'].astype(str)
+    rows['statistic'] = rows['statistic'].astype(str)
+    rows['value'] = pd.to_numeric(rows['value'], errors='coerce').astype(np.float64)
+    return rows.reset_index(drop=True)
+
+
+class ResultStore:
+    """
+    This class appends computed statistics to a directory of columnar files partitioned by run and subgroup, and
+    queries them.
+
+    Attributes:
+        directory: The directory holding the store
+        run: The identifier of the run new statistics are written to
+        file_format: 'parquet' or 'feather'
+
+    Methods:
+        write: Appends the statistics in a dataframe to the current run
+        runs: Returns the identifiers of the stored runs
+        subgroups: Returns the names of the subgroups stored for a run
+        read: Returns stored rows matching some criteria
+        get_frame: Returns the statistics of a subgroup in the layout of get_stats_comparison
+        diff: Compares the statistics of two runs
+    """
+
+    def __init__(self, directory, run=None, file_format='parquet'):
+        """
+        :param directory: The directory holding the store. It is created if it does not exist.
+        :param run: The identifier of the run new statistics are written to. Defaults to a new identifier.
+        :param file_format: 'parquet' or 'feather'
+        """
+        if file_format not in _EXTENSIONS:
+            raise ValueError("Unknown file format {!r}, expected one of {}.".format(file_format, list(_EXTENSIONS)))
+        self.directory = directory
+        self.run = run or new_run_id()
+        self.file_format = file_format
+
+    def _partition(self, run, subgroup=None):
+        path = os.path.join(self.directory, "run=" + quote(str(run), safe=""))
+        if subgroup is not None:
+            path = os.path.join(path, "subgroup=" + quote(str(subgroup), safe=""))
+        return path
+
+    def write(self, frame, subgroup=None, title=None):
+        """
+        Appends the statistics in a dataframe to the current run, see frame_rows.
+        :param frame: A dataframe of statistics
+        :param subgroup: The name of the subgroup, see frame_rows
+        :param title: The title of the analysis, see frame_rows
+        :return: The number of rows written
+        """
+        rows = frame_rows(frame, subgroup, title)
+        rows.insert(0, 'run', str(self.run))
+        for name, group in rows.groupby('subgroup', sort=False):
+            directory = self._partition(self.run, name)
+            os.makedirs(directory, exist_ok=True)
+            filename = "part-{}-{}{}".format(new_run_id(), uuid.uuid4().hex[:8], _EXTENSIONS[self.file_format])
+            group = group.reset_index(drop=True)
+            if self.file_format == 'parquet':
+                group.to_parquet(os.path.join(directory, filename), index=False)
+            else:
+                group.to_feather(os.path.join(directory, filename))
+        return len(rows.index)
+
+    def runs(self):
+        """
+        Returns the identifiers of the stored runs.
+        :return: A sorted list of run identifiers
+        """
+        return sorted(_partition_values(self.directory, 'run'))
+
+    def subgroups(self, run=None):
+        """
+        Returns the names of the subgroups stored for a run.
+        :param run: The run. Defaults to the current run.
+        :return: A sorted list of subgroup names
+        """
+        return sorted(_partition_values(self._partition(run or self.run), 'subgroup'))
+
+    def read(self, runs=None, subgroups=None, codes=None, statistics=None, title=None):
+        """
+        Returns the stored rows matching some criteria. Only the directories of the selected runs and subgroups are
+        read.
+        :param runs: A run or list of runs. Defaults to the current run. 'ALL' reads every run.
+        :param subgroups: A subgroup or list of subgroups. Defaults to every subgroup.
+        :param codes: A code or list of codes. Defaults to every code.
+        :param statistics: A statistic or list of statistics. Defaults to every statistic.
+        :param title: The title of the analyses. Defaults to every title.
+        :return: A dataframe with the columns run, subgroup, title, code, statistic and value
+        """
+        if runs is None:
+            runs = [self.run]
+        elif runs == 'ALL':
+            runs = self.runs()
+        frames = []
+        for run in _as_list(runs):
+            names = self.subgroups(run) if subgroups is None else _as_list(subgroups)
+            for name in names:
+                directory = self._partition(run, name)
+                if not os.path.isdir(directory):
+                    continue
+                for entry in sorted(os.scandir(directory), key=lambda item: item.name):
+                    if entry.name.endswith('.parquet'):
+                        frames.append(pd.read_parquet(entry.path))
+                    elif entry.name.endswith('.feather'):
+                        frames.append(pd.read_feather(entry.path))
+        if not frames:
+            return pd.DataFrame({column: pd.Series(dtype=np.float64 if column == 'value' else object)
+                                 for column in STORE_COLUMNS})
+        rows = pd.concat(frames, ignore_index=True)[STORE_COLUMNS]
+        selected = np.ones(len(rows.index), dtype=bool)
+        if codes is not None:
+            selected &= rows['code'].isin(_as_list(codes)).to_numpy()
+        if statistics is not None:
+            selected &= rows['statistic'].isin(_as_list(statistics)).to_numpy()
+        if title is not None:
+            selected &= (rows['title'] == title).to_numpy()
+        return rows[selected].reset_index(drop=True)
+
+    def get_frame(self, subgroup, title=None, run=None):
+        """
+        Returns the statistics of a subgroup in the layout of get_stats_comparison, a dataframe indexed by code with a
+        column for each statistic, with the statistics stored with an empty code as attributes. When a subgroup was
+        written several times, the last value of each statistic is used.
+        :param subgroup: The name of the subgroup
+        :param title: The title of the analysis. Defaults to every title.
+        :param run: The run. Defaults to the current run.
+        :return: A dataframe
+        """
+        rows = self.read(run or self.run, subgroup, title=title)
+        codes = rows[rows['code'] != ""]
+        frame = codes.pivot_table(index='code', columns='statistic', values='value', aggfunc='last', sort=False,
+                                  dropna=False)
+        frame.columns.name = None
+        frame.index.name = None
+        attributes = rows[rows['code'] == ""].drop_duplicates('statistic', keep='last')
+        frame.attrs.update(zip(attributes['statistic'], attributes['value']))
+        frame.attrs['description'] = subgroup
+        if title is not None:
+            frame.attrs['title'] = title
+        return frame
+
+    def diff(self, run, other_run=None, tolerance=0.0):
+        """
+        Compares the statistics of two runs.
+        :param run: The first run
+        :param other_run: The second run. Defaults to the current run.
+        :param tolerance: Differences with an absolute value up to the tolerance are not reported
+        :return: A dataframe with the columns subgroup, title, code and statistic, the value in each run and their
+                 difference, with a row for every statistic that changed or is only in one run
+        """
+        other_run = other_run or self.run
+        keys = ['subgroup', 'title', 'code', 'statistic']
+        first = self.read(run).drop(columns='run').drop_duplicates(keys, keep='last')
+        second = self.read(other_run).drop(columns='run').drop_duplicates(keys, keep='last')
+        merged = first.merge(second, on=keys, how='outer', suffixes=('_' + str(run), '_' + str(other_run)))
+        first_values = merged['value_' + str(run)]
+        second_values = merged['value_' + str(other_run)]
+        merged['difference'] = second_values - first_values
+        changed = (merged['difference'].abs() > tolerance) | (first_values.isna() != second_values.isna())
+        return merged[changed.to_numpy()].reset_index(drop=True)
+
+
+def _as_list(values):
+    if isinstance(values, (list, tuple, set, pd.Index, np.ndarray)):
+        return list(values)
+    return [values]
+
+
+def _partition_values(directory, key):
+    """
+    Returns the values of the partitions in a directory.
+    :param directory: A directory
+    :param key: The partition key, such as run or subgroup
+    :return: A list of values
+    """
+    if not os.path.isdir(directory):
+        return []
+    prefix = key + "="
+    return [unquote(entry.name[len(prefix):]) for entry in os.scandir(directory)
+            if entry.is_dir() and entry.name.startswith(prefix)]
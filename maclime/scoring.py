@@ -2,20 +2,229 @@
 Created on May 18, 2022
 
 @author: Devin Burke
+
+This file scores responses with the value dictionary returned by the configured value dictionary callback.
+Scores are encoded once per code into a float64 column over the results file, with NaN for answers that have no
+score, and subgroup scores are served as mask slices of these columns.
 """
-from maclime.config import get_config
+import numpy as np
+
+from maclime.config import get_survey, register_append_hook
+from maclime.frequencies import encode_responses
+from maclime.include_arrays import as_include_set
+from maclime.instrumentation import instrumented
+
+# Names of the survey caches of score columns and level codes keyed by question code and of score matrices keyed by a
+# tuple of codes.
+_SCORE_COLUMNS = 'score_columns'
+_SCORE_LEVELS = 'score_levels'
+_SCORE_MATRICES = 'score_matrices'
+
+
+def clear_scores(survey=None):
+    """
+    Removes every score column and score matrix from a survey's cache.
+    :param survey: The survey. Defaults to the current survey.
+    :return:
+    """
+    survey = get_survey(survey)
+    for name in (_SCORE_COLUMNS, _SCORE_LEVELS, _SCORE_MATRICES):
+        survey.get_cache(name).clear()
+
+
+def _append_score_columns(survey, columns, rows):
+    """
+    Extends every cached score column with appended responses. Run after the encoded responses have been extended.
+    :param survey: The survey
+    :param columns: The survey's cache of score columns
+    :param rows: A dataframe of the appended responses
+    :return:
+    """
+    n = len(rows.index)
+    for code, old_column in list(columns.items()):
+        codes, lookup = _score_lookup(code, survey)
+        column = np.concatenate([old_column, lookup[codes[-n:]]])
+        column.setflags(write=False)
+        columns[code] = column
+
+
+def _append_score_levels(survey, encoded_levels, rows):
+    """
+    Extends every cached level encoding with appended responses. Level encodings are rebuilt when the new responses
+    introduce a score that was not seen before.
+    :param survey: The survey
+    :param encoded_levels: The survey's cache of level encodings
+    :param rows: A dataframe of the appended responses
+    :return:
+    """
+    n = len(rows.index)
+    for code, (old_level_codes, old_levels) in list(encoded_levels.items()):
+        codes, lookup = _score_lookup(code, survey)
+        scored = ~np.isnan(lookup)
+        levels = np.unique(lookup[scored])
+        if not np.array_equal(levels, old_levels):
+            del encoded_levels[code]
+            continue
+        level_lookup = np.where(scored, np.searchsorted(levels, lookup), -1).astype(np.int16)
+        level_codes = np.concatenate([old_level_codes, level_lookup[codes[-n:]]])
+        level_codes.setflags(write=False)
+        encoded_levels[code] = (level_codes, levels)
+
+
+def _append_score_matrices(survey, matrices, rows):
+    """
+    Extends every cached score matrix with appended responses.
+    :param survey: The survey
+    :param matrices: The survey's cache of score matrices
+    :param rows: A dataframe of the appended responses
+    :return:
+    """
+    n = len(rows.index)
+    for key, old_matrix in list(matrices.items()):
+        matrix = np.empty((old_matrix.shape[0] + n, len(key)), dtype=np.float64, order='F')
+        matrix[:old_matrix.shape[0]] = old_matrix
+        for i, code in enumerate(key):
+            matrix[old_matrix.shape[0]:, i] = get_score_column(code, survey)[-n:]
+        matrix.setflags(write=False)
+        matrices[key] = matrix
+
+
+# Score columns and levels are built from the encoded responses, and score matrices from the score columns.
+register_append_hook(_SCORE_COLUMNS, _append_score_columns, priority=1)
+register_append_hook(_SCORE_LEVELS, _append_score_levels, priority=1)
+register_append_hook(_SCORE_MATRICES, _append_score_matrices, priority=2)
+
+
+@instrumented('scoring')
+def get_score_column(code, survey=None):
+    """
+    Returns the score of every respondent for a question code. The value dictionary callback is called once per code
+    and the column is cached until the survey changes.
+    :param code: The question code
+    :param survey: The survey. Defaults to the current survey.
+    :return: A read-only float64 array over the results file with NaN where an answer has no score
+    """
+    survey = get_survey(survey)
+    columns = survey.get_cache(_SCORE_COLUMNS)
+    if code not in columns:
+        codes, lookup = _score_lookup(code, survey)
+        column = lookup[codes]
+        column.setflags(write=False)
+        columns[code] = column
+    return columns[code]
+
+
+def _score_lookup(code, survey):
+    """
+    Returns the encoded responses to a question code and the score of each category.
+    :param code: The question code
+    :param survey: The survey
+    :return: An array of category numbers with -1 for no answer, and a float64 array with the score of each
+             category followed by NaN for no answer
+    """
+    value_dict = survey.get_value_dict(code) or {}
+    codes, categories = encode_responses(code, survey)
+    lookup = np.array([value_dict.get(category, np.nan) for category in categories] + [np.nan], dtype=np.float64)
+    return codes, lookup
+
+
+@instrumented('scoring')
+def get_score_levels(code, survey=None):
+    """
+    Returns the position of every respondent's score among the sorted distinct scores of a question code.
+    :param code: The question code
+    :param survey: The survey. Defaults to the current survey.
+    :return: An integer array with -1 where an answer has no score, and the sorted array of distinct scores
+    """
+    survey = get_survey(survey)
+    encoded_levels = survey.get_cache(_SCORE_LEVELS)
+    if code not in encoded_levels:
+        codes, lookup = _score_lookup(code, survey)
+        scored = ~np.isnan(lookup)
+        levels = np.unique(lookup[scored])
+        level_lookup = np.where(scored, np.searchsorted(levels, lookup), -1).astype(np.int16)
+        level_codes = level_lookup[codes]
+        level_codes.setflags(write=False)
+        encoded_levels[code] = (level_codes, levels)
+    return encoded_levels[code]
+
+
+@instrumented('scoring')
+def count_score_levels(codes, masks, survey=None):
+    """
+    Counts how many respondents of each group gave each score for a list of question codes.
+    :param codes: A list of question codes
+    :param masks: A group x respondent boolean array
+    :param survey: The survey. Defaults to the current survey.
+    :return: The sorted array of every distinct score across the codes, and a group x code x score array of counts
+    """
+    encoded = [get_score_levels(code, survey) for code in codes]
+    levels = np.unique(np.concatenate([code_levels for _, code_levels in encoded] + [np.empty(0)]))
+    weights = np.asarray(masks, dtype=np.float64)
+    counts = np.zeros((weights.shape[0], len(codes), len(levels)))
+    for c, (level_codes, code_levels) in enumerate(encoded):
+        if not len(code_levels):
+            continue
+        positions = np.searchsorted(levels, code_levels)
+        scored = np.flatnonzero(level_codes >= 0)
+        indicators = np.zeros((len(level_codes), len(code_levels)))
+        indicators[scored, level_codes[scored]] = 1
+        counts[:, c, positions] = weights @ indicators
+    return levels, counts
+
+
+@instrumented('scoring')
+def get_score_matrix(codes, survey=None):
+    """
+    Returns the scores of every respondent for a list of question codes.
+    :param codes: A list of question codes
+    :param survey: The survey. Defaults to the current survey.
+    :return: A read-only respondent x code float64 array with NaN where an answer has no score
+    """
+    survey = get_survey(survey)
+    matrices = survey.get_cache(_SCORE_MATRICES)
+    key = tuple(codes)
+    if key not in matrices:
+        n = len(survey.get_results_file().index)
+        matrix = np.empty((n, len(key)), dtype=np.float64, order='F')
+        for i, code in enumerate(key):
+            matrix[:, i] = get_score_column(code, survey)
+        matrix.setflags(write=False)
+        matrices[key] = matrix
+    return matrices[key]
+
+
+@instrumented('scoring')
+def get_included_scores(code, include=None, survey=None):
+    """
+    Returns the scores of the included respondents for a question code in the order of the results file.
+    Answers without a score are dropped.
+    :param code: The question code
+    :param include: An include array. Defaults to all respondents.
+    :param survey: The survey. Defaults to the current survey.
+    :return: A float array of scores
+    """
+    survey = get_survey(survey)
+    column = get_score_column(code, survey)
+    if include is None:
+        scores = column
+    else:
+        scores = column[as_include_set(include, survey.get_results_file().index).mask]
+    return scores[~np.isnan(scores)]
 
 
 # An array of responses passed returns an array of scored values using value_dict
-def get_scored_data(responses, code=None, value_dict=None):
+@instrumented('scoring')
+def get_scored_data(responses, code=None, value_dict=None, survey=None):
     """
     Returns an array of scored values for a given question code and array of responses.
     :param responses: An array of responses
     :param code: The question code
     :param value_dict: The value dictionary for the question
+    :param survey: The survey. Defaults to the current survey.
     :return: An array of scored values
     """
-    config = get_config()
+    config = get_survey(survey)
     if value_dict is None:
         if code is None:
             raise ValueError("Either code or value_dict must be passed.")
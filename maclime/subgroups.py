@@ -0,0 +1,114 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+This file explores demographic subgroups. Instead of writing crossed include arrays such as undergraduate women by
+hand, give a list of demographic codes. Every respondent is assigned one cell of a count cube over all combinations of
+answers to those codes with a single bincount. Every intersection of answers is then counted from the cube, those
+with fewer respondents than a minimum cell size are pruned, and the rest are compared in one batched call to
+maclime.analysis.compare_subgroups.
+
+Subgroups are named by the include expression selecting them, for example SAL1 == 'I am an undergraduate student.' &
+PI3 == 'Female (cis or trans)', so any subgroup found here can be reused with maclime.include_expressions.
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from maclime.analysis import compare_subgroups
+from maclime.config import get_survey
+from maclime.frequencies import encode_responses
+from maclime.include_expressions import evaluate_include, format_value
+from maclime.utils import fast_mwu_test
+
+# Largest number of cells allowed in a count cube.
+MAX_CUBE_CELLS = 2 ** 24
+
+
+def get_subgroup_cube(codes, survey=None):
+    """
+    Counts the respondents giving each combination of answers to a list of codes.
+    :param codes: A list of question codes
+    :param survey: The survey. Defaults to the current survey.
+    :return: An array with an axis for each code holding the number of respondents in each cell, and a list with the
+             answers of each code. The last position on each axis counts respondents who gave no answer.
+    """
+    survey = get_survey(survey)
+    encoded = [encode_responses(code, survey) for code in codes]
+    shape = tuple(len(categories) + 1 for _, categories in encoded)
+    if np.prod(shape, dtype=float) > MAX_CUBE_CELLS:
+        raise ValueError("The answers to {} have {} combinations, more than the {} allowed."
+                         .format(codes, int(np.prod(shape, dtype=float)), MAX_CUBE_CELLS))
+    cells = np.zeros(len(survey.get_results_file().index), dtype=np.int64)
+    for (level_codes, categories), size in zip(encoded, shape):
+        cells *= size
+        cells += np.where(level_codes < 0, len(categories), level_codes)
+    cube = np.bincount(cells, minlength=int(np.prod(shape))).reshape(shape)
+    return cube, [list(categories) for _, categories in encoded]
+
+
+def enumerate_subgroups(codes, min_size=10, max_depth=2, survey=None):
+    """
+    Lists every intersection of answers to up to max_depth of the codes with at least min_size respondents and at
+    least min_size respondents outside it. Respondents who gave no answer to a code do not form a subgroup.
+    :param codes: A list of demographic question codes
+    :param min_size: The minimum number of respondents in a subgroup and in its complement
+    :param max_depth: The largest number of codes crossed in a subgroup. None crosses every code.
+    :param survey: The survey. Defaults to the current survey.
+    :return: A dataframe indexed by subgroup name with the columns depth, n and the answer to each code, which is
+             missing for codes the subgroup does not depend on
+    """
+    codes = list(codes)
+    cube, answers = get_subgroup_cube(codes, survey)
+    total = cube.sum()
+    if max_depth is None:
+        max_depth = len(codes)
+    rows = []
+    for depth in range(1, min(max_depth, len(codes)) + 1):
+        for axes in itertools.combinations(range(len(codes)), depth):
+            others = tuple(axis for axis in range(len(codes)) if axis not in axes)
+            marginal = cube.sum(axis=others) if others else cube
+            answered = marginal[tuple(slice(0, len(answers[axis])) for axis in axes)]
+            for cell in np.argwhere((answered >= min_size) & (total - answered >= min_size)):
+                row = dict.fromkeys(codes)
+                for axis, position in zip(axes, cell):
+                    row[codes[axis]] = answers[axis][position]
+                name = " & ".join("{} == {}".format(codes[axis], format_value(answers[axis][position]))
+                                  for axis, position in zip(axes, cell))
+                row.update({'name': name, 'depth': depth, 'n': int(answered[tuple(cell)])})
+                rows.append(row)
+    frame = pd.DataFrame(rows, columns=['name', 'depth', 'n'] + codes)
+    return frame.set_index('name')
+
+
+def get_subgroup_includes(subgroups, survey=None):
+    """
+    Returns the include array of each subgroup listed by enumerate_subgroups. Subgroups sharing an answer share the
+    mask of that answer.
+    :param subgroups: A dataframe returned by enumerate_subgroups, or a list of subgroup names
+    :param survey: The survey. Defaults to the current survey.
+    :return: A dictionary mapping subgroup names to IncludeSets
+    """
+    names = subgroups.index if isinstance(subgroups, pd.DataFrame) else subgroups
+    return {name: evaluate_include(name, survey=survey) for name in names}
+
+
+def explore_subgroups(demographic_codes, codes, min_size=10, max_depth=2, p_test=fast_mwu_test,
+                      confidence_interval=None, survey=None):
+    """
+    Compares every subgroup of respondents found by enumerate_subgroups with its complement for a list of codes.
+    :param demographic_codes: A list of demographic question codes used to form subgroups
+    :param codes: A list of question codes to compare
+    :param min_size: The minimum number of respondents in a subgroup and in its complement
+    :param max_depth: The largest number of demographic codes crossed in a subgroup. None crosses every code.
+    :param p_test: The p-value test passed to maclime.analysis.compare_subgroups
+    :param confidence_interval: The confidence interval passed to maclime.analysis.compare_subgroups
+    :param survey: The survey. Defaults to the current survey.
+    :return: The long dataframe returned by maclime.analysis.compare_subgroups, with a subgroup for each subgroup name
+    """
+    subgroups = enumerate_subgroups(demographic_codes, min_size, max_depth, survey)
+    includes = get_subgroup_includes(subgroups, survey)
+    return compare_subgroups(includes, codes, p_test=p_test, confidence_interval=confidence_interval, survey=survey)
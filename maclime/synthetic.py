@@ -0,0 +1,209 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+This file generates synthetic results and statistics files in the layout of a Limesurvey export, for trying out an
+analysis before the survey closes and for benchmarking maclime at sizes no real survey reaches.
+
+The results file has a column of answers for each question code, indexed by respondent ID, with None where a
+respondent gave no answer. The statistics file has a block for each code with its summary row, question text, header
+row, answer rows with counts and percentages, the no answer and not displayed rows and two blank rows, as read by
+maclime.read_statistics.generate_codex. Both can be written to Excel files read with the usual arguments of
+set_results_file and set_statistics_file, or set directly on a survey.
+"""
+
+import numpy as np
+import pandas as pd
+
+from maclime.config import get_survey
+
+# Answer scales used by the default codes. Answers are listed in the order they appear in the statistics file.
+SCALES = {
+    'consent': ['I understand and agree to participate in the study.'],
+    'level': ['I am a PhD level graduate student within the Department of Physics and Astronomy.',
+              'I am a master level graduate student within the Department of Physics and Astronomy.',
+              'I am an undergraduate student.'],
+    'yes_no': ['Yes', 'No'],
+    'gender': ['Female (cis or trans)', 'Male (cis or trans)', 'Other'],
+    'co-op': ['I am in a co-op work placement this semester.', 'No'],
+    'continuum': ['In crisis', 'Struggling', 'Surviving', 'Thriving', 'Excelling'],
+    'frequency': ['None of the time', 'Rarely', 'Some of the time', 'Most of the time', 'All of the time'],
+    'agreement': ['Strongly disagree', 'Disagree', 'Somewhat disagree', 'Neither agree nor disagree',
+                  'Somewhat agree', 'Agree', 'Strongly agree'],
+    'impact': ['Strongly negative', 'Negative', 'Neutral', 'Positive', 'Strongly positive'],
+}
+
+
+def subquestion_codes(top_code, subquestions, scale):
+    """
+    Returns the codes of a question with subquestions, such as AE0(SQ001) to AE0(SQ006), all answered on one scale.
+    :param top_code: The code of the top question
+    :param subquestions: The number of subquestions
+    :param scale: The name of a scale in SCALES or a list of answers
+    :return: A dictionary mapping each code to the scale
+    """
+    return {"{}(SQ{:03d})".format(top_code, i): scale for i in range(1, subquestions + 1)}
+
+
+# The codes of the default synthetic survey, which follow the example survey so that its value dictionary, include
+# arrays and analyses can be run on synthetic data.
+DEFAULT_CODES = {
+    'C0': 'consent',
+    'SAL1': 'level',
+    'PI1': 'yes_no',
+    'PI2': 'yes_no',
+    'PI3': 'gender',
+    **subquestion_codes('SAL9', 4, 'yes_no'),
+    'SAL6': 'co-op',
+    'MH2': 'continuum',
+    **subquestion_codes('MH0', 5, 'frequency'),
+    **subquestion_codes('AE0', 6, 'frequency'),
+    **subquestion_codes('AE1', 5, 'agreement'),
+    **subquestion_codes('AE6', 10, 'impact'),
+}
+
+
+def generate_results(respondents=1000, codes=None, missing=0.1, seed=None):
+    """
+    Generates a synthetic results file. Each code draws its answers from its own random distribution over its scale.
+    :param respondents: The number of respondents
+    :param codes: A dictionary mapping question codes to the name of a scale in SCALES or a list of answers.
+                  Defaults to DEFAULT_CODES.
+    :param missing: The probability that a respondent gives no answer, either a single probability or a dictionary
+                    mapping codes to probabilities. Codes missing from the dictionary are always answered.
+    :param seed: The seed of the random number generator, or None for a different survey every time
+    :return: A dataframe of answers indexed by respondent ID
+    """
+    scales = _scales(codes)
+    return _results_frame(_draw_answers(respondents, scales, missing, seed), scales)
+
+
+def _draw_answers(respondents, scales, missing, seed):
+    """
+    Draws the position of every respondent's answer in the scale of each code.
+    :param respondents: The number of respondents
+    :param scales: A dictionary mapping question codes to lists of answers
+    :param missing: The probability that a respondent gives no answer, see generate_results
+    :param seed: The seed of the random number generator
+    :return: A dictionary mapping question codes to integer arrays, where the length of the scale means no answer
+    """
+    rng = np.random.default_rng(seed)
+    drawn = {}
+    for code, answers in scales.items():
+        probability = missing.get(code, 0.0) if isinstance(missing, dict) else missing
+        weights = rng.dirichlet(np.full(len(answers), 2.0)) * (1 - probability)
+        drawn[code] = rng.choice(len(answers) + 1, size=respondents, p=np.append(weights, probability))
+    return drawn
+
+
+def _results_frame(drawn, scales):
+    """
+    Builds a results file from drawn answer positions.
+    :param drawn: A dictionary returned by _draw_answers
+    :param scales: A dictionary mapping question codes to lists of answers
+    :return: A dataframe of answers indexed by respondent ID
+    """
+    respondents = len(next(iter(drawn.values()))) if drawn else 0
+    columns = {code: np.array(scales[code] + [None], dtype=object)[positions] for code, positions in drawn.items()}
+    return pd.DataFrame(columns, index=pd.RangeIndex(1, respondents + 1, name='id'))
+
+
+def generate_statistics(results, codes=None):
+    """
+    Generates the statistics file of a results file.
+    :param results: A results file returned by generate_results
+    :param codes: The codes passed to generate_results. Defaults to DEFAULT_CODES.
+    :return: A dataframe of the statistics file without a header row
+    """
+    scales = _scales(codes)
+    counts = {}
+    for code, answers in scales.items():
+        column = results[code]
+        answer_counts = column.value_counts()
+        counts[code] = [int(answer_counts.get(answer, 0)) for answer in answers] + [int(column.isna().sum())]
+    return _statistics_frame(counts, scales, len(results.index))
+
+
+def _statistics_frame(counts, scales, respondents):
+    """
+    Builds a statistics file from answer counts.
+    :param counts: A dictionary mapping question codes to the count of each answer followed by the count of no answer
+    :param scales: A dictionary mapping question codes to lists of answers
+    :param respondents: The number of respondents
+    :return: A dataframe of the statistics file without a header row
+    """
+    rows = []
+    for code, answers in scales.items():
+        subquestion = "[Subquestion {}]".format(code) if '(' in code else ""
+        rows.append(["Summary for {}{}".format(code, subquestion), None, None])
+        rows.append(["Question text for {}".format(code), None, None])
+        rows.append(['Answer', 'Count', 'Percentage'])
+        for i, (answer, count) in enumerate(zip(answers, counts[code])):
+            rows.append(["{} (A{})".format(answer, i + 1), count, count / respondents])
+        rows.append(['No answer', counts[code][-1], counts[code][-1] / respondents])
+        rows.append(['Not completed or Not displayed', 0, 0.0])
+        rows.append([None, None, None])
+        rows.append([None, None, None])
+    return pd.DataFrame(rows)
+
+
+def generate_survey(respondents=1000, codes=None, missing=0.1, seed=None):
+    """
+    Generates a synthetic results file and its statistics file.
+    :param respondents: The number of respondents
+    :param codes: A dictionary mapping question codes to the name of a scale in SCALES or a list of answers.
+                  Defaults to DEFAULT_CODES.
+    :param missing: The probability that a respondent gives no answer, see generate_results
+    :param seed: The seed of the random number generator, or None for a different survey every time
+    :return: The results file and the statistics file
+    """
+    scales = _scales(codes)
+    drawn = _draw_answers(respondents, scales, missing, seed)
+    counts = {code: np.bincount(positions, minlength=len(scales[code]) + 1).tolist()
+              for code, positions in drawn.items()}
+    return _results_frame(drawn, scales), _statistics_frame(counts, scales, respondents)
+
+
+def write_survey(results, statistics, results_path, statistics_path):
+    """
+    Writes a synthetic survey to Excel files. The results file has a row of question text under the row of codes, so
+    both files are read with the arguments used for a Limesurvey export:
+    set_results_file(io=results_path, header=0, skiprows=[1], index_col=0) and
+    set_statistics_file(io=statistics_path, header=None).
+    :param results: A results file returned by generate_results
+    :param statistics: A statistics file returned by generate_statistics
+    :param results_path: The path of the results file
+    :param statistics_path: The path of the statistics file
+    :return:
+    """
+    text = pd.DataFrame([["Question text for {}".format(code) for code in results.columns]],
+                        columns=results.columns, index=pd.Index(['Response ID'], name=results.index.name))
+    pd.concat([text, results.astype(object)]).to_excel(results_path)
+    statistics.to_excel(statistics_path, header=False, index=False)
+
+
+def load_survey(results, statistics, categorical=None, survey=None):
+    """
+    Sets a synthetic survey's results and statistics files on a survey without writing them to disk.
+    :param results: A results file returned by generate_results
+    :param statistics: A statistics file returned by generate_statistics
+    :param categorical: Whether to store answer columns as pandas Categoricals, see Survey.set_results_frame
+    :param survey: The survey. Defaults to the current survey.
+    :return: The survey
+    """
+    survey = get_survey(survey)
+    survey.set_statistics_frame(statistics)
+    survey.set_results_frame(results, categorical=categorical)
+    return survey
+
+
+def _scales(codes):
+    """
+    Resolves the scale of each code.
+    :param codes: A dictionary mapping question codes to the name of a scale in SCALES or a list of answers, or None
+    :return: A dictionary mapping question codes to lists of answers
+    """
+    if codes is None:
+        codes = DEFAULT_CODES
+    return {code: SCALES[scale] if isinstance(scale, str) else list(scale) for code, scale in codes.items()}
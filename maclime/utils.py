@@ -5,13 +5,16 @@ Created on Apr. 12, 2022
 This file contains various general purpose utility functions
 """
 
+import hashlib
 import pandas as pd
 import numpy as np
 import math
+from functools import lru_cache
+from scipy.special import ndtr
 from scipy.stats import mannwhitneyu  
 
-from maclime.config import get_config
-CONFIG = get_config()
+from maclime.config import get_survey
+from maclime.instrumentation import instrumented
 
 
 def char_split(word):
@@ -36,14 +39,16 @@ def merge(s):
 
 
 # Returns the median and lower/upper limits of the median confidence interval
-def get_confidence_interval(data):
+@instrumented('utils')
+def get_confidence_interval(data, survey=None):
     """
     Returns the median and lower/upper limits of the median confidence interval.
     :param data: The data
+    :param survey: The survey whose z-score and population are used. Defaults to the current survey.
     :return: The median and lower/upper limits of the median confidence interval
     """
-    zscore = CONFIG.get_zscore()
-    pop = CONFIG.get_population()
+    zscore = get_survey(survey).get_zscore()
+    pop = get_survey(survey).get_population()
     data = [i for i in data if not pd.isna(i)]
     if not data:
         return None, None, None
@@ -63,6 +68,7 @@ def get_confidence_interval(data):
 
 
 # Returns the standard error of an array
+@instrumented('utils')
 def standard_error(sample):
     """
     Returns the standard error of an array.
@@ -74,12 +80,131 @@ def standard_error(sample):
         return None
     if len(sample) == 1:
         return None
-    se = np.std(sample) * np.std(sample)
+    se = np.var(sample)
     se = se / len(sample)
     se = math.sqrt(se)
     return se
 
 
+# Ordinal data such as Likert scores only take a few levels, so statistics can be computed from per-level counts.
+# The functions below accept an array of counts with the levels on the last axis and any number of leading axes,
+# for example subgroup x code x level, and return an array with the leading shape.
+def get_level_counts(data, levels=None):
+    """
+    Returns the sorted levels of some data and the number of times each level occurs. NaN values are ignored.
+    :param data: The data
+    :param levels: The levels to count. Defaults to the distinct values of the data. Values that are not one of the
+                   levels are not counted.
+    :return: An array of levels and an array of counts
+    """
+    data = np.asarray(data, dtype=np.float64)
+    data = data[~np.isnan(data)]
+    if levels is None:
+        levels, counts = np.unique(data, return_counts=True)
+        return levels, counts
+    levels = np.sort(np.asarray(levels, dtype=np.float64))
+    if not len(levels):
+        return levels, np.zeros(0, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(levels, data), len(levels) - 1)
+    matched = levels[positions] == data
+    return levels, np.bincount(positions[matched], minlength=len(levels))
+
+
+def seeded_generator(seed_sequence, *arrays):
+    """
+    Returns a random number generator derived from a seed sequence and a digest of some inputs, so that the same seed
+    and inputs always give the same random numbers, whatever was drawn before.
+    :param seed_sequence: A numpy SeedSequence
+    :param arrays: The inputs, as arrays
+    :return: A numpy Generator
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(repr((array.dtype.str, array.shape)).encode())
+        digest.update(array.tobytes())
+    spawn_key = tuple(seed_sequence.spawn_key) + (int.from_bytes(digest.digest(), 'little'),)
+    return np.random.default_rng(np.random.SeedSequence(seed_sequence.entropy, spawn_key=spawn_key))
+
+
+def order_statistic_from_counts(levels, counts, position):
+    """
+    Returns the value at a zero based position of the sorted data described by per-level counts.
+    :param levels: An array of k sorted levels
+    :param counts: An array of counts with k entries on the last axis
+    :param position: An integer array of positions broadcastable to the leading shape of counts
+    :return: An array of values
+    """
+    levels = np.asarray(levels)
+    cumulative = np.cumsum(counts, axis=-1)
+    index = np.sum(cumulative <= np.expand_dims(position, -1), axis=-1)
+    return levels[np.minimum(index, len(levels) - 1)]
+
+
+def mean_from_counts(levels, counts):
+    """
+    Returns the mean of the data described by per-level counts. The mean is NaN where there is no data.
+    :param levels: An array of k sorted levels
+    :param counts: An array of counts with k entries on the last axis
+    :return: An array of means
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return counts @ np.asarray(levels, dtype=np.float64) / counts.sum(axis=-1)
+
+
+def standard_error_from_counts(levels, counts):
+    """
+    Returns the standard error of the data described by per-level counts, matching standard_error.
+    The standard error is NaN where there are fewer than two values.
+    :param levels: An array of k sorted levels
+    :param counts: An array of counts with k entries on the last axis
+    :return: An array of standard errors
+    """
+    levels = np.asarray(levels, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.float64)
+    n = counts.sum(axis=-1)
+    mean = mean_from_counts(levels, counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = np.sum(counts * (levels - np.expand_dims(mean, -1)) ** 2, axis=-1) / n
+        se = np.sqrt(variance / n)
+    return np.where(n > 1, se, np.nan)
+
+
+@instrumented('utils')
+def confidence_interval_from_counts(levels, counts, zscore=None, population=None, survey=None):
+    """
+    Returns the median and lower/upper limits of the median confidence interval from per-level counts, using the
+    same order statistics and finite population correction as get_confidence_interval.
+    Values are NaN where there is no data. A population of None skips the finite population correction.
+    :param levels: An array of k sorted levels
+    :param counts: An array of counts with k entries on the last axis
+    :param zscore: The z-score. Defaults to the survey's z-score.
+    :param population: The population size. Defaults to the survey's population size.
+    :param survey: The survey. Defaults to the current survey.
+    :return: Arrays of the lower limits, medians and upper limits
+    """
+    if zscore is None:
+        zscore = get_survey(survey).get_zscore()
+    if population is None:
+        population = get_survey(survey).get_population()
+    n = np.asarray(counts).sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correction = 1.0 if population is None else np.sqrt((population - n) / (population - 1))
+        half_width = zscore * correction * np.sqrt(n * 0.5 * (1 - 0.5))
+        j = np.ceil(n * 0.5 + half_width)
+        k = np.ceil(n * 0.5 - half_width)
+    last = np.maximum(n - 1, 0)
+    j = np.where((j > 0) & (j < n - 1), j, last).astype(np.intp)
+    k = np.where((k > 0) & (k < n - 1), k, 0).astype(np.intp)
+    hconf = order_statistic_from_counts(levels, counts, j).astype(np.float64)
+    lconf = order_statistic_from_counts(levels, counts, k).astype(np.float64)
+    median = (order_statistic_from_counts(levels, counts, last // 2) +
+              order_statistic_from_counts(levels, counts, n // 2)) / 2
+    empty = n == 0
+    return np.where(empty, np.nan, lconf), np.where(empty, np.nan, median), np.where(empty, np.nan, hconf)
+
+
 # finite population correction
 # Use when n/N > 0.05
 def fpc(population_size, sample_size):
@@ -96,6 +221,7 @@ def fpc(population_size, sample_size):
 
 
 # Perform MannWhitneyU test for two datasets and return pvalue
+@instrumented('utils')
 def mwu_test(data, comp):
     """
     Perform MannWhitneyU test for two datasets and return pvalue.
@@ -114,3 +240,100 @@ def mwu_test(data, comp):
     else:
         pval = mannwhitneyu(data, comp).pvalue
     return pval
+
+
+@lru_cache(maxsize=256)
+def mwu_exact_sf(n1, n2):
+    """
+    Returns the survival function of the Mann-Whitney U statistic under the null hypothesis for two samples without
+    ties. The distribution is the coefficient list of the Gaussian binomial coefficient, computed with exact integers
+    and cached by sample sizes.
+    :param n1: The size of the first sample
+    :param n2: The size of the second sample
+    :return: A read-only array whose entry u is the probability that U is at least u
+    """
+    m, n = min(n1, n2), max(n1, n2)
+    frequencies = np.zeros(m * n + 1, dtype=object)
+    frequencies[0] = 1
+    for i in range(1, m + 1):
+        # Divide by (1 - q^i) then multiply by (1 - q^(n + i)).
+        for residue in range(i):
+            frequencies[residue::i] = np.cumsum(frequencies[residue::i])
+        frequencies[n + i:] = frequencies[n + i:] - frequencies[:-(n + i)]
+    total = sum(frequencies)
+    sf = np.array([count / total for count in np.cumsum(frequencies[::-1])[::-1]], dtype=np.float64)
+    sf.setflags(write=False)
+    return sf
+
+
+@instrumented('utils')
+def mwu_test_counts(counts, comp_counts, exact_below=8, levels=None):
+    """
+    Performs two-sided Mann-Whitney U tests on data described by per-level counts, matching mwu_test.
+    Both arrays hold counts of the same sorted levels on their last axis, and any leading axes, for example
+    subgroup x code, are tested element by element. Midranks are computed once from the combined counts.
+    The exact distribution is used when the first sample is smaller than exact_below, or when either sample has at
+    most 8 values and there are no ties. The normal approximation with tie and continuity corrections is used
+    otherwise.
+    :param counts: An array of counts for the data
+    :param comp_counts: An array of counts for the comparison data
+    :param exact_below: Sizes of the first sample below which the exact test is always used
+    :param levels: The sorted levels. Unused, since the test only depends on the order of the levels.
+    :return: An array of p-values, NaN where either sample is empty
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    comp_counts = np.asarray(comp_counts, dtype=np.float64)
+    n1 = counts.sum(axis=-1)
+    n2 = comp_counts.sum(axis=-1)
+    below = np.cumsum(comp_counts, axis=-1) - comp_counts
+    u1 = np.sum(counts * (below + 0.5 * comp_counts), axis=-1)
+    u = np.maximum(u1, n1 * n2 - u1)
+    tied = counts + comp_counts
+    ties = np.any(tied > 1, axis=-1)
+
+    n = n1 + n2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tie_term = np.sum(tied ** 3 - tied, axis=-1)
+        s = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+        z = (u - n1 * n2 / 2 - 0.5) / s
+        pvalue = 2 * ndtr(-z)
+
+    exact = (n1 < exact_below) | (((n1 <= 8) | (n2 <= 8)) & ~ties)
+    exact &= (n1 > 0) & (n2 > 0)
+    if np.any(exact):
+        pvalue = np.array(pvalue, dtype=np.float64, ndmin=1)
+        flat_exact = np.flatnonzero(np.ravel(exact))
+        sizes = np.stack([np.ravel(n1)[flat_exact], np.ravel(n2)[flat_exact]], axis=-1).astype(np.int64)
+        statistics = np.ravel(u)[flat_exact].astype(np.int64)
+        flat_pvalue = pvalue.reshape(-1)
+        for (size1, size2), position, statistic in zip(sizes.tolist(), flat_exact, statistics.tolist()):
+            flat_pvalue[position] = 2 * mwu_exact_sf(size1, size2)[statistic]
+        pvalue = flat_pvalue.reshape(np.shape(u))
+    pvalue = np.clip(pvalue, 0., 1.)
+    return np.where((n1 > 0) & (n2 > 0), pvalue, np.nan)
+
+
+@instrumented('utils')
+def fast_mwu_test(data, comp):
+    """
+    Perform MannWhitneyU test for two datasets and return pvalue. This gives the same result as mwu_test but ranks
+    the data once through per-level counts and reuses cached exact distributions, so it is much cheaper to call
+    many times. It can be passed as p_test to get_stats_comparison and is evaluated for all subgroups and codes at
+    once by maclime.analysis.compare_subgroups through its counts_test attribute.
+    :param data: The data
+    :param comp: The comparison data
+    :return: The p-value
+    """
+    data = np.asarray(data, dtype=np.float64)
+    comp = np.asarray(comp, dtype=np.float64)
+    data = data[~np.isnan(data)]
+    comp = comp[~np.isnan(comp)]
+    if not len(data) or not len(comp):
+        return None
+    levels, inverse = np.unique(np.concatenate([data, comp]), return_inverse=True)
+    counts = np.bincount(inverse[:len(data)], minlength=len(levels))
+    comp_counts = np.bincount(inverse[len(data):], minlength=len(levels))
+    return float(mwu_test_counts(counts, comp_counts))
+
+
+fast_mwu_test.counts_test = mwu_test_counts
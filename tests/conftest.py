@@ -0,0 +1,39 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+Fixtures shared by the tests. Tests run on a small synthetic survey from maclime.synthetic, made the current survey
+for the duration of each test.
+"""
+
+import pytest
+
+from maclime import synthetic
+from maclime.config import Survey, use_survey
+
+# Scores of the answers of the synthetic scales used by the tests.
+SCORES = {
+    'impact': dict(zip(synthetic.SCALES['impact'], [-2, -1, 0, 1, 2])),
+    'frequency': dict(zip(synthetic.SCALES['frequency'], [0, 1, 2, 3, 4])),
+    'continuum': dict(zip(synthetic.SCALES['continuum'], [0, 1, 2, 3, 4])),
+}
+
+
+def value_dict(code):
+    """
+    Returns the value dictionary of a code of the default synthetic survey.
+    :param code: The question code
+    :return: A dictionary mapping answers to scores
+    """
+    scale = synthetic.DEFAULT_CODES.get(code)
+    return SCORES.get(scale, {})
+
+
+@pytest.fixture
+def survey():
+    survey = synthetic.load_survey(*synthetic.generate_survey(300, seed=0), survey=Survey())
+    survey.set_value_dict_callback(value_dict)
+    survey.set_population(1000)
+    with use_survey(survey):
+        yield survey
@@ -0,0 +1,49 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+Tests of appending responses to a survey, which extends the caches derived from the results file.
+"""
+
+import numpy as np
+
+from maclime import config, synthetic
+from maclime.config import Survey, use_survey
+from maclime.frequencies import encode_responses
+from maclime.scoring import count_score_levels, get_score_column, get_score_matrix
+
+from conftest import value_dict
+
+CODES = ['AE6(SQ001)', 'MH0(SQ001)', 'MH2']
+
+
+def test_hooks_run_in_order_of_priority(survey, monkeypatch):
+    calls = []
+    monkeypatch.setitem(config._APPEND_HOOKS, 'test_late', (5, lambda *_: calls.append('late')))
+    monkeypatch.setitem(config._APPEND_HOOKS, 'test_early', (-5, lambda *_: calls.append('early')))
+    survey.get_cache('test_late')
+    survey.get_cache('test_early')
+    results, _ = synthetic.generate_survey(5, seed=1)
+    survey.append_results_frame(results.set_axis(results.index + 10 ** 6))
+    assert calls == ['early', 'late']
+
+
+def test_appended_caches_match_rebuilt_caches():
+    results, statistics = synthetic.generate_survey(300, seed=2)
+    survey = synthetic.load_survey(results.iloc[:250], statistics, survey=Survey())
+    survey.set_value_dict_callback(value_dict)
+    with use_survey(survey):
+        # Build the score matrix first, so its hook depends on the hooks of the caches it is built from.
+        get_score_matrix(CODES)
+        for code in CODES:
+            get_score_column(code)
+            encode_responses(code)
+        count_score_levels(CODES, np.ones((1, 250), dtype=bool))
+        survey.append_results_frame(results.iloc[250:])
+        appended = get_score_matrix(CODES), count_score_levels(CODES, np.ones((1, 300), dtype=bool))
+        survey.invalidate()
+        rebuilt = get_score_matrix(CODES), count_score_levels(CODES, np.ones((1, 300), dtype=bool))
+    np.testing.assert_array_equal(appended[0], rebuilt[0])
+    np.testing.assert_array_equal(appended[1][0], rebuilt[1][0])
+    np.testing.assert_array_equal(appended[1][1], rebuilt[1][1])
@@ -0,0 +1,55 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+Tests of the on-disk cache of maclime.cache.
+"""
+
+import os
+import pickle
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from maclime.cache import load_or_build
+
+
+def test_entries_are_built_once(tmp_path):
+    calls = []
+
+    def build():
+        calls.append(1)
+        return {'value': 1}
+
+    assert load_or_build(str(tmp_path), 'key', build) == {'value': 1}
+    assert load_or_build(str(tmp_path), 'key', build) == {'value': 1}
+    assert len(calls) == 1
+
+
+def test_damaged_entries_are_rebuilt(tmp_path):
+    frame = pd.DataFrame({'a': np.arange(20.0), 'b': list('xy') * 10})
+    pickled = pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)
+    rng = random.Random(0)
+    path = os.path.join(str(tmp_path), 'key.pkl')
+    for _ in range(100):
+        damaged = bytearray(pickled)
+        for _ in range(3):
+            damaged[rng.randrange(len(damaged))] = rng.randrange(256)
+        with open(path, 'wb') as file:
+            file.write(bytes(damaged))
+        load_or_build(str(tmp_path), 'key', lambda: frame)
+    with open(path, 'wb') as file:
+        file.write(pickled[:len(pickled) // 2])
+    assert load_or_build(str(tmp_path), 'key', lambda: frame).equals(frame)
+
+
+def test_builder_errors_are_raised(tmp_path):
+    def build():
+        raise RuntimeError("broken builder")
+
+    with pytest.raises(RuntimeError):
+        load_or_build(str(tmp_path), 'key', build)
+    assert not os.listdir(str(tmp_path))
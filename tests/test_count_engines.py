@@ -0,0 +1,146 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+Tests of the statistics computed from per-level counts against the list based functions of maclime.utils and the
+tests of scipy.stats, on random level data.
+"""
+
+import numpy as np
+import pytest
+from scipy import stats
+
+from maclime.bootstrap import Bootstrap, bootstrap_from_counts
+from maclime.config import get_survey
+from maclime.include_arrays import IncludeSet
+from maclime.permutation import PermutationTest
+from maclime.scoring import count_score_levels
+from maclime.utils import (confidence_interval_from_counts, fast_mwu_test, get_confidence_interval, get_level_counts,
+                           mean_from_counts, mwu_test, mwu_test_counts, standard_error, standard_error_from_counts)
+
+from conftest import value_dict
+
+LEVELS = np.array([-2., -1., 0., 1., 2.])
+
+
+def random_samples(seed, count=60, sizes=(1, 40)):
+    """
+    Returns pairs of random samples of the levels, with sizes small enough to use both the exact and the normal
+    Mann-Whitney U tests.
+    :param seed: The seed
+    :param count: The number of pairs
+    :param sizes: The smallest and largest sample size
+    :return: A list of pairs of arrays
+    """
+    rng = np.random.default_rng(seed)
+    samples = []
+    for _ in range(count):
+        weights = rng.dirichlet(np.ones(len(LEVELS)))
+        comp_weights = rng.dirichlet(np.ones(len(LEVELS)))
+        samples.append((rng.choice(LEVELS, rng.integers(*sizes), p=weights),
+                        rng.choice(LEVELS, rng.integers(*sizes), p=comp_weights)))
+    return samples
+
+
+def counts_of(sample):
+    return get_level_counts(sample, LEVELS)[1]
+
+
+def test_mwu_test_counts_matches_mwu_test():
+    for data, comp in random_samples(0):
+        expected = mwu_test(list(data), list(comp))
+        assert float(mwu_test_counts(counts_of(data), counts_of(comp))) == pytest.approx(expected, rel=1e-9)
+        assert fast_mwu_test(data, comp) == pytest.approx(expected, rel=1e-9)
+
+
+def test_mwu_test_counts_tests_every_element():
+    samples = random_samples(1, count=12)
+    counts = np.array([counts_of(data) for data, _ in samples]).reshape(3, 4, -1)
+    comp_counts = np.array([counts_of(comp) for _, comp in samples]).reshape(3, 4, -1)
+    expected = np.array([mwu_test(list(data), list(comp)) for data, comp in samples]).reshape(3, 4)
+    np.testing.assert_allclose(mwu_test_counts(counts, comp_counts), expected, rtol=1e-9)
+
+
+def test_count_statistics_match_lists(survey):
+    zscore = survey.get_zscore()
+    population = survey.get_population()
+    for data, _ in random_samples(2, sizes=(1, 200)):
+        counts = counts_of(data)
+        lower, median, upper = confidence_interval_from_counts(LEVELS, counts, zscore, population)
+        assert (float(lower), float(median), float(upper)) == pytest.approx(get_confidence_interval(list(data)))
+        assert float(standard_error_from_counts(LEVELS, counts)) == pytest.approx(standard_error(list(data)),
+                                                                                  nan_ok=True)
+        assert float(mean_from_counts(LEVELS, counts)) == pytest.approx(np.mean(data))
+    lower, median, upper = confidence_interval_from_counts(LEVELS, np.zeros(len(LEVELS)), zscore, population)
+    assert np.isnan(lower) and np.isnan(median) and np.isnan(upper)
+
+
+def test_count_score_levels_matches_scored_answers(survey):
+    codes = ['AE6(SQ001)', 'AE6(SQ002)', 'MH0(SQ001)', 'MH2']
+    rng = np.random.default_rng(3)
+    results = get_survey().get_results_file()
+    masks = rng.random((4, len(results.index))) < [[0.], [0.1], [0.5], [1.]]
+    levels, counts = count_score_levels(codes, masks)
+    for g, mask in enumerate(masks):
+        for c, code in enumerate(codes):
+            scores = results[code][mask].map(value_dict(code)).dropna().to_numpy(dtype=np.float64)
+            np.testing.assert_array_equal(counts[g, c], get_level_counts(scores, levels)[1])
+    include = IncludeSet.from_ids(results.index[masks[1]], results.index)
+    assert count_score_levels(codes, include.mask[None, :])[1].tolist() == counts[1:2].tolist()
+
+
+def test_permutation_counts_test_matches_scipy():
+    test = PermutationTest(permutations=20000, seed=4, confidence=None)
+    samples = random_samples(4, count=8, sizes=(5, 40))
+    counts = np.array([counts_of(data) for data, _ in samples])
+    comp_counts = np.array([counts_of(comp) for _, comp in samples])
+    pvalues = test.counts_test(counts, comp_counts, LEVELS)
+    for (data, comp), pvalue in zip(samples, pvalues):
+        # PermutationTest is two-sided on the absolute difference in means, where scipy doubles the smaller tail.
+        expected = stats.permutation_test((data, comp), lambda x, y: abs(np.mean(x) - np.mean(y)), n_resamples=20000,
+                                          alternative='greater', rng=np.random.default_rng(5)).pvalue
+        # Both p-values are estimates from 20000 permutations, whose standard error is at most 0.0035.
+        assert pvalue == pytest.approx(expected, abs=0.025)
+        assert test(data, comp) == pytest.approx(expected, abs=0.025)
+
+
+def test_bootstrap_from_counts_matches_scipy():
+    for data, _ in random_samples(6, count=6, sizes=(30, 200)):
+        for statistic, function in (('mean', np.mean), ('median', np.median)):
+            for method in ('percentile', 'bca'):
+                lower, estimate, upper = bootstrap_from_counts(LEVELS, counts_of(data), statistic, method,
+                                                               resamples=5000, rng=np.random.default_rng(7))
+                assert float(estimate) == pytest.approx(function(data))
+                if method == 'bca' and statistic == 'median':
+                    # scipy's jackknife over respondents is not defined for medians of data with this many ties.
+                    continue
+                expected = stats.bootstrap((data,), function, n_resamples=5000, method=method,
+                                           rng=np.random.default_rng(8)).confidence_interval
+                spread = np.ptp(LEVELS) / np.sqrt(len(data))
+                assert float(lower) == pytest.approx(expected.low, abs=0.2 * spread)
+                assert float(upper) == pytest.approx(expected.high, abs=0.2 * spread)
+
+
+def test_seeded_tests_are_reproducible():
+    samples = random_samples(9, count=6, sizes=(5, 40))
+    counts = np.array([counts_of(data) for data, _ in samples])
+    comp_counts = np.array([counts_of(comp) for _, comp in samples])
+    first = PermutationTest(permutations=2000, seed=10)
+    second = PermutationTest(permutations=2000, seed=10)
+    expected = first.counts_test(counts, comp_counts)
+    # Other tests drawn in between do not change the random numbers of a test.
+    first(*samples[0])
+    np.testing.assert_array_equal(first.counts_test(counts, comp_counts), expected)
+    np.testing.assert_array_equal(second.counts_test(counts, comp_counts), expected)
+    assert first(*samples[1]) == second(*samples[1])
+    assert not np.array_equal(PermutationTest(permutations=2000, seed=11).counts_test(counts, comp_counts), expected)
+
+    first = Bootstrap(resamples=500, confidence=0.95, seed=10)
+    second = Bootstrap(resamples=500, confidence=0.95, seed=10)
+    expected = first.counts_interval(LEVELS, counts)
+    first(samples[0][0])
+    for result in (first.counts_interval(LEVELS, counts), second.counts_interval(LEVELS, counts)):
+        for array, expected_array in zip(result, expected):
+            np.testing.assert_array_equal(array, expected_array)
+    assert first(samples[1][0]) == second(samples[1][0])
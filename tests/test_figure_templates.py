@@ -0,0 +1,30 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+Tests of the template mode of the example figure callbacks.
+"""
+
+import os
+
+import matplotlib
+matplotlib.use('Agg')
+
+from example.mhw_spring_2023 import get_stats_comparison, get_value_dict, make_histo, plot_impact_statistics
+from maclime.figures import FigureTemplate
+from maclime.include_arrays import get_include_array
+
+AE6 = ['AE6(SQ{:03d})'.format(i) for i in range(1, 11)]
+
+
+def test_templates_write_one_file_per_callback(survey, tmp_path):
+    survey.set_value_dict_callback(get_value_dict)
+    template = FigureTemplate(str(tmp_path))
+    frame = get_stats_comparison(AE6, get_include_array('PI1', 'Yes'), "AE6", "yes")
+    for complement in (False, True):
+        make_histo(frame, "AE6", "yes", complement=complement, template=template)
+        plot_impact_statistics(frame, complement, "AE6", "yes", x_labels=['AE6'] * len(AE6), template=template)
+    assert sorted(os.listdir(tmp_path)) == ['AE6_yes_histo.png', 'AE6_yes_histo_comp.png',
+                                            'AE6_yes_impact.png', 'AE6_yes_impact_comp.png']
+    assert len(template) == 2
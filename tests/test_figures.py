@@ -0,0 +1,38 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+Tests of the headless figure rendering of maclime.figures.
+"""
+
+import os
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+
+from maclime.figures import figure_filename, render_figure
+
+
+def _bar_chart(title, complement=False):
+    plt.clf()
+    plt.bar([0, 1], [1, 2])
+    plt.title(title)
+
+
+def test_render_figure_keeps_open_figures(tmp_path):
+    figure = plt.figure()
+    figure.add_subplot().plot([0, 1])
+    paths = render_figure(_bar_chart, str(tmp_path / "chart"), title="chart")
+    assert paths == [str(tmp_path / "chart.png")]
+    assert os.path.exists(paths[0])
+    assert plt.get_fignums() == [figure.number]
+    assert len(figure.axes[0].lines) == 1
+    plt.close(figure)
+
+
+def test_figure_filename():
+    assert figure_filename("AE6", "grads") == "AE6_grads"
+    assert figure_filename("A/B: c", None) == "A_B_ c"
+    assert figure_filename("", "") == "figure"
@@ -0,0 +1,31 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+Tests of the answer frequencies of maclime.frequencies.
+"""
+
+from maclime.frequencies import get_frequencies
+from maclime.include_arrays import IncludeSet, get_include_array
+
+
+def test_frequencies_of_all_respondents(survey):
+    answers, counts, percentages = get_frequencies('MH2')
+    results = survey.get_results_file()
+    for answer, count in zip(answers, counts):
+        if answer in set(results['MH2'].dropna()):
+            assert count == (results['MH2'] == answer).sum()
+
+
+def test_empty_include_gives_zero_counts(survey):
+    empty = IncludeSet.from_ids([], survey.get_results_file().index)
+    answers, counts, percentages = get_frequencies('MH2', empty)
+    assert len(answers) > 0
+    assert all(count in (0, None) for count in counts)
+
+
+def test_include_counts_only_its_respondents(survey):
+    include = get_include_array('PI1', 'Yes')
+    _, counts, _ = get_frequencies('PI1', include)
+    assert counts[0] == len(include)
@@ -0,0 +1,25 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+Tests of the include expressions of maclime.include_expressions.
+"""
+
+from maclime.include_expressions import compile_include, evaluate_include, format_value
+
+ALIASES = {'yes': 'Yes', 'Yes': 'No'}
+
+
+def test_aliases_replace_bare_words_only():
+    assert compile_include("PI1 == yes", ALIASES) == ('in', 'PI1', ('Yes',))
+    assert compile_include("PI1 == 'yes'", ALIASES) == ('in', 'PI1', ('yes',))
+    assert compile_include("PI1 in {Yes, 'Yes'}", ALIASES) == ('in', 'PI1', ('No', 'Yes'))
+
+
+def test_formatted_values_are_not_aliased(survey):
+    # An answer written back with format_value keeps its meaning even when it is also the name of an alias.
+    expression = "PI1 == " + format_value('Yes')
+    assert compile_include(expression, ALIASES) == ('in', 'PI1', ('Yes',))
+    results = survey.get_results_file()
+    assert len(evaluate_include(expression, ALIASES)) == int((results['PI1'] == 'Yes').sum())
@@ -0,0 +1,77 @@
+"""
+Created on October 17, 2026
+
+@author: Devin Burke
+
+Tests of the job graph of maclime.analysis, which skips jobs whose inputs did not change.
+"""
+
+import importlib
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from maclime.analysis import JobGraph, callable_identity, compare_subgroups, fingerprint_value
+from maclime.include_arrays import get_include_array
+
+MH0 = ['MH0(SQ{:03d})'.format(i) for i in range(1, 6)]
+
+
+def _stats(include, include_other, codes):
+    return compare_subgroups({'include': include}, codes, include_other=include_other)
+
+
+def test_unchanged_jobs_are_skipped(survey, tmp_path):
+    includes = {'yes': get_include_array('PI1', 'Yes'), 'no': get_include_array('PI1', 'No')}
+
+    def run(includes):
+        graph = JobGraph(str(tmp_path))
+        for name, include in includes.items():
+            graph.add(name, include, _stats, {'codes': MH0})
+        return graph, graph.run()
+
+    graph, first = run(includes)
+    assert graph.built == ['yes', 'no']
+    graph, second = run(includes)
+    assert graph.skipped == ['yes', 'no']
+    assert second['yes'].equals(first['yes'])
+    includes['no'] = get_include_array('PI2', 'No')
+    graph, _ = run(includes)
+    assert graph.built == ['no'] and graph.skipped == ['yes']
+
+
+def test_callable_identity_follows_helpers(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / 'job_helpers.py').write_text("def helper():\n    return 1\n")
+    (tmp_path / 'job_callback.py').write_text("import job_helpers\n\n\ndef callback():\n"
+                                              "    return job_helpers.helper()\n")
+    try:
+        callback = importlib.import_module('job_callback').callback
+        identity = callable_identity(callback)
+        assert callable_identity(callback) == identity
+        (tmp_path / 'job_helpers.py').write_text("def helper():\n    return 22\n")
+        assert callable_identity(callback) != identity
+    finally:
+        sys.modules.pop('job_callback', None)
+        sys.modules.pop('job_helpers', None)
+
+
+class _Slots:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def test_fingerprints_do_not_depend_on_memory_addresses():
+    assert fingerprint_value(_Slots(1)) == fingerprint_value(_Slots(1))
+    assert fingerprint_value(_Slots(1)) != fingerprint_value(_Slots(2))
+    assert fingerprint_value(len) == fingerprint_value(len)
+    assert fingerprint_value(np.sqrt) != fingerprint_value(np.exp)
+
+
+def test_unpicklable_arguments_are_rejected():
+    with pytest.raises(TypeError):
+        fingerprint_value(threading.Lock())